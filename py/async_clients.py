@@ -0,0 +1,173 @@
+# async_clients.py - asyncio clients for Gemini and Custom Search with per-provider limits
+import asyncio
+import os
+import time
+import backoff
+from llm_clients import client_registry, is_retryable_error
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+# Requests per minute allowed by our Gemini quota; the burst is how many may go out back to back
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "8"))
+SEARCH_RPM = float(os.getenv("SEARCH_RPM", "100"))
+SEARCH_BURST = int(os.getenv("SEARCH_BURST", "5"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+ASYNC_MAX_TRIES = int(os.getenv("ASYNC_MAX_TRIES", "5"))
+ASYNC_MAX_RETRY_TIME = float(os.getenv("ASYNC_MAX_RETRY_TIME", "30"))
+
+CUSTOM_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+
+class TokenBucket:
+    """Token bucket refilled at rate_per_minute; acquire() waits without blocking the loop"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class ProviderLimiter:
+    """Concurrency cap plus request-rate cap for one upstream provider"""
+
+    def __init__(self, name, max_concurrency, rate_per_minute, burst):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.total = 0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self.in_flight += 1
+        self.total += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate_per_minute": self.bucket.rate * 60,
+            "in_flight": self.in_flight,
+            "requests": self.total,
+        }
+
+def retry_async(giveup):
+    """Exponential backoff for coroutines - sleeps with asyncio.sleep, never on the loop thread"""
+    return backoff.on_exception(
+        backoff.expo,
+        Exception,
+        giveup=giveup,
+        max_tries=ASYNC_MAX_TRIES,
+        max_time=ASYNC_MAX_RETRY_TIME
+    )
+
+class AsyncGeminiClient:
+    """generate_content_async through the response cache and the Gemini limiter"""
+
+    def __init__(self, cache, limiter=None):
+        self.cache = cache
+        self.limiter = limiter or ProviderLimiter("gemini", GEMINI_MAX_CONCURRENCY, GEMINI_RPM, GEMINI_BURST)
+
+    @retry_async(giveup=lambda e: not is_retryable_error(e))
+    async def _generate(self, model, prompt, stream=False):
+        async with self.limiter:
+            return await model.generate_content_async(prompt, stream=stream)
+
+    async def generate(self, prompt, model_name, system_instruction=None, generation_config=None):
+        cached = self.cache.get(prompt, model_name, system_instruction, generation_config)
+        if cached is not None:
+            return cached
+
+        model = client_registry.get_model(model_name, system_instruction, generation_config)
+        response = await self._generate(model, prompt)
+        text = response.text
+
+        self.cache.set(prompt, model_name, text, system_instruction, generation_config)
+        return text
+
+    async def stream(self, prompt, model_name, system_instruction=None, generation_config=None):
+        """Yield response chunks; only opening the stream is retried, never a partial answer"""
+        cached = self.cache.get(prompt, model_name, system_instruction, generation_config)
+        if cached is not None:
+            yield cached
+            return
+
+        model = client_registry.get_model(model_name, system_instruction, generation_config)
+        response = await self._generate(model, prompt, stream=True)
+
+        parts = []
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield text
+
+        self.cache.set(prompt, model_name, "".join(parts), system_instruction, generation_config)
+
+def is_retryable_http_error(error):
+    """Rate limiting, server errors and dropped connections are worth retrying"""
+    import httpx
+
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+class AsyncSearchClient:
+    """Custom Search JSON API over a pooled httpx.AsyncClient"""
+
+    def __init__(self, api_key, limiter=None):
+        self.api_key = api_key
+        self.limiter = limiter or ProviderLimiter("search", SEARCH_MAX_CONCURRENCY, SEARCH_RPM, SEARCH_BURST)
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            # httpx is only needed once the async search path is used
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=SEARCH_TIMEOUT,
+                limits=httpx.Limits(max_connections=SEARCH_MAX_CONCURRENCY)
+            )
+        return self._client
+
+    @retry_async(giveup=lambda e: not is_retryable_http_error(e))
+    async def list(self, q, cx, num):
+        """Same response body as service.cse().list(...).execute()"""
+        async with self.limiter:
+            response = await self._http().get(
+                CUSTOM_SEARCH_URL,
+                params={"key": self.api_key, "cx": cx, "q": q, "num": num}
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,185 @@
+# batch_ocr.py - multi-page OCR: PDFs and image sets fanned out over a process pool
+import asyncio
+import io
+import multiprocessing
+import os
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+load_dotenv()
+
+BATCH_OCR_WORKERS = int(os.getenv("BATCH_OCR_WORKERS", str(os.cpu_count() or 1)))
+BATCH_OCR_MAX_PAGES = int(os.getenv("BATCH_OCR_MAX_PAGES", "50"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+
+class PageLimitError(ValueError):
+    """Upload has more pages than BATCH_OCR_MAX_PAGES"""
+
+def is_pdf(data: bytes) -> bool:
+    return data[:5] == b"%PDF-"
+
+def pdf_page_count(pdf_source) -> int:
+    document = pdfium.PdfDocument(pdf_source)
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+def render_pdf_page(pdf_source, page_index: int, dpi: int = PDF_RENDER_DPI) -> bytes:
+    """Rasterize one PDF page to PNG bytes; pdf_source is a path or the PDF bytes"""
+    document = pdfium.PdfDocument(pdf_source)
+    try:
+        page = document[page_index]
+        image = page.render(scale=dpi / 72).to_pil()
+    finally:
+        document.close()
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def ocr_page(page_number, data, pdf_page_index=None, dpi=PDF_RENDER_DPI):
+    """OCR one page in a worker process - PDF pages are rasterized there too.
+
+    For PDF pages data is the path of the spooled PDF, so only a path crosses
+    the process boundary and pdfium loads just the page it renders.
+    """
+    from enhanced_ocr import enhanced_ocr
+
+    # Pages are already spread over the pool; don't fan regions out again
+    enhanced_ocr.region_parallel = False
+
+    try:
+        image_bytes = render_pdf_page(data, pdf_page_index, dpi) if pdf_page_index is not None else data
+        result = enhanced_ocr.extract_text(io.BytesIO(image_bytes))
+    except Exception as e:
+        result = {"text": f"OCR Error: {e}", "format": "plain", "source": "failed", "confidence": 0}
+
+    return {
+        "page": page_number,
+        "text": result.get("text", "").strip(),
+        "confidence": result.get("confidence", 0),
+        "source": result.get("source", ""),
+        "lab_values": result.get("lab_values", []),
+        "cache_hit": result.get("cache_hit", False)
+    }
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+class PageTasks(list):
+    """Page tasks of one upload; its spooled PDFs are deleted by cleanup() or with the list"""
+
+    def __init__(self):
+        super().__init__()
+        self.temp_paths = []
+        self._finalizer = weakref.finalize(self, _remove_files, self.temp_paths)
+
+    def spool(self, data: bytes) -> str:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(data)
+        self.temp_paths.append(tmp.name)
+        return tmp.name
+
+    def cleanup(self):
+        self._finalizer()
+
+class BatchOCR:
+    """Process pool of EnhancedOCR workers; every page is an independent task"""
+
+    def __init__(self, workers=BATCH_OCR_WORKERS, max_pages=BATCH_OCR_MAX_PAGES):
+        self.workers = max(1, workers)
+        self.max_pages = max_pages
+        self._executor = None
+
+    def _pool(self):
+        # Workers are spawned on first use so the API process starts fast
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def expand_pages(self, documents):
+        """Turn uploaded documents (bytes) into page tasks: (page_number, data, pdf_page_index).
+
+        Blocking (PDFs are parsed and spooled to disk) - call it on an executor.
+        A PDF page's data is the path of its spooled file.
+        """
+        pages = PageTasks()
+        try:
+            for data in documents:
+                if is_pdf(data):
+                    if pdfium is None:
+                        raise ValueError("PDF support requires pypdfium2 - pip install pypdfium2")
+                    try:
+                        page_count = pdf_page_count(data)
+                    except Exception as e:
+                        raise ValueError(f"Could not read PDF: {e}")
+                    if len(pages) + page_count > self.max_pages:
+                        raise PageLimitError(f"Too many pages - the limit is {self.max_pages}")
+                    path = pages.spool(data)
+                    for index in range(page_count):
+                        pages.append((len(pages) + 1, path, index))
+                else:
+                    pages.append((len(pages) + 1, data, None))
+
+                if len(pages) > self.max_pages:
+                    raise PageLimitError(f"Too many pages - the limit is {self.max_pages}")
+        except Exception:
+            pages.cleanup()
+            raise
+        return pages
+
+    async def iter_pages(self, pages):
+        """Yield page results as they complete (not in page order)"""
+        loop = asyncio.get_running_loop()
+        executor = self._pool()
+        futures = [
+            loop.run_in_executor(executor, ocr_page, page_number, data, pdf_page_index)
+            for page_number, data, pdf_page_index in pages
+        ]
+        try:
+            for finished in asyncio.as_completed(futures):
+                yield await finished
+        finally:
+            for future in futures:
+                future.cancel()
+            if isinstance(pages, PageTasks):
+                pages.cleanup()
+
+    @staticmethod
+    def combine(page_results):
+        """Pages in order, joined text, every page's lab values and mean confidence"""
+        ordered = sorted(page_results, key=lambda page: page["page"])
+        confidences = [page["confidence"] for page in ordered]
+        return {
+            "pages": ordered,
+            "page_count": len(ordered),
+            "text": "\n\n".join(
+                f"--- Page {page['page']} ---\n{page['text']}" for page in ordered
+            ),
+            "lab_values": [
+                dict(record, page=page["page"]) for page in ordered for record in page.get("lab_values", [])
+            ],
+            "average_confidence": sum(confidences) / len(confidences) if confidences else 0.0
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Global instance
+batch_ocr = BatchOCR()
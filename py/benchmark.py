@@ -0,0 +1,836 @@
+# benchmark.py - offline benchmarks for OCR, transcription and the full workflow
+#
+#   python benchmark.py corpus                     # generate the synthetic corpus (once)
+#   python benchmark.py run --output bench.json    # every suite and engine configuration
+#   python benchmark.py run --suite ocr --env OCR_TARGET_TEXT_HEIGHT=32 --output taller.json
+#   python benchmark.py compare bench.json taller.json
+#
+# Each configuration runs in its own process (settings are read from the environment at
+# import, and peak RSS is per process) with every result cache disabled. Gemini and
+# Custom Search are replaced by deterministic local stubs, so runs need no network.
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+from log import get_logger
+
+load_dotenv()
+
+logger = get_logger("benchmark")
+
+BENCH_CORPUS_DIR = os.getenv("BENCH_CORPUS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_corpus"))
+# Seconds each stubbed Gemini / search call takes; 0 measures only our own code
+BENCH_STUB_LATENCY = float(os.getenv("BENCH_STUB_LATENCY", "0"))
+BENCH_WORKER_TIMEOUT = float(os.getenv("BENCH_WORKER_TIMEOUT", "3600"))
+
+# Bump when the generated corpus changes - results are only comparable on the same corpus
+CORPUS_VERSION = 1
+CORPUS_SEED = 20240601
+RESULTS_SCHEMA = 1
+SAMPLE_RATE = 16000
+
+SUITES = ("ocr", "speech", "workflow")
+
+# Environment shared by every configuration: no caches, no network, quiet logs
+BENCH_BASE_ENV = {
+    "RESULT_CACHE_MAX_BYTES": "0",
+    "RESULT_CACHE_DIR": "",
+    "LLM_CACHE_ENABLED": "0",
+    "SEARCH_CACHE_ENABLED": "0",
+    "OCR_SPACE_API_KEY": "",
+    "GEMINI_API_KEY": "bench-stub",
+    "GOOGLE_API_KEY": "bench-stub",
+    "PROGRAMMABLE_SEARCH_ENGINE_ID": "bench-stub",
+    # Quota limits exist for the real APIs; against the stubs they would only measure the token bucket
+    "GEMINI_RPM": "1000000",
+    "GEMINI_BURST": "1000",
+    "SEARCH_RPM": "1000000",
+    "SEARCH_BURST": "1000",
+    "WARMUP_ON_STARTUP": "0",
+    "METRICS_ENABLED": "1",
+    "OTEL_TRACING": "0",
+    "LOG_LEVEL": "WARNING",
+}
+
+CONFIGS = {
+    "ocr": {
+        "single_pass": {"OCR_ENGINE_MODE": "single_pass"},
+        "multi_pass": {"OCR_ENGINE_MODE": "multi_pass"},
+        "legacy_preprocess": {"OCR_PREPROCESS_MODE": "legacy"},
+        "regions": {"OCR_REGION_MODE": "always", "OCR_REGION_WORKERS": "2"},
+    },
+    "speech": {
+        "base_beam5": {"WHISPER_MODEL_SIZE": "base", "WHISPER_BEAM_SIZE": "5"},
+        "base_beam1": {"WHISPER_MODEL_SIZE": "base", "WHISPER_BEAM_SIZE": "1"},
+        "tiny_beam1": {"WHISPER_MODEL_SIZE": "tiny", "WHISPER_BEAM_SIZE": "1"},
+    },
+    "workflow": {
+        "single_call": {"WORKFLOW_ANALYSIS_MODE": "single_call"},
+        "multi_call": {"WORKFLOW_ANALYSIS_MODE": "multi_call"},
+    },
+}
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+# (test, unit, low, high, decimals)
+REPORT_TESTS = [
+    ("Hemoglobin", "g/dL", 12.0, 15.5, 1),
+    ("RBC Count", "million/uL", 4.2, 5.4, 2),
+    ("WBC Count", "cells/uL", 4000, 11000, 0),
+    ("Platelet Count", "lakh/uL", 1.5, 4.5, 1),
+    ("Hematocrit", "%", 36.0, 46.0, 1),
+    ("MCV", "fL", 80.0, 100.0, 1),
+    ("Fasting Glucose", "mg/dL", 70, 100, 0),
+    ("HbA1c", "%", 4.0, 5.6, 1),
+    ("Total Cholesterol", "mg/dL", 125, 200, 0),
+    ("HDL Cholesterol", "mg/dL", 40, 60, 0),
+    ("Triglycerides", "mg/dL", 50, 150, 0),
+    ("Creatinine", "mg/dL", 0.6, 1.2, 2),
+    ("Sodium", "mmol/L", 135, 145, 0),
+    ("Potassium", "mmol/L", 3.5, 5.1, 1),
+]
+
+REPORT_PATIENTS = [
+    ("Anita Sharma", 42, "F"),
+    ("Rahul Verma", 57, "M"),
+    ("Maria Lopez", 35, "F"),
+]
+
+DICTATIONS = [
+    "The patient reports fatigue and shortness of breath for the past two weeks.",
+    "She has a history of type two diabetes and takes metformin twice daily.",
+    "Blood pressure is one hundred forty over ninety and the pulse is regular.",
+    "Please repeat the complete blood count and check the cholesterol in three months.",
+]
+
+IMAGE_VARIANTS = ("clean", "skewed", "noisy", "lowres")
+AUDIO_VARIANTS = ("clean", "noisy", "fast")
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+def _format_value(value, decimals):
+    return f"{value:.{decimals}f}"
+
+def report_lines(rng, patient):
+    """Lines of one lab report and the lab values printed on it"""
+    name, age, sex = patient
+    lines = [
+        "CITY DIAGNOSTIC LABORATORY",
+        f"Patient: {name}   Age: {age}   Sex: {sex}",
+        f"Sample ID: {rng.randint(100000, 999999)}   Collected: 2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        "Test   Result   Unit   Reference Range",
+    ]
+    expected = []
+    for test, unit, low, high, decimals in rng.sample(REPORT_TESTS, 10):
+        # Mostly in range, sometimes just outside it so flags are exercised
+        span = high - low
+        value = round(rng.uniform(low - 0.15 * span, high + 0.15 * span), decimals)
+        lines.append(f"{test}   {_format_value(value, decimals)}   {unit}   "
+                     f"{_format_value(low, decimals)} - {_format_value(high, decimals)}")
+        expected.append({"test": test, "value": value})
+    lines.append("Remarks: Correlate clinically.")
+    return lines, expected
+
+def _load_font(size):
+    from PIL import ImageFont
+
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size), os.path.basename(path)
+    return ImageFont.load_default(size=size), "default"
+
+def render_report(lines, font_size=22):
+    """White A4-ish page at 150 dpi with the report lines in one column"""
+    from PIL import Image, ImageDraw
+
+    font, font_name = _load_font(font_size)
+    line_height = int(font_size * 1.6)
+    image = Image.new("L", (1240, 120 + line_height * len(lines)), 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(lines):
+        draw.text((70, 60 + index * line_height), line, fill=0, font=font)
+    return image, font_name
+
+def image_variant(image, variant, rng):
+    """(encoded bytes, extension) of a degraded copy of a clean page"""
+    from PIL import Image, ImageFilter
+
+    if variant == "skewed":
+        image = image.rotate(rng.uniform(1.5, 3.5), resample=Image.BICUBIC, expand=True, fillcolor=255)
+    elif variant == "noisy":
+        noise = np.random.default_rng(rng.randint(0, 2**32 - 1)).normal(0, 28, (image.height, image.width))
+        pixels = np.asarray(image.filter(ImageFilter.GaussianBlur(0.8)), dtype=np.float32) + noise
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    elif variant == "lowres":
+        image = image.resize((image.width // 2, image.height // 2), Image.BILINEAR)
+
+    buffer = io.BytesIO()
+    if variant == "noisy":
+        # Phone photos arrive as JPEG
+        image.save(buffer, format="JPEG", quality=70)
+        return buffer.getvalue(), "jpg"
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), "png"
+
+def find_tts():
+    for binary in ("espeak-ng", "espeak"):
+        if shutil.which(binary):
+            return binary
+    return None
+
+def synthesize(tts, text, words_per_minute):
+    """Mono float32 samples at 16 kHz from espeak"""
+    import soundfile as sf
+
+    with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
+        subprocess.run([tts, "-v", "en", "-s", str(words_per_minute), "-w", tmp.name, text],
+                       check=True, capture_output=True)
+        samples, rate = sf.read(tmp.name, dtype="float32")
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if rate != SAMPLE_RATE:
+        target_length = int(len(samples) * SAMPLE_RATE / rate)
+        positions = np.linspace(0, len(samples) - 1, num=target_length)
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+def encode_wav(samples):
+    import soundfile as sf
+
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+def add_noise(samples, snr_db, seed):
+    signal_power = float(np.mean(samples ** 2)) or 1e-8
+    noise = np.random.default_rng(seed).normal(0, np.sqrt(signal_power / 10 ** (snr_db / 10)), samples.shape)
+    return np.clip(samples + noise, -1.0, 1.0).astype(np.float32)
+
+def _write_item(corpus_dir, kind, item_id, data, extension, reference, **fields):
+    path = os.path.join(kind, f"{item_id}.{extension}")
+    with open(os.path.join(corpus_dir, path), "wb") as f:
+        f.write(data)
+    return {
+        "id": item_id,
+        "path": path,
+        "reference": reference,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        **fields
+    }
+
+def generate_corpus(corpus_dir=BENCH_CORPUS_DIR):
+    """Write images/, audio/ and manifest.json; the same seed always gives the same corpus"""
+    rng = random.Random(CORPUS_SEED)
+    os.makedirs(os.path.join(corpus_dir, "images"), exist_ok=True)
+    os.makedirs(os.path.join(corpus_dir, "audio"), exist_ok=True)
+
+    images = []
+    font_name = None
+    for index, patient in enumerate(REPORT_PATIENTS):
+        lines, expected = report_lines(rng, patient)
+        page, font_name = render_report(lines)
+        for variant in IMAGE_VARIANTS:
+            data, extension = image_variant(page, variant, rng)
+            images.append(_write_item(corpus_dir, "images", f"report{index + 1}_{variant}", data, extension,
+                                      "\n".join(lines), variant=variant, lab_values=expected))
+
+    # The sample report shipped with the repo; no ground truth, so latency only
+    sample_report = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blood_report.png")
+    if os.path.exists(sample_report):
+        with open(sample_report, "rb") as f:
+            images.append(_write_item(corpus_dir, "images", "blood_report", f.read(), "png", None, variant="sample"))
+
+    audio = []
+    # Always present so the workflow suite has an upload even without a TTS engine
+    audio.append(_write_item(corpus_dir, "audio", "silence_2s", encode_wav(np.zeros(2 * SAMPLE_RATE, dtype=np.float32)),
+                             "wav", None, variant="silence"))
+    tts = find_tts()
+    if tts is None:
+        logger.warning("espeak-ng not found - only the silent clip is generated, speech accuracy is not measured")
+    else:
+        for index, text in enumerate(DICTATIONS):
+            for variant in AUDIO_VARIANTS:
+                samples = synthesize(tts, text, 210 if variant == "fast" else 150)
+                if variant == "noisy":
+                    samples = add_noise(samples, snr_db=15, seed=rng.randint(0, 2**32 - 1))
+                audio.append(_write_item(corpus_dir, "audio", f"dictation{index + 1}_{variant}",
+                                         encode_wav(samples), "wav", text, variant=variant))
+
+    digest = hashlib.sha256()
+    for item in images + audio:
+        digest.update(item["sha256"].encode("ascii"))
+    manifest = {
+        "version": CORPUS_VERSION,
+        "seed": CORPUS_SEED,
+        "digest": digest.hexdigest()[:16],
+        "font": font_name,
+        "tts": tts,
+        "images": images,
+        "audio": audio,
+    }
+    with open(os.path.join(corpus_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_corpus(corpus_dir=BENCH_CORPUS_DIR, regenerate=False):
+    path = os.path.join(corpus_dir, "manifest.json")
+    if not regenerate and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CORPUS_VERSION:
+            return manifest
+    return generate_corpus(corpus_dir)
+
+def read_item(corpus_dir, item):
+    with open(os.path.join(corpus_dir, item["path"]), "rb") as f:
+        return f.read()
+
+# ---------------------------------------------------------------------------
+# Accuracy
+# ---------------------------------------------------------------------------
+
+WORD_PATTERN = re.compile(r"\w+(?:[./]\w+)*")
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two sequences (characters or words)"""
+    if len(reference) < len(hypothesis):
+        reference, hypothesis = hypothesis, reference
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_token in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_token in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_token != hyp_token)
+            ))
+        previous = current
+    return previous[-1]
+
+def normalize_chars(text):
+    return " ".join(text.lower().split())
+
+def normalize_words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+def error_counts(reference, hypothesis):
+    """Character and word edits against the reference, with the reference lengths"""
+    ref_chars, hyp_chars = normalize_chars(reference), normalize_chars(hypothesis or "")
+    ref_words, hyp_words = normalize_words(reference), normalize_words(hypothesis or "")
+    return {
+        "char_edits": edit_distance(ref_chars, hyp_chars),
+        "chars": len(ref_chars),
+        "word_edits": edit_distance(ref_words, hyp_words),
+        "words": len(ref_words),
+    }
+
+def lab_value_hits(expected, extracted):
+    """How many of the printed (test, value) pairs were extracted exactly"""
+    found = {(record["test"], record["value"]) for record in extracted or []}
+    return sum(1 for record in expected if (record["test"], record["value"]) in found)
+
+def accuracy_summary(samples):
+    """Corpus-level CER/WER (total edits / total reference length), overall and per variant"""
+    def rates(group):
+        chars = sum(sample["errors"]["chars"] for sample in group)
+        words = sum(sample["errors"]["words"] for sample in group)
+        return {
+            "cer": round(sum(sample["errors"]["char_edits"] for sample in group) / chars, 4) if chars else None,
+            "wer": round(sum(sample["errors"]["word_edits"] for sample in group) / words, 4) if words else None,
+            "items": len(group),
+        }
+
+    scored = [sample for sample in samples if sample.get("errors")]
+    if not scored:
+        return {"cer": None, "wer": None, "items": 0, "by_variant": {}}
+    by_variant = {}
+    for sample in scored:
+        by_variant.setdefault(sample["variant"], []).append(sample)
+    summary = rates(scored)
+    summary["by_variant"] = {variant: rates(group) for variant, group in sorted(by_variant.items())}
+
+    lab_samples = [sample for sample in scored if "lab_values_expected" in sample]
+    if lab_samples:
+        expected = sum(sample["lab_values_expected"] for sample in lab_samples)
+        summary["lab_value_recall"] = round(sum(sample["lab_values_found"] for sample in lab_samples) / expected, 4)
+    return summary
+
+# ---------------------------------------------------------------------------
+# Local Gemini and Custom Search stubs
+# ---------------------------------------------------------------------------
+
+STUB_ANALYSIS = (
+    "**Key Medical Findings**\n- Hemoglobin is slightly below the reference range.\n"
+    "- Fasting glucose and HbA1c are elevated.\n\n**Recommendations**\n"
+    "- Repeat the complete blood count in three months.\n- Review diabetes management."
+)
+STUB_SUMMARY = (
+    "**Patient Information**: adult patient\n**Key Findings**: mild anemia, raised glucose\n"
+    "**Recommendations**: repeat CBC, review diabetes medication"
+)
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+class StubGeminiModel:
+    """Deterministic stand-in for GenerativeModel with a fixed per-call latency"""
+
+    def __init__(self, system_instruction=None, generation_config=None, latency=BENCH_STUB_LATENCY):
+        self.system_instruction = system_instruction or ""
+        self.generation_config = generation_config or {}
+        self.latency = latency
+
+    def _text(self, prompt):
+        if self.generation_config.get("response_mime_type") == "application/json":
+            return json.dumps({"analysis": STUB_ANALYSIS, "summary": STUB_SUMMARY})
+        if "web search" in self.system_instruction:
+            # Routing call: always search, so the search path is part of the measurement
+            return "anemia elevated glucose treatment"
+        return STUB_ANALYSIS
+
+    async def generate_content_async(self, prompt, stream=False):
+        await asyncio.sleep(self.latency)
+        text = self._text(prompt)
+        if not stream:
+            return StubResponse(text)
+
+        async def chunks():
+            for line in text.splitlines(keepends=True):
+                yield StubResponse(line)
+        return chunks()
+
+def stub_search_response(query, num=5):
+    slug = "-".join(WORD_PATTERN.findall(query.lower())[:4])
+    return {"items": [
+        {
+            "link": f"https://example.org/{slug}/{index}",
+            "title": f"{query[:60]} - source {index}",
+            "snippet": f"Reference information about {query[:80]}. Consult a physician for diagnosis and treatment."
+        }
+        for index in range(1, num + 1)
+    ]}
+
+class StubAsyncSearchClient:
+    """AsyncSearchClient.list without the network"""
+
+    def __init__(self, latency=BENCH_STUB_LATENCY):
+        self.latency = latency
+
+    async def list(self, q, cx=None, num=5):
+        await asyncio.sleep(self.latency)
+        return stub_search_response(q, num)
+
+    async def aclose(self):
+        pass
+
+def install_stubs(latency=BENCH_STUB_LATENCY):
+    """Route every Gemini model and search client in this process to the local stubs"""
+    import utils
+    from llm_clients import client_registry
+
+    client_registry.get_model = lambda model_name, system_instruction=None, generation_config=None: (
+        StubGeminiModel(system_instruction, generation_config, latency)
+    )
+    utils.search_async = StubAsyncSearchClient(latency)
+
+# ---------------------------------------------------------------------------
+# Worker: one suite + configuration in this process
+# ---------------------------------------------------------------------------
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (waited-for) children"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    return round(own, 1), round(children, 1)
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration) / 1000
+    return stages
+
+def latency_summary(seconds):
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    if values.size == 0:
+        return None
+    return {
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "mean": round(float(values.mean()), 2),
+        "min": round(float(values.min()), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+def stage_summary(samples):
+    """p50/p95 per pipeline stage, from the metrics timings of each request"""
+    by_stage = {}
+    for sample in samples:
+        for name, seconds in sample["stages"].items():
+            by_stage.setdefault(name, []).append(seconds)
+    return {name: latency_summary(values) for name, values in sorted(by_stage.items())}
+
+def ocr_task(corpus_dir):
+    from enhanced_ocr import enhanced_ocr
+
+    def run(item):
+        result = enhanced_ocr.extract_text(io.BytesIO(read_item(corpus_dir, item)))
+        if not isinstance(result, dict) or result.get("source") == "failed":
+            return {"hypothesis": "", "error": (result or {}).get("text", "OCR failed")}
+        return {
+            "hypothesis": result.get("text", ""),
+            "error": None,
+            "lab_values": result.get("lab_values", []),
+        }
+
+    return enhanced_ocr.warm_up, run
+
+def speech_task(corpus_dir):
+    from enhanced_speech import enhanced_speech
+
+    def run(item):
+        result = enhanced_speech.transcribe_audio(read_item(corpus_dir, item))
+        failed = result.get("source") == "error"
+        return {"hypothesis": "" if failed else result.get("text", ""), "error": result["text"] if failed else None}
+
+    return enhanced_speech.warm_up, run
+
+def workflow_task(corpus_dir, client):
+    def run(item):
+        audio, image = item["audio"], item["image"]
+        response = client.post(
+            "/full-workflow",
+            files={
+                "file": (os.path.basename(audio["path"]), read_item(corpus_dir, audio), "audio/wav"),
+                "image": (os.path.basename(image["path"]), read_item(corpus_dir, image),
+                          "image/jpeg" if image["path"].endswith(".jpg") else "image/png"),
+            },
+            data={"language": "en"}
+        )
+        body = response.json() if response.status_code == 200 else {}
+        return {
+            "hypothesis": body.get("extracted_text", ""),
+            "lab_values": body.get("lab_values", []),
+            "error": None if response.status_code == 200 else f"HTTP {response.status_code}",
+            "stages": parse_server_timing(response.headers.get("Server-Timing")),
+        }
+
+    return (lambda: True), run
+
+def workflow_items(manifest):
+    """Each report image paired with a dictation; accuracy is scored on the OCR text"""
+    audio = [item for item in manifest["audio"] if item["reference"]] or manifest["audio"]
+    return [
+        {"id": f"{image['id']}+{audio[index % len(audio)]['id']}", "variant": image["variant"],
+         "reference": image["reference"], "image": image, "audio": audio[index % len(audio)]}
+        for index, image in enumerate(manifest["images"])
+    ]
+
+def timed_run(run, item):
+    from metrics import start_request_timings
+
+    timings = start_request_timings()
+    started = time.perf_counter()
+    try:
+        outcome = run(item)
+    except Exception as e:
+        outcome = {"hypothesis": "", "error": f"{type(e).__name__}: {e}"}
+    seconds = time.perf_counter() - started
+
+    stages = outcome.get("stages")
+    if stages is None:
+        stages = {}
+        for name, stage_seconds in timings:
+            stages[name] = stages.get(name, 0.0) + stage_seconds
+    return {**outcome, "id": item["id"], "variant": item["variant"], "seconds": seconds, "stages": stages}
+
+def measure(run, items, iterations, concurrency):
+    """Every item `iterations` times on `concurrency` threads; returns (samples, wall seconds)"""
+    runs = [item for _ in range(iterations) for item in items]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Each run gets a fresh context so stage timings never leak between items
+        futures = [pool.submit(contextvars.copy_context().run, timed_run, run, item) for item in runs]
+        samples = [future.result() for future in futures]
+    return samples, time.perf_counter() - started
+
+def score(samples, items):
+    """Accuracy from the first run of each item - the engines are deterministic"""
+    by_id = {item["id"]: item for item in items}
+    scored, seen = [], set()
+    for sample in samples:
+        item = by_id[sample["id"]]
+        if sample["id"] in seen or not item.get("reference"):
+            continue
+        seen.add(sample["id"])
+        entry = {"variant": sample["variant"], "errors": error_counts(item["reference"], sample["hypothesis"])}
+        expected = item.get("lab_values") or item.get("image", {}).get("lab_values")
+        if expected and "lab_values" in sample:
+            entry["lab_values_expected"] = len(expected)
+            entry["lab_values_found"] = lab_value_hits(expected, sample["lab_values"])
+        scored.append(entry)
+    return accuracy_summary(scored)
+
+def run_worker(suite, corpus_dir, iterations, concurrency):
+    """Benchmark one suite in this process with the configuration from its environment"""
+    manifest = load_corpus(corpus_dir)
+    install_stubs()
+
+    client = None
+    if suite == "ocr":
+        items = manifest["images"]
+        warm_up, run = ocr_task(corpus_dir)
+    elif suite == "speech":
+        items = manifest["audio"]
+        warm_up, run = speech_task(corpus_dir)
+    elif suite == "workflow":
+        from fastapi.testclient import TestClient
+        import main
+
+        client = TestClient(main.app)
+        client.__enter__()
+        items = workflow_items(manifest)
+        warm_up, run = workflow_task(corpus_dir, client)
+    else:
+        raise ValueError(f"Unknown suite: {suite}")
+
+    try:
+        # Model loading and the first (cold) run are reported separately from the timed runs
+        started = time.perf_counter()
+        ready = warm_up()
+        timed_run(run, items[0])
+        warm_up_seconds = time.perf_counter() - started
+
+        samples, wall = measure(run, items, iterations, concurrency)
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+
+    rss, children_rss = peak_rss_mb()
+    errors = [sample for sample in samples if sample["error"]]
+    return {
+        "ready": bool(ready),
+        "items": len(items),
+        "runs": len(samples),
+        "errors": len(errors),
+        "first_error": errors[0]["error"] if errors else None,
+        "warm_up_s": round(warm_up_seconds, 3),
+        "latency_ms": latency_summary([sample["seconds"] for sample in samples]),
+        "throughput_per_s": round(len(samples) / wall, 3) if wall else None,
+        "peak_rss_mb": rss,
+        "peak_rss_children_mb": children_rss,
+        "accuracy": score(samples, items),
+        "stages_ms": stage_summary(samples),
+    }
+
+# ---------------------------------------------------------------------------
+# Runner and comparison
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_config(suite, name, env, corpus_dir, iterations, concurrency):
+    """Run one configuration in a fresh interpreter and return its result dict"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        result_path = tmp.name
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "worker", suite, "--corpus", corpus_dir,
+             "--iterations", str(iterations), "--concurrency", str(concurrency), "--result", result_path],
+            env={**os.environ, **env},
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            timeout=BENCH_WORKER_TIMEOUT
+        )
+        if completed.returncode != 0:
+            return {"failed": f"worker exited with {completed.returncode}"}
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"failed": f"timed out after {BENCH_WORKER_TIMEOUT:.0f}s"}
+    finally:
+        os.unlink(result_path)
+
+def run_benchmarks(suites, config_filter, overrides, corpus_dir, iterations, concurrency):
+    manifest = load_corpus(corpus_dir)
+    results = []
+    for suite in suites:
+        for name, config_env in CONFIGS[suite].items():
+            if config_filter and name not in config_filter:
+                continue
+            env = {**BENCH_BASE_ENV, "BENCH_STUB_LATENCY": str(BENCH_STUB_LATENCY), **config_env, **overrides}
+            print(f"⏱️ {suite}/{name}")
+            result = run_config(suite, name, env, corpus_dir, iterations, concurrency)
+            results.append({
+                "suite": suite,
+                "config": name,
+                "env": {**config_env, **overrides},
+                **result
+            })
+            print(format_result(results[-1]))
+
+    return {
+        "schema": RESULTS_SCHEMA,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": {
+            "version": manifest["version"],
+            "digest": manifest["digest"],
+            "images": len(manifest["images"]),
+            "audio": len(manifest["audio"]),
+            "tts": manifest["tts"],
+        },
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "stub_latency_s": BENCH_STUB_LATENCY,
+        "results": results,
+    }
+
+def format_result(result):
+    if result.get("failed"):
+        return f"{result['suite']}/{result['config']}: FAILED ({result['failed']})"
+    latency = result["latency_ms"] or {}
+    accuracy = result["accuracy"]
+    return (f"{result['suite']}/{result['config']}: p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, "
+            f"{result['throughput_per_s']}/s, peak RSS {result['peak_rss_mb']} MB, "
+            f"CER {accuracy['cer']}, WER {accuracy['wer']}, errors {result['errors']}/{result['runs']}")
+
+# (metric path, lower is better)
+COMPARED_METRICS = [
+    (("latency_ms", "p50"), True),
+    (("latency_ms", "p95"), True),
+    (("throughput_per_s",), False),
+    (("peak_rss_mb",), True),
+    (("accuracy", "cer"), True),
+    (("accuracy", "wer"), True),
+    (("accuracy", "lab_value_recall"), False),
+    (("errors",), True),
+]
+
+def _lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+def compare_results(baseline, candidate):
+    """Lines describing each metric change from baseline to candidate, per suite/config"""
+    lines = []
+    if baseline["corpus"]["digest"] != candidate["corpus"]["digest"]:
+        lines.append("⚠️ Different corpora - accuracy numbers are not comparable")
+    if baseline["machine"] != candidate["machine"]:
+        lines.append("⚠️ Different machines - latency numbers are not comparable")
+
+    before = {(result["suite"], result["config"]): result for result in baseline["results"]}
+    for result in candidate["results"]:
+        key = (result["suite"], result["config"])
+        if key not in before:
+            continue
+        lines.append(f"{key[0]}/{key[1]}:")
+        for path, lower_is_better in COMPARED_METRICS:
+            old, new = _lookup(before[key], path), _lookup(result, path)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            better = (new < old) if lower_is_better else (new > old)
+            marker = "" if new == old else (" better" if better else " worse")
+            lines.append(f"   {'.'.join(path):<22} {old:>10} -> {new:<10} ({change:+.1f}%){marker}")
+    return lines
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        overrides[key] = value
+    return overrides
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR, transcription and workflow benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    corpus_parser = commands.add_parser("corpus", help="(re)generate the synthetic corpus")
+    corpus_parser.add_argument("--corpus", default=BENCH_CORPUS_DIR)
+
+    run_parser = commands.add_parser("run", help="benchmark every configuration of the selected suites")
+    run_parser.add_argument("--suite", default=",".join(SUITES), help="comma separated: ocr,speech,workflow")
+    run_parser.add_argument("--config", default="", help="comma separated configuration names (default: all)")
+    run_parser.add_argument("--env", action="append", help="KEY=VALUE applied to every configuration")
+    run_parser.add_argument("--iterations", type=int, default=3)
+    run_parser.add_argument("--concurrency", type=int, default=1)
+    run_parser.add_argument("--corpus", default=BENCH_CORPUS_DIR)
+    run_parser.add_argument("--output", default="bench_results.json")
+
+    worker_parser = commands.add_parser("worker", help=argparse.SUPPRESS)
+    worker_parser.add_argument("suite", choices=SUITES)
+    worker_parser.add_argument("--corpus", default=BENCH_CORPUS_DIR)
+    worker_parser.add_argument("--iterations", type=int, default=3)
+    worker_parser.add_argument("--concurrency", type=int, default=1)
+    worker_parser.add_argument("--result", required=True)
+
+    compare_parser = commands.add_parser("compare", help="metric changes between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.command == "corpus":
+        manifest = load_corpus(args.corpus, regenerate=True)
+        print(f"✅ Corpus {manifest['digest']}: {len(manifest['images'])} images, {len(manifest['audio'])} audio clips")
+    elif args.command == "run":
+        suites = [suite for suite in args.suite.split(",") if suite]
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+        report = run_benchmarks(suites, {name for name in args.config.split(",") if name},
+                                parse_overrides(args.env), args.corpus, args.iterations, args.concurrency)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+    elif args.command == "worker":
+        result = run_worker(args.suite, args.corpus, args.iterations, args.concurrency)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.candidate, "r", encoding="utf-8") as f:
+            candidate = json.load(f)
+        print("\n".join(compare_results(baseline, candidate)))
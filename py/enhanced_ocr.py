@@ -198,135 +198,328 @@
 
 # enhanced_ocr.py - OCR using Tesseract
 import os
+import time
+import multiprocessing
 import requests
-import pytesseract
-import cv2
 import numpy as np
 from PIL import Image
 import io
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
+from tesseract_backend import ocr_backend
+from result_cache import ResultCache, content_key
+from lab_values import extract_lab_values, rows_from_words, lab_row_words, strip_lab_rows, LAB_DICTIONARY_VERSION
+from metrics import stage
+from log import get_logger, debug_enabled
 
 load_dotenv()
 
+logger = get_logger("ocr")
+
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY")
 
+# "single_pass" builds text from the image_to_data word boxes (one tesseract run
+# per config, stops early); "multi_pass" is the original data + string per config.
+OCR_ENGINE_MODE = os.getenv("OCR_ENGINE_MODE", "single_pass")
+OCR_EARLY_STOP_CONFIDENCE = float(os.getenv("OCR_EARLY_STOP_CONFIDENCE", "85"))
+
+# "fast": decode straight to grayscale, crop to the page, normalize text height,
+# deskew and binarize with OpenCV/NumPy; "legacy": the original full-resolution PIL path
+OCR_PREPROCESS_MODE = os.getenv("OCR_PREPROCESS_MODE", "fast")
+# Tesseract is most accurate with text around 20-40 px tall
+OCR_TARGET_TEXT_HEIGHT = float(os.getenv("OCR_TARGET_TEXT_HEIGHT", "28"))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "3000"))
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", "10"))
+# Long edge of the downscaled copy used to find the page, text height and skew
+OCR_ANALYSIS_SIZE = 1000
+
+# Large pages are cut into horizontal bands (at blank rows) or text blocks and
+# OCR'd in parallel: "auto" above OCR_REGION_MIN_PIXELS, "always", or "off"
+OCR_REGION_MODE = os.getenv("OCR_REGION_MODE", "auto")
+OCR_REGION_SPLIT = os.getenv("OCR_REGION_SPLIT", "bands")
+OCR_REGION_MIN_PIXELS = int(os.getenv("OCR_REGION_MIN_PIXELS", str(3_000_000)))
+OCR_REGION_WORKERS = int(os.getenv("OCR_REGION_WORKERS", str(os.cpu_count() or 1)))
+
+PSM_MODES = [
+    6,   # uniform block of text
+    4,   # single column of variable sizes
+    8,   # single word
+    11,  # sparse text
+]
+
+_region_executor = None
+
+def region_executor():
+    """Process pool for region OCR, spawned on first use"""
+    global _region_executor
+    if _region_executor is None:
+        _region_executor = ProcessPoolExecutor(
+            max_workers=max(1, OCR_REGION_WORKERS),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _region_executor
+
+def _ocr_region(region):
+    """Region OCR task - runs in a region_executor worker process"""
+    return enhanced_ocr._single_pass_ocr(region, region)
+
 class EnhancedOCR:
     def __init__(self):
+        # Tesseract is probed by warm_up(), not at import time
+        self.cache = ResultCache("ocr")
+        # Processes that are already pool workers (batch OCR) turn this off
+        self.region_parallel = OCR_REGION_MODE != "off" and OCR_REGION_WORKERS > 1
+
+    def warm_up(self):
+        """Check Tesseract, pre-create backend handles and import OpenCV ahead of the first request"""
         try:
-            version = pytesseract.get_tesseract_version()
-            print(f"✅ Tesseract version: {version}")
+            version = ocr_backend.version()
+            logger.info("Tesseract ready", extra={"version": str(version), "backend": ocr_backend.name})
+            ocr_backend.warm_up()
+            import cv2  # noqa: F401 - slow first import
+            if self.region_parallel:
+                # Start the region workers now rather than on the first large page
+                region_executor().submit(int).result()
+            return True
         except Exception as e:
-            print(f"⚠️ Tesseract issue: {e}")
+            logger.warning("Tesseract unavailable: %s", e)
+            return False
 
     def preprocess_image(self, image):
         """Image preprocessing for better OCR"""
         try:
+            import cv2
+
             opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
             gray = cv2.cvtColor(opencv_image, cv2.COLOR_BGR2GRAY)
             blurred = cv2.GaussianBlur(gray, (5, 5), 0)
             _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
             return Image.fromarray(thresh)
         except Exception as e:
-            print(f"Preprocessing error: {e}")
+            logger.warning("Preprocessing error: %s", e)
             return image
 
+    def fast_preprocess(self, image_bytes):
+        """Grayscale decode, page crop, text-height normalization, deskew and Otsu - all in OpenCV/NumPy.
+
+        Returns {"binary", "gray", "scale", "skew_angle", "crop", "timings"} or None if
+        OpenCV cannot decode the image.
+        """
+        import cv2
+
+        timings = {}
+        started = time.perf_counter()
+
+        def lap(stage):
+            nonlocal started
+            now = time.perf_counter()
+            timings[stage] = round((now - started) * 1000, 2)
+            started = now
+
+        # Decode straight to 8-bit grayscale (EXIF orientation applied), no RGB copy
+        gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE) if image_bytes else None
+        if gray is None or gray.size == 0:
+            return None
+        lap("decode_ms")
+
+        # Small copy for the analysis steps
+        height, width = gray.shape
+        factor = min(1.0, OCR_ANALYSIS_SIZE / max(height, width))
+        small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1 else gray
+
+        x, y, w, h = self._document_region(cv2, small)
+        small = small[y:y + h, x:x + w]
+        crop = [int(x / factor), int(y / factor), int(w / factor), int(h / factor)]
+        gray = gray[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]]
+        lap("crop_ms")
+
+        text_height = self._median_text_height(cv2, small)
+        if text_height:
+            scale = OCR_TARGET_TEXT_HEIGHT / (text_height / factor)
+        else:
+            scale = 1.0
+        scale = min(max(scale, 0.2), 2.0, OCR_MAX_DIMENSION / max(gray.shape))
+        if abs(scale - 1.0) > 0.05:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+        lap("scale_ms")
+
+        angle = self._skew_angle(cv2, small)
+        if abs(angle) >= 0.3:
+            gray = self._rotate(cv2, gray, angle, cv2.INTER_LINEAR)
+        lap("deskew_ms")
+
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        lap("binarize_ms")
+
+        return {
+            "binary": binary,
+            "gray": gray,
+            "scale": round(scale, 3),
+            "skew_angle": round(angle, 2),
+            "crop": crop,
+            "timings": timings
+        }
+
+    def _document_region(self, cv2, small):
+        """Bounding box of the bright page in a photo; the whole image when the page fills it"""
+        height, width = small.shape
+        blurred = cv2.GaussianBlur(small, (7, 7), 0)
+        _, page = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        page = cv2.morphologyEx(page, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 25)))
+
+        contours, _ = cv2.findContours(page, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return 0, 0, width, height
+
+        x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        coverage = (w * h) / float(width * height)
+        if coverage < 0.2 or coverage > 0.95:
+            return 0, 0, width, height
+
+        margin = 4
+        x, y = max(0, x - margin), max(0, y - margin)
+        return x, y, min(width - x, w + 2 * margin), min(height - y, h + 2 * margin)
+
+    def _ink_mask(self, cv2, small):
+        """Dark strokes relative to their neighbourhood - flat dark background is not ink"""
+        return cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+
+    def _median_text_height(self, cv2, small):
+        """Median glyph height in pixels of the analysis image, None if too little text"""
+        ink = self._ink_mask(cv2, small)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+
+        # Glyph-like components: not specks, not rules or photos
+        glyphs = heights[(heights >= 3) & (heights <= small.shape[0] * 0.1) & (widths <= heights * 5)]
+        if glyphs.size < 10:
+            return None
+        return float(np.median(glyphs))
+
+    def _skew_angle(self, cv2, small):
+        """Rotation that maximizes the row-projection contrast, coarse then fine"""
+        if OCR_DESKEW_MAX_ANGLE <= 0:
+            return 0.0
+
+        ink = self._ink_mask(cv2, small)
+        # Page and crop edges are long straight lines that would outweigh the text
+        margin_y = 6 + small.shape[0] // 50
+        margin_x = 6 + small.shape[1] // 50
+        ink[:margin_y] = 0
+        ink[-margin_y:] = 0
+        ink[:, :margin_x] = 0
+        ink[:, -margin_x:] = 0
+
+        def score(angle):
+            rotated = self._rotate(cv2, ink, angle, cv2.INTER_NEAREST, border=0)
+            rows = rotated.sum(axis=1, dtype=np.float64)
+            return float(np.sum(np.diff(rows) ** 2))
+
+        coarse = np.arange(-OCR_DESKEW_MAX_ANGLE, OCR_DESKEW_MAX_ANGLE + 0.5, 1.0)
+        best = max(coarse, key=score)
+        fine = np.arange(best - 0.8, best + 0.9, 0.2)
+        return float(max(fine, key=score))
+
+    def _rotate(self, cv2, image, angle, interpolation, border=255):
+        height, width = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        return cv2.warpAffine(
+            image, matrix, (width, height),
+            flags=interpolation,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=border
+        )
+
+    def load_image(self, image_input):
+        """Open a file path or file object as an RGB PIL image (legacy preprocessing path)"""
+        if isinstance(image_input, str):
+            image = Image.open(image_input)
+        else:
+            image_input.seek(0)
+            image = Image.open(image_input)
+        logger.debug("Image loaded: %s %s", image.size, image.mode)
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
     def tesseract_ocr(self, image_input):
         """Tesseract OCR with multiple configurations - handles both file objects and file paths"""
         try:
             # Check if input is a file path (string) or file object
-            if isinstance(image_input, str):
-                # It's a file path
-                print(f"📖 Opening image from file path: {image_input}")
-                if not os.path.exists(image_input):
-                    print(f"❌ Image file not found: {image_input}")
-                    return {
-                        "text": "Image file not found",
-                        "format": "plain",
-                        "source": "error",
-                        "confidence": 0
-                    }
-                
-                image = Image.open(image_input)
-                print(f"✅ Image loaded successfully: {image.size}, {image.mode}")
+            if isinstance(image_input, str) and not os.path.exists(image_input):
+                logger.error("Image file not found: %s", image_input)
+                return {
+                    "text": "Image file not found",
+                    "format": "plain",
+                    "source": "error",
+                    "confidence": 0
+                }
+
+            prepared = None
+            if OCR_PREPROCESS_MODE == "fast":
+                image_bytes = self._read_input_bytes(image_input)
+                with stage("ocr_preprocess", bytes=len(image_bytes or b"")):
+                    prepared = self.fast_preprocess(image_bytes)
+                if prepared is None:
+                    logger.warning("OpenCV could not decode the image, using legacy preprocessing")
+
+            if prepared is not None:
+                processed_image, image = prepared["binary"], prepared["gray"]
+                timings = prepared["timings"]
+                logger.debug("Image preprocessed: %dx%d, scale %s, skew %s°", processed_image.shape[1],
+                             processed_image.shape[0], prepared["scale"], prepared["skew_angle"])
             else:
-                # It's a file object
-                print("📖 Opening image from file object...")
-                image_input.seek(0)
-                image = Image.open(image_input)
-                print(f"✅ Image loaded successfully: {image.size}, {image.mode}")
-
-            if image.mode != 'RGB':
-                print(f"🔄 Converting image from {image.mode} to RGB")
-                image = image.convert('RGB')
-
-            processed_image = self.preprocess_image(image)
-
-            configs = [
-                '--oem 3 --psm 6',
-                '--oem 3 --psm 4',
-                '--oem 3 --psm 8',
-                '--oem 3 --psm 11'
-            ]
-
-            best_text = ""
-            best_confidence = 0
-
-            print("🔍 Trying multiple OCR configurations...")
-            for i, config in enumerate(configs):
-                try:
-                    print(f"   Trying config {i+1}/{len(configs)}: {config}")
-                    data = pytesseract.image_to_data(
-                        processed_image,
-                        lang='eng',
-                        config=config,
-                        output_type=pytesseract.Output.DICT
-                    )
-
-                    confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-                    if confidences:
-                        avg_confidence = sum(confidences) / len(confidences)
-                        text = pytesseract.image_to_string(processed_image, lang='eng', config=config)
-                        text = text.strip()
-                        
-                        print(f"   Result: {len(text)} chars, {avg_confidence:.1f}% confidence")
-                        
-                        if avg_confidence > best_confidence and text:
-                            best_confidence = avg_confidence
-                            best_text = text
-                            print(f"   ✅ New best result!")
-                except Exception as config_error:
-                    print(f"   ❌ Config failed: {config_error}")
-                    continue
-
-            # Fallback to basic OCR if no good result
-            if not best_text or best_confidence < 30:
-                try:
-                    print("🔄 Trying basic OCR as fallback...")
-                    basic_text = pytesseract.image_to_string(image)
-                    if basic_text.strip():
-                        best_text = basic_text.strip()
-                        best_confidence = 50
-                        print("✅ Basic OCR succeeded")
-                except Exception:
-                    print("❌ Basic OCR also failed")
-                    pass
-
-            print(f"🎯 Final OCR result:")
-            print(f"   Text length: {len(best_text)} characters")
-            print(f"   Confidence: {best_confidence:.1f}%")
-            print(f"   Preview: {best_text[:100]}{'...' if len(best_text) > 100 else ''}")
+                started = time.perf_counter()
+                with stage("ocr_preprocess"):
+                    image = self.load_image(image_input)
+                    processed_image = self.preprocess_image(image)
+                timings = {"preprocess_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+            started = time.perf_counter()
+            regions = None
+            if OCR_ENGINE_MODE == "multi_pass":
+                best_text, best_confidence = self._multi_pass_ocr(processed_image, image)
+                rows = best_text.splitlines()
+                with stage("lab_values"):
+                    lab_values = extract_lab_values(rows)
+                other_text = strip_lab_rows(rows, lab_values)
+            elif self._use_regions(processed_image):
+                with stage("tesseract_regions"):
+                    best_text, best_confidence, lab_values, other_text, regions = self._region_ocr(processed_image)
+            else:
+                best_text, best_confidence, lab_values, other_text = self._single_pass_ocr(processed_image, image)
+            timings["ocr_ms"] = round((time.perf_counter() - started) * 1000, 2)
 
-            return {
+            logger.info("OCR finished", extra={"chars": len(best_text), "confidence": round(best_confidence, 1)})
+            if debug_enabled(logger):
+                logger.debug("OCR preview: %r", best_text[:100])
+
+            result = {
                 "text": best_text,
                 "format": "plain",
                 "source": "tesseract",
-                "confidence": best_confidence
+                "confidence": best_confidence,
+                "lab_values": lab_values,
+                # The text minus the rows the lab values came from, for structured prompts
+                "other_text": other_text,
+                "timings": timings
             }
+            if regions is not None:
+                result["regions"] = regions
+            if prepared is not None:
+                result["preprocess"] = {
+                    "scale": prepared["scale"],
+                    "skew_angle": prepared["skew_angle"],
+                    "crop": prepared["crop"]
+                }
+            return result
 
         except Exception as e:
-            print(f"❌ Tesseract OCR error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Tesseract OCR error")
             return {
                 "text": f"OCR Error: {str(e)}",
                 "format": "plain",
@@ -334,14 +527,269 @@ class EnhancedOCR:
                 "confidence": 0
             }
 
+    def rank_psm_modes(self, image):
+        """Order PSM modes by how likely they fit the image, using only its size"""
+        if isinstance(image, np.ndarray):
+            height, width = image.shape[:2]
+        else:
+            width, height = image.size
+
+        if height < 80 and width < 600:
+            # Small crop - most likely a single word or label
+            order = [8, 6, 11, 4]
+        elif height < 200:
+            # One or two lines of text
+            order = [6, 8, 4, 11]
+        else:
+            # Full page - single word mode is the least useful
+            order = [6, 4, 11, 8]
+
+        return order
+
+    def _use_regions(self, processed_image):
+        if not self.region_parallel or not isinstance(processed_image, np.ndarray):
+            return False
+        return OCR_REGION_MODE == "always" or processed_image.size >= OCR_REGION_MIN_PIXELS
+
+    def detect_text_regions(self, binary, split=OCR_REGION_SPLIT, target_count=None):
+        """Regions of a binarized page as (x, y, w, h) boxes, in reading order"""
+        import cv2
+
+        ink = binary < 128
+        if split == "blocks":
+            boxes = self._text_blocks(cv2, ink)
+            if len(boxes) >= 2:
+                return boxes
+        return self._text_bands(ink, target_count or 2 * max(1, OCR_REGION_WORKERS))
+
+    def _text_bands(self, ink, target_count):
+        """Full-width horizontal bands cut only at blank rows, so table rows stay intact"""
+        height, width = ink.shape
+        row_ink = ink.sum(axis=1)
+        blank = row_ink == 0
+
+        # Centre of every run of blank rows is a safe cut
+        cuts = []
+        run_start = None
+        for y, is_blank in enumerate(blank):
+            if is_blank and run_start is None:
+                run_start = y
+            elif not is_blank and run_start is not None:
+                cuts.append((run_start + y) // 2)
+                run_start = None
+
+        band_height = height / target_count
+        boxes = []
+        top = 0
+        for cut in cuts:
+            if cut - top >= band_height:
+                boxes.append((0, top, width, cut - top))
+                top = cut
+        boxes.append((0, top, width, height - top))
+
+        # Drop bands without any ink
+        return [box for box in boxes if row_ink[box[1]:box[1] + box[3]].any()]
+
+    def _text_blocks(self, cv2, ink):
+        """Text blocks from morphological closing: words into lines, lines into blocks"""
+        text_height = int(OCR_TARGET_TEXT_HEIGHT)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (text_height * 2, int(text_height * 1.5)))
+        merged = cv2.morphologyEx(ink.astype(np.uint8) * 255, cv2.MORPH_CLOSE, kernel)
+
+        contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(contour) for contour in contours]
+        boxes = [box for box in boxes if box[2] * box[3] >= text_height * text_height]
+
+        # Reading order: blocks that overlap vertically form a row, read left to right
+        boxes.sort(key=lambda box: box[1])
+        rows = []
+        for box in boxes:
+            if rows and box[1] < rows[-1]["bottom"]:
+                rows[-1]["boxes"].append(box)
+                rows[-1]["bottom"] = max(rows[-1]["bottom"], box[1] + box[3])
+            else:
+                rows.append({"boxes": [box], "bottom": box[1] + box[3]})
+        return [box for row in rows for box in sorted(row["boxes"], key=lambda box: box[0])]
+
+    def _region_ocr(self, processed_image):
+        """OCR regions in parallel on the region pool and stitch them in reading order"""
+        boxes = self.detect_text_regions(processed_image)
+        if len(boxes) < 2:
+            text, confidence, lab_values, other_text = self._single_pass_ocr(processed_image, processed_image)
+            return text, confidence, lab_values, other_text, None
+
+        logger.info("Region OCR", extra={"regions": len(boxes), "workers": OCR_REGION_WORKERS})
+        pad = 4
+        height, width = processed_image.shape[:2]
+        crops = []
+        for x, y, w, h in boxes:
+            top, bottom = max(0, y - pad), min(height, y + h + pad)
+            left, right = max(0, x - pad), min(width, x + w + pad)
+            crops.append(np.ascontiguousarray(processed_image[top:bottom, left:right]))
+
+        results = list(region_executor().map(_ocr_region, crops))
+
+        regions = []
+        lab_values = []
+        other_texts = []
+        weighted = 0.0
+        total_chars = 0
+        for index, ((x, y, w, h), (text, confidence, region_lab_values, other_text)) in enumerate(zip(boxes, results)):
+            regions.append({
+                "index": index,
+                "bbox": [int(x), int(y), int(w), int(h)],
+                "text": text,
+                "confidence": confidence
+            })
+            # Row indexes count within their region
+            lab_values.extend(dict(record, region=index) for record in region_lab_values)
+            if other_text:
+                other_texts.append(other_text)
+            weighted += confidence * len(text)
+            total_chars += len(text)
+
+        text = "\n".join(region["text"] for region in regions if region["text"])
+        confidence = weighted / total_chars if total_chars else 0
+        return text, confidence, lab_values, "\n".join(other_texts), regions
+
+    def average_confidence(self, data):
+        """Mean word confidence from image_to_data output, ignoring non-word rows"""
+        confidences = [float(conf) for conf in data['conf'] if float(conf) > 0]
+        if not confidences:
+            return 0
+        return sum(confidences) / len(confidences)
+
+    def words_to_text(self, data, skip=frozenset()):
+        """Rebuild page text from image_to_data word boxes, without another tesseract run.
+
+        Words whose index is in skip are left out.
+        """
+        lines = []
+        current_key = None
+        current_block = None
+
+        for i, word in enumerate(data['text']):
+            word = word.strip() if word else ""
+            if not word or i in skip:
+                continue
+
+            block_key = (data['block_num'][i], data['par_num'][i])
+            line_key = block_key + (data['line_num'][i],)
+
+            if line_key != current_key:
+                # Blank line between blocks/paragraphs, like image_to_string
+                if current_block is not None and block_key != current_block:
+                    lines.append("")
+                lines.append(word)
+                current_key = line_key
+                current_block = block_key
+            else:
+                lines[-1] += " " + word
+
+        return "\n".join(lines).strip()
+
+    def _single_pass_ocr(self, processed_image, image):
+        """One image_to_data run per config, best-ranked configs first, with early stop.
+
+        Lab values come from the best run's word boxes regrouped into table rows; the
+        other text is the page without the words of those rows.
+        Returns (text, confidence, lab_values, other_text).
+        """
+        best_text = ""
+        best_confidence = 0
+        best_data = None
+
+        psm_modes = self.rank_psm_modes(processed_image)
+
+        for i, psm in enumerate(psm_modes):
+            try:
+                with stage(f"tesseract_psm{psm}"):
+                    data = ocr_backend.image_to_data(processed_image, lang='eng', psm=psm)
+
+                avg_confidence = self.average_confidence(data)
+                text = self.words_to_text(data)
+
+                logger.debug("psm %d: %d chars, %.1f%% confidence", psm, len(text), avg_confidence)
+
+                if avg_confidence > best_confidence and text:
+                    best_confidence = avg_confidence
+                    best_text = text
+                    best_data = data
+
+                if best_confidence >= OCR_EARLY_STOP_CONFIDENCE:
+                    logger.debug("Confidence above %.0f%%, skipping remaining configs", OCR_EARLY_STOP_CONFIDENCE)
+                    break
+            except Exception as config_error:
+                logger.warning("psm %d failed: %s", psm, config_error)
+                continue
+
+        # Fallback to basic OCR on the original image if no good result
+        if not best_text or best_confidence < 30:
+            try:
+                logger.info("Low confidence, trying basic OCR as fallback")
+                data = ocr_backend.image_to_data(image)
+                basic_text = self.words_to_text(data)
+                if basic_text:
+                    best_text = basic_text
+                    best_confidence = 50
+                    best_data = data
+            except Exception:
+                logger.warning("Basic OCR also failed")
+
+        if best_data is None:
+            return best_text, best_confidence, [], best_text
+
+        rows, row_words = rows_from_words(best_data)
+        with stage("lab_values"):
+            lab_values = extract_lab_values(rows)
+        other_text = self.words_to_text(best_data, skip=lab_row_words(lab_values, row_words))
+        return best_text, best_confidence, lab_values, other_text
+
+    def _multi_pass_ocr(self, processed_image, image):
+        """Original engine: image_to_data and image_to_string for every config"""
+        best_text = ""
+        best_confidence = 0
+
+        for i, psm in enumerate(PSM_MODES):
+            try:
+                with stage(f"tesseract_psm{psm}"):
+                    data = ocr_backend.image_to_data(processed_image, lang='eng', psm=psm)
+
+                avg_confidence = self.average_confidence(data)
+                if avg_confidence > 0:
+                    text = ocr_backend.image_to_string(processed_image, lang='eng', psm=psm)
+                    text = text.strip()
+                    
+                    logger.debug("psm %d: %d chars, %.1f%% confidence", psm, len(text), avg_confidence)
+                    
+                    if avg_confidence > best_confidence and text:
+                        best_confidence = avg_confidence
+                        best_text = text
+            except Exception as config_error:
+                logger.warning("psm %d failed: %s", psm, config_error)
+                continue
+
+        # Fallback to basic OCR if no good result
+        if not best_text or best_confidence < 30:
+            try:
+                logger.info("Low confidence, trying basic OCR as fallback")
+                basic_text = ocr_backend.image_to_string(image)
+                if basic_text.strip():
+                    best_text = basic_text.strip()
+                    best_confidence = 50
+            except Exception:
+                logger.warning("Basic OCR also failed")
+
+        return best_text, best_confidence
+
     def ocr_space_backup(self, image_input):
         """OCR.space API backup - handles both file objects and file paths"""
         try:
             if not OCR_SPACE_API_KEY:
-                print("⚠️ OCR.space API key not configured")
+                logger.warning("OCR.space API key not configured")
                 return None
 
-            print("🌐 Trying OCR.space as backup...")
+            logger.info("Trying OCR.space as backup")
             
             # Handle file path vs file object
             if isinstance(image_input, str):
@@ -356,7 +804,7 @@ class EnhancedOCR:
                 return self._call_ocr_space_api(files)
 
         except Exception as e:
-            print(f"❌ OCR.space error: {e}")
+            logger.error("OCR.space error: %s", e)
             return None
 
     def _call_ocr_space_api(self, files):
@@ -381,48 +829,94 @@ class EnhancedOCR:
             if result.get('ParsedResults') and len(result['ParsedResults']) > 0:
                 parsed_text = result['ParsedResults'][0].get('ParsedText', '')
                 if parsed_text.strip():
-                    print(f"✅ OCR.space succeeded: {len(parsed_text)} characters")
+                    logger.info("OCR.space succeeded", extra={"chars": len(parsed_text)})
+                    lines = parsed_text.strip().splitlines()
+                    lab_values = extract_lab_values(lines)
                     return {
                         "text": parsed_text.strip(),
                         "format": "plain",
                         "source": "ocr_space",
-                        "confidence": 80
+                        "confidence": 80,
+                        "lab_values": lab_values,
+                        "other_text": strip_lab_rows(lines, lab_values)
                     }
         return None
 
     def extract_text(self, image_input):
         """Extract text with fallback options - handles both file objects and file paths"""
-        print("🚀 Starting OCR extraction...")
-        print(f"   Input type: {type(image_input)}")
-        
-        if isinstance(image_input, str):
-            print(f"   File path: {image_input}")
-            print(f"   File exists: {os.path.exists(image_input)}")
-            if os.path.exists(image_input):
-                print(f"   File size: {os.path.getsize(image_input)} bytes")
+        # Consult the result cache before doing any OCR work
+        cache_key = None
+        image_bytes = self._read_input_bytes(image_input)
+        if image_bytes:
+            cache_key = self.cache_key(image_bytes)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("OCR cache hit")
+                cached["cache_hit"] = True
+                return cached
+            image_input = io.BytesIO(image_bytes)
 
         # Try primary OCR method
         result = self.tesseract_ocr(image_input)
         if result and result["text"] and "OCR Error" not in result["text"] and result["confidence"] > 20:
-            print("✅ Primary OCR successful!")
-            return result
+            return self._cache_result(cache_key, result)
 
-        print("⚠️ Primary OCR failed or low confidence, trying backup...")
+        logger.warning("Primary OCR failed or low confidence, trying backup")
         
         # Try backup method
         backup_result = self.ocr_space_backup(image_input)
         if backup_result and backup_result["text"]:
-            print("✅ Backup OCR successful!")
-            return backup_result
+            return self._cache_result(cache_key, backup_result)
 
-        print("❌ All OCR methods failed")
+        logger.error("All OCR methods failed")
         return {
             "text": "Unable to extract text from image. Please ensure clear, readable text.",
             "format": "plain",
             "source": "failed",
-            "confidence": 0
+            "confidence": 0,
+            "cache_hit": False
         }
 
+    def cache_key(self, image_bytes):
+        """Content hash of the image plus every setting that changes the OCR output"""
+        return content_key(
+            image_bytes,
+            engine="tesseract",
+            backend=ocr_backend.name,
+            lang="eng",
+            mode=OCR_ENGINE_MODE,
+            region_split=OCR_REGION_SPLIT if self.region_parallel else "off",
+            region_mode=OCR_REGION_MODE if self.region_parallel else "off",
+            region_min_pixels=OCR_REGION_MIN_PIXELS,
+            preprocess=OCR_PREPROCESS_MODE,
+            target_text_height=OCR_TARGET_TEXT_HEIGHT,
+            max_dimension=OCR_MAX_DIMENSION,
+            deskew_max_angle=OCR_DESKEW_MAX_ANGLE,
+            psm_modes=PSM_MODES,
+            early_stop=OCR_EARLY_STOP_CONFIDENCE,
+            lab_dictionary=LAB_DICTIONARY_VERSION
+        )
+
+    def _read_input_bytes(self, image_input):
+        """Read raw image bytes from a file path or file object, None if unreadable"""
+        try:
+            if isinstance(image_input, str):
+                if not os.path.exists(image_input):
+                    return None
+                with open(image_input, 'rb') as f:
+                    return f.read()
+            image_input.seek(0)
+            return image_input.read()
+        except Exception as e:
+            logger.warning("Could not read image for caching: %s", e)
+            return None
+
+    def _cache_result(self, cache_key, result):
+        if cache_key:
+            self.cache.set(cache_key, result)
+        result["cache_hit"] = False
+        return result
+
     def format_medical_report(self, ocr_result):
         """Format OCR result for medical reports"""
         text = ocr_result["text"]
@@ -439,11 +933,26 @@ class EnhancedOCR:
 
         confidence_emoji = "🟢" if confidence > 70 else "🟡" if confidence > 40 else "🔴"
 
+        lab_section = ""
+        lab_values = ocr_result.get("lab_values") or []
+        if lab_values:
+            rows = "\n".join(
+                f"| {record['test']} | {record['value_text']} | {record['unit'] or ''} | "
+                f"{record['reference_range']['text'] if record['reference_range'] else ''} | {record['flag'] or ''} |"
+                for record in lab_values
+            )
+            lab_section = f"""### 🧪 Lab Values:
+| Test | Value | Unit | Reference | Flag |
+|---|---|---|---|---|
+{rows}
+
+"""
+
         return f"""## 📋 Medical Report Analysis
 
 {confidence_emoji} **OCR Quality: {confidence:.1f}%** *(using {source})*
 
-### 📄 Extracted Text:
+{lab_section}### 📄 Extracted Text:
 {text}
 
 ### 🔍 Key Information to Review:
@@ -1,179 +1,463 @@
-try:
-    import audioop
-except ImportError:
-    audioop = None 
+import contextvars
 import os
+import queue
+import subprocess
 import tempfile
+import threading
 import logging
-from faster_whisper import WhisperModel
-from pydub import AudioSegment
+import numpy as np
+import soundfile as sf
 import io
+from contextlib import contextmanager
+from result_cache import ResultCache, content_key
+from metrics import stage
+from log import get_logger, debug_enabled
 
 logging.basicConfig()
 logging.getLogger("faster_whisper").setLevel(logging.WARNING)
 
-class EnhancedSpeechToText:
-    def __init__(self):
-        print("🎤 Loading Faster-Whisper model...")
+logger = get_logger("speech")
+
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+
+# Model replicas, each shared by WHISPER_NUM_WORKERS concurrent transcriptions;
+# CTranslate2 threads are split across them so replicas do not oversubscribe the CPU
+WHISPER_REPLICAS = max(1, int(os.getenv("WHISPER_REPLICAS", "1")))
+WHISPER_NUM_WORKERS = max(1, int(os.getenv("WHISPER_NUM_WORKERS", "1")))
+WHISPER_CPU_THREADS = int(os.getenv(
+    "WHISPER_CPU_THREADS",
+    str(max(1, (os.cpu_count() or 1) // (WHISPER_REPLICAS * WHISPER_NUM_WORKERS)))
+))
+# Transcriptions allowed to wait for a free model before new ones are rejected
+TRANSCRIPTION_QUEUE_SIZE = int(os.getenv("TRANSCRIPTION_QUEUE_SIZE", str(4 * WHISPER_REPLICAS * WHISPER_NUM_WORKERS)))
+# Decoded segments buffered per stream, so a slow reader rarely holds up the decoder
+STREAM_SEGMENT_BUFFER = int(os.getenv("STREAM_SEGMENT_BUFFER", "256"))
+
+# Whisper expects 16 kHz mono float32 samples
+SAMPLE_RATE = 16000
+
+class WhisperModelPool:
+    """Whisper replicas handed out per transcription; each replica serves num_workers callers at once"""
+
+    def __init__(self, replicas=WHISPER_REPLICAS, cpu_threads=WHISPER_CPU_THREADS, num_workers=WHISPER_NUM_WORKERS):
+        self.replicas = replicas
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.concurrency = replicas * num_workers
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Claim a slot for a new replica; False once every replica exists"""
+        with self._lock:
+            if self._created >= self.replicas:
+                return False
+            self._created += 1
+            return True
+
+    def _new_model(self):
+        from faster_whisper import WhisperModel
+
         try:
-            self.whisper_model = WhisperModel(
-                "base",
+            model = WhisperModel(
+                WHISPER_MODEL_SIZE,
                 device="cpu",
-                compute_type="int8",
+                compute_type=WHISPER_COMPUTE_TYPE,
+                cpu_threads=self.cpu_threads,
+                num_workers=self.num_workers,
                 download_root=None,
                 local_files_only=False
             )
-            print("✅ Faster-Whisper model loaded successfully!")
-            self.whisper_available = True
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        for _ in range(self.num_workers):
+            self._pool.put(model)
+        return model
+
+    def load_one(self):
+        """Make sure at least one replica exists"""
+        if self._reserve():
+            self._new_model()
+
+    def load_all(self):
+        while self._reserve():
+            self._new_model()
+
+    @contextmanager
+    def checkout(self):
+        """Borrow a replica, creating one lazily until all replicas exist.
+
+        Waiting callers poll rather than block: when another thread's load fails,
+        its replica slot is freed and the next poll retries the load here, raising
+        if it fails again instead of waiting for a replica that never comes.
+        """
+        model = None
+        while model is None:
+            try:
+                model = self._pool.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    self._new_model()
+                try:
+                    model = self._pool.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+
+        try:
+            yield model
+        finally:
+            self._pool.put(model)
+
+    def stats(self):
+        return {
+            "replicas": self.replicas,
+            "loaded_replicas": self._created,
+            "cpu_threads": self.cpu_threads,
+            "num_workers": self.num_workers,
+            "idle_slots": self._pool.qsize()
+        }
+
+class TranscriptionSlots:
+    """Admission control: running + queued transcriptions are bounded, extra requests are refused"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, count=1):
+        with self._lock:
+            if self.in_use + count > self.capacity:
+                self.rejected += 1
+                return False
+            self.in_use += count
+            return True
+
+    def release(self, count=1):
+        with self._lock:
+            self.in_use -= count
+
+    def stats(self):
+        with self._lock:
+            return {"capacity": self.capacity, "in_use": self.in_use, "rejected": self.rejected}
+
+class EnhancedSpeechToText:
+    def __init__(self):
+        # Models are loaded on first use or by warm_up(), never at import time
+        self.models = WhisperModelPool()
+        self.whisper_available = False
+        self.load_attempted = False
+        self._load_lock = threading.Lock()
+
+        self.slots = TranscriptionSlots(self.models.concurrency + TRANSCRIPTION_QUEUE_SIZE)
+        self.cache = ResultCache("transcription")
+
+    def ensure_model(self):
+        """Load the Whisper model once (thread-safe); True when it is usable"""
+        if self.load_attempted:
+            return self.whisper_available
+
+        with self._load_lock:
+            if self.load_attempted:
+                return self.whisper_available
+
+            logger.info("Loading Faster-Whisper model", extra={"model": WHISPER_MODEL_SIZE})
+            try:
+                self.models.load_one()
+                self.whisper_available = True
+            except Exception as e:
+                logger.error("Faster-Whisper model loading failed: %s", e)
+                self.whisper_available = False
+            self.load_attempted = True
+
+        return self.whisper_available
+
+    def warm_up(self):
+        """Load every model replica ahead of the first request"""
+        if not self.ensure_model():
+            return False
+        try:
+            self.models.load_all()
+            logger.info("Whisper pool ready", extra=self.models.stats())
         except Exception as e:
-            print(f"❌ Faster-Whisper model loading failed: {e}")
-            self.whisper_model = None
-            self.whisper_available = False
+            logger.warning("Could not load every Whisper replica: %s", e)
+        return True
+
+    def decode_audio(self, audio_input):
+        """Decode audio to 16 kHz mono float32 samples in memory - handles bytes, file objects and file paths"""
+        if isinstance(audio_input, str):
+            # ffmpeg reads the path itself, nothing is loaded up front
+            try:
+                return self._ffmpeg_decode(["-i", audio_input])
+            except Exception as e:
+                logger.warning("Audio decoding failed: %s", e)
+                return None
+
+        audio_bytes = audio_input if isinstance(audio_input, (bytes, bytearray)) else audio_input.read()
 
-    def convert_audio_format(self, audio_input):
-        """Convert audio file to WAV format - handles both file objects and file paths"""
         try:
-            # Check if input is a file path (string) or file object
-            if isinstance(audio_input, str):
-                # It's a file path - process directly
-                print(f"🔄 Converting audio from file path: {audio_input}")
-                
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                    try:
-                        # Load audio directly from file path
-                        audio_segment = AudioSegment.from_file(audio_input)
-                        audio_segment = audio_segment.set_channels(1)
-                        audio_segment = audio_segment.set_frame_rate(16000)
-                        audio_segment.export(temp_wav.name, format="wav")
-                        print(f"✅ Audio converted successfully to: {temp_wav.name}")
-                        return temp_wav.name
-                    except Exception as e:
-                        print(f"Audio conversion failed: {e}")
-                        # If conversion fails, check if original file is already compatible
-                        if audio_input.lower().endswith(('.wav', '.mp3', '.m4a', '.flac', '.ogg')):
-                            print("Using original file as fallback")
-                            return audio_input
-                        return None
-            else:
-                # It's a file object
-                print("🔄 Converting audio from file object...")
-                
-                audio_data = audio_input.read()
-                audio_input.seek(0)
-
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                    audio_io = io.BytesIO(audio_data)
-                    try:
-                        audio_segment = AudioSegment.from_file(audio_io)
-                        audio_segment = audio_segment.set_channels(1)
-                        audio_segment = audio_segment.set_frame_rate(16000)
-                        audio_segment.export(temp_wav.name, format="wav")
-                        return temp_wav.name
-                    except Exception as e:
-                        print(f"Audio conversion failed: {e}")
-                        temp_wav.write(audio_data)
-                        return temp_wav.name
-                        
+            return self._ffmpeg_decode(["-i", "pipe:0"], audio_bytes)
+        except Exception as e:
+            logger.debug("ffmpeg pipe decoding failed: %s", e)
+
+        try:
+            return self._soundfile_decode(audio_bytes)
+        except Exception as e:
+            logger.debug("soundfile decoding failed: %s", e)
+
+        # Containers such as m4a can keep their index at the end and need a seekable input
+        try:
+            with tempfile.NamedTemporaryFile(suffix=".audio") as tmp:
+                tmp.write(audio_bytes)
+                tmp.flush()
+                return self._ffmpeg_decode(["-i", tmp.name])
         except Exception as e:
-            print(f"Audio conversion error: {e}")
+            logger.warning("Audio decoding failed: %s", e)
             return None
 
+    def _ffmpeg_decode(self, input_args, audio_bytes=None):
+        """Decode with ffmpeg straight to raw float32 PCM on stdout"""
+        process = subprocess.run(
+            ["ffmpeg", "-nostdin", "-threads", "0", *input_args,
+             "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-loglevel", "error", "pipe:1"],
+            input=audio_bytes,
+            capture_output=True,
+            check=False
+        )
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.decode("utf-8", errors="replace").strip())
+        return np.frombuffer(process.stdout, dtype=np.float32)
+
+    def _soundfile_decode(self, audio_bytes):
+        """Decode wav/flac/ogg with libsndfile, downmix and resample with NumPy"""
+        samples, sample_rate = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+        samples = samples.mean(axis=1)
+
+        if sample_rate != SAMPLE_RATE:
+            target_length = int(round(len(samples) * SAMPLE_RATE / sample_rate))
+            positions = np.linspace(0, len(samples) - 1, num=target_length)
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+        return samples
+
+    def stream_segments(self, audio_input):
+        """Yield the detected language, then each segment as faster-whisper decodes it"""
+        with stage("audio_decode") as info:
+            if isinstance(audio_input, (bytes, bytearray)):
+                info["bytes"] = len(audio_input)
+            audio = self.decode_audio(audio_input)
+        if audio is None:
+            logger.warning("Audio decoding failed")
+            return
+
+        if audio.size == 0:
+            logger.warning("Audio is empty")
+            return
+
+        logger.info("Transcribing", extra={"audio_seconds": round(audio.size / SAMPLE_RATE, 1)})
+
+        # Whisper runs on its own thread and hands events over a bounded queue, so the
+        # replica goes back to the pool as soon as decoding ends, however slowly (or
+        # whether) the caller reads the events
+        events = queue.Queue(maxsize=STREAM_SEGMENT_BUFFER)
+        stop = threading.Event()
+        decoder = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._decode_segments, audio, events, stop),
+            name="whisper-decode",
+            daemon=True
+        )
+        decoder.start()
+
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            # Also reached when the caller closes the generator early; the decoder
+            # notices within one segment, and returning only after that keeps the
+            # caller's transcription slot held for as long as Whisper is busy
+            stop.set()
+            decoder.join()
+
+    def _decode_segments(self, audio, events, stop):
+        """Decoder thread: run Whisper and queue language and segment events, then None"""
+        def put(event):
+            while not stop.is_set():
+                try:
+                    events.put(event, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            with stage("whisper", audio_seconds=round(audio.size / SAMPLE_RATE, 2)), self.models.checkout() as model:
+                segments, info = model.transcribe(
+                    audio,
+                    beam_size=WHISPER_BEAM_SIZE,
+                    language=None,
+                    task="transcribe",
+                    vad_filter=True,
+                    vad_parameters=dict(min_silence_duration_ms=1000),
+                    word_timestamps=False,
+                    condition_on_previous_text=True
+                )
+
+                if not put({
+                    "event": "language",
+                    "language": self.language_name(info.language),
+                    "language_code": info.language,
+                    "language_confidence": info.language_probability,
+                    "audio_duration": info.duration
+                }):
+                    return
+
+                # faster-whisper decodes lazily, one segment per iteration
+                for index, segment in enumerate(segments):
+                    if not put({
+                        "event": "segment",
+                        "index": index,
+                        "start": segment.start,
+                        "end": segment.end,
+                        "text": segment.text
+                    }):
+                        logger.info("Transcription abandoned by the client")
+                        return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def language_name(self, language_code):
+        language_names = {
+            'hi': 'Hindi', 'kn': 'Kannada', 'mr': 'Marathi',
+            'ta': 'Tamil', 'te': 'Telugu', 'bn': 'Bengali',
+            'gu': 'Gujarati', 'pa': 'Punjabi', 'en': 'English',
+            'ur': 'Urdu', 'ne': 'Nepali', 'si': 'Sinhala',
+            'ml': 'Malayalam', 'or': 'Odia', 'as': 'Assamese'
+        }
+        return language_names.get(language_code, language_code.upper())
+
+    def build_result(self, language_event, transcript_parts, total_duration):
+        """Assemble the transcription result from the streamed events"""
+        full_transcript = " ".join(transcript_parts).strip()
+
+        language_name = language_event["language"]
+        language_confidence = language_event["language_confidence"]
+        confidence_level = "high" if language_confidence > 0.8 else "medium" if language_confidence > 0.5 else "low"
+
+        logger.info("Transcription completed", extra={
+            "language": language_name,
+            "language_confidence": round(language_confidence, 2),
+            "duration": round(total_duration, 1),
+        })
+        if debug_enabled(logger):
+            logger.debug("Transcript preview: %r", full_transcript[:100])
+
+        return {
+            "text": full_transcript,
+            "language": language_name,
+            "language_code": language_event["language_code"],
+            "language_confidence": language_confidence,
+            "duration": total_duration,
+            "source": "faster_whisper",
+            "confidence": confidence_level,
+            "segments_count": len(transcript_parts)
+        }
+
     def faster_whisper_transcribe(self, audio_input):
         """Transcribe using faster-whisper - handles both file objects and file paths"""
-        if not self.whisper_available:
+        if not self.ensure_model():
             return None
 
         try:
-            print("🎧 Converting audio format...")
-            wav_path = self.convert_audio_format(audio_input)
-            if not wav_path:
-                print("❌ Audio conversion failed")
-                return None
+            language_event = None
+            transcript_parts = []
+            total_duration = 0
 
-            print(f"🚀 Transcribing with Faster-Whisper: {wav_path}")
-            
-            # Verify file exists and is not empty
-            if not os.path.exists(wav_path):
-                print(f"❌ Audio file not found: {wav_path}")
-                return None
-                
-            if os.path.getsize(wav_path) == 0:
-                print(f"❌ Audio file is empty: {wav_path}")
+            for event in self.stream_segments(audio_input):
+                if event["event"] == "language":
+                    language_event = event
+                else:
+                    transcript_parts.append(event["text"])
+                    total_duration = max(total_duration, event["end"])
+
+            if language_event is None:
                 return None
 
-            segments, info = self.whisper_model.transcribe(
-                wav_path,
-                beam_size=5,
-                language=None,
-                task="transcribe",
-                vad_filter=True,
-                vad_parameters=dict(min_silence_duration_ms=1000),
-                word_timestamps=False,
-                condition_on_previous_text=True
-            )
+            return self.build_result(language_event, transcript_parts, total_duration)
 
-            transcript_parts = []
-            total_duration = 0
-            for segment in segments:
-                transcript_parts.append(segment.text)
-                total_duration = max(total_duration, segment.end)
+        except Exception:
+            logger.exception("Faster-Whisper transcription error")
+            return None
 
-            full_transcript = " ".join(transcript_parts).strip()
+    def transcribe_stream(self, audio_input):
+        """Streaming transcription - yields language, segment and done/error events"""
+        if not self.ensure_model():
+            yield {"event": "error", "message": "Faster-Whisper not available. Please install: pip install faster-whisper"}
+            return
 
-            # Clean up temporary WAV file if it was created
-            try:
-                if wav_path != audio_input and os.path.exists(wav_path):
-                    os.unlink(wav_path)
-                    print(f"🧹 Cleaned up temporary file: {wav_path}")
-            except:
-                pass
-
-            detected_language = info.language
-            language_confidence = info.language_probability
-
-            language_names = {
-                'hi': 'Hindi', 'kn': 'Kannada', 'mr': 'Marathi',
-                'ta': 'Tamil', 'te': 'Telugu', 'bn': 'Bengali',
-                'gu': 'Gujarati', 'pa': 'Punjabi', 'en': 'English',
-                'ur': 'Urdu', 'ne': 'Nepali', 'si': 'Sinhala',
-                'ml': 'Malayalam', 'or': 'Odia', 'as': 'Assamese'
-            }
+        cache_key = None
+        audio_bytes = self._read_input_bytes(audio_input)
+        if audio_bytes:
+            cache_key = self.cache_key(audio_bytes)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Transcription cache hit")
+                cached["cache_hit"] = True
+                yield {
+                    "event": "segment",
+                    "index": 0,
+                    "start": 0.0,
+                    "end": cached.get("duration", 0.0),
+                    "text": cached["text"]
+                }
+                yield {"event": "done", **cached}
+                return
+            audio_input = audio_bytes
+
+        try:
+            language_event = None
+            transcript_parts = []
+            total_duration = 0
 
-            language_name = language_names.get(detected_language, detected_language.upper())
-            confidence_level = "high" if language_confidence > 0.8 else "medium" if language_confidence > 0.5 else "low"
+            for event in self.stream_segments(audio_input):
+                if event["event"] == "language":
+                    language_event = event
+                else:
+                    transcript_parts.append(event["text"])
+                    total_duration = max(total_duration, event["end"])
+                yield event
 
-            print(f"✅ Transcription completed!")
-            print(f"   Language: {language_name} ({language_confidence:.2f})")
-            print(f"   Duration: {total_duration:.1f}s")
-            print(f"   Text: {full_transcript[:100]}{'...' if len(full_transcript) > 100 else ''}")
+            if language_event is None or not " ".join(transcript_parts).strip():
+                yield {"event": "error", "message": "Unable to transcribe audio. Please check audio quality and format."}
+                return
 
-            return {
-                "text": full_transcript,
-                "language": language_name,
-                "language_code": detected_language,
-                "language_confidence": language_confidence,
-                "duration": total_duration,
-                "source": "faster_whisper",
-                "confidence": confidence_level,
-                "segments_count": len(transcript_parts)
-            }
+            result = self.build_result(language_event, transcript_parts, total_duration)
+            if cache_key:
+                self.cache.set(cache_key, result)
+            result["cache_hit"] = False
+            yield {"event": "done", **result}
 
         except Exception as e:
-            print(f"❌ Faster-Whisper transcription error: {e}")
-            import traceback
-            traceback.print_exc()
-            
-            # Clean up on error
-            try:
-                if 'wav_path' in locals() and wav_path != audio_input and os.path.exists(wav_path):
-                    os.unlink(wav_path)
-            except:
-                pass
-            return None
+            logger.error("Faster-Whisper transcription error: %s", e)
+            yield {"event": "error", "message": f"Transcription error: {str(e)}"}
 
     def transcribe_audio(self, audio_input, preferred_language="auto"):
-        """Main transcription method - handles both file objects and file paths"""
-        if not self.whisper_available:
+        """Main transcription method - handles bytes, file objects and file paths"""
+        if not self.ensure_model():
             return {
                 "text": "Faster-Whisper not available. Please install: pip install faster-whisper",
                 "language": "unknown",
@@ -181,28 +465,63 @@ class EnhancedSpeechToText:
                 "confidence": "low"
             }
 
-        print("🎯 Starting transcription...")
-        print(f"   Input type: {type(audio_input)}")
-        if isinstance(audio_input, str):
-            print(f"   File path: {audio_input}")
-            print(f"   File exists: {os.path.exists(audio_input)}")
-            print(f"   File size: {os.path.getsize(audio_input) if os.path.exists(audio_input) else 'N/A'} bytes")
+        # Consult the result cache before doing any decoding or inference
+        cache_key = None
+        audio_bytes = self._read_input_bytes(audio_input)
+        if audio_bytes:
+            cache_key = self.cache_key(audio_bytes)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Transcription cache hit")
+                cached["cache_hit"] = True
+                return cached
+            audio_input = audio_bytes
         
         result = self.faster_whisper_transcribe(audio_input)
 
         if result and result["text"] and result["text"].strip():
-            print("✅ Transcription successful!")
+            if cache_key:
+                self.cache.set(cache_key, result)
+            result["cache_hit"] = False
             return result
         else:
-            print("❌ Transcription failed or returned empty text")
+            logger.warning("Transcription failed or returned empty text")
 
         return {
             "text": "Unable to transcribe audio. Please check audio quality and format.",
             "language": "unknown",
             "language_code": "unknown",
             "source": "failed",
-            "confidence": "low"
+            "confidence": "low",
+            "cache_hit": False
         }
 
+    def cache_key(self, audio_bytes):
+        """Content hash of the audio plus every setting that changes the transcript"""
+        return content_key(
+            audio_bytes,
+            engine="faster_whisper",
+            model=WHISPER_MODEL_SIZE,
+            compute_type=WHISPER_COMPUTE_TYPE,
+            beam_size=WHISPER_BEAM_SIZE,
+            vad_filter=True
+        )
+
+    def _read_input_bytes(self, audio_input):
+        """Read raw audio bytes from bytes, a file path or a file object, None if unreadable"""
+        try:
+            if isinstance(audio_input, (bytes, bytearray)):
+                return audio_input
+            if isinstance(audio_input, str):
+                if not os.path.exists(audio_input):
+                    return None
+                with open(audio_input, 'rb') as f:
+                    return f.read()
+            audio_input.seek(0)
+            return audio_input.read()
+        except Exception as e:
+            logger.warning("Could not read audio for caching: %s", e)
+            return None
+
 # Global instance
 enhanced_speech = EnhancedSpeechToText()
@@ -0,0 +1,402 @@
+# jobs.py - background /full-workflow jobs with pluggable queue backends
+import asyncio
+import ipaddress
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
+import backoff
+import requests
+from dotenv import load_dotenv
+from log import get_logger
+
+load_dotenv()
+
+logger = get_logger("jobs")
+
+# "process": local process pool sized separately from the HTTP workers
+# "thread": tasks on the API's event loop (development, or when models must be shared with the API)
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "process")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "spawn")
+JOB_WARM_UP = os.getenv("JOB_WARM_UP", "0") == "1"
+# Jobs queued or running at once; further submissions are refused with 429
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", str(8 * JOB_WORKERS)))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(60 * 60)))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", "1000"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_TRIES = int(os.getenv("WEBHOOK_MAX_TRIES", "4"))
+# Comma separated hosts webhooks may be sent to ("hooks.example.com", or ".example.com"
+# for every subdomain). When empty, any https host with a public address is allowed
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+# Worker-process state: progress queue and a long-lived event loop, so the
+# async Gemini clients keep their limiter and connections between jobs. A pool
+# process runs one job at a time, so every client is only ever used on this loop
+_progress_queue = None
+_worker_local = threading.local()
+
+def _init_worker(progress_queue, warm_up=False, pool_process=False):
+    """Process pool initializer - runs once in each worker process"""
+    global _progress_queue
+    _progress_queue = progress_queue
+
+    if pool_process:
+        from enhanced_ocr import enhanced_ocr
+        # Jobs are already spread over the pool; don't fan regions out again
+        enhanced_ocr.region_parallel = False
+
+    if warm_up:
+        from enhanced_speech import enhanced_speech
+        from enhanced_ocr import enhanced_ocr
+        enhanced_speech.warm_up()
+        enhanced_ocr.warm_up()
+
+def _worker_loop():
+    loop = getattr(_worker_local, "loop", None)
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        _worker_local.loop = loop
+    return loop
+
+def _report(job_id, stage, data):
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage, data))
+
+async def _run_workflow(job_id, audio_bytes, image_bytes, response_data, analysis_mode):
+    from workflow import (
+        prepare_analysis_text, transcribe_upload, ocr_upload,
+        apply_transcription_stage, apply_ocr_stage, run_analysis_stage
+    )
+    loop = asyncio.get_running_loop()
+    language = response_data["language"]
+
+    # STEP 1 + STEP 2 run concurrently; each is reported as soon as it finishes
+    async def transcription():
+        if audio_bytes is None:
+            result = {"transcription": "No audio file provided", "text": ""}
+        elif len(audio_bytes) == 0:
+            result = {"transcription": "Error: Audio file is empty", "text": ""}
+        else:
+            result = await loop.run_in_executor(None, transcribe_upload, audio_bytes)
+
+        apply_transcription_stage(response_data, result)
+        _report(job_id, "transcription", {
+            "transcription": response_data["transcription"],
+            "cache_hit": response_data["cache_hits"]["transcription"]
+        })
+        return result
+
+    async def ocr():
+        if image_bytes is None:
+            result = {"extracted_text": "No image file provided", "text": "", "formatted_report": ""}
+        else:
+            result = await loop.run_in_executor(None, ocr_upload, image_bytes)
+
+        apply_ocr_stage(response_data, result)
+        _report(job_id, "ocr", {
+            "extracted_text": response_data["extracted_text"],
+            "formatted_report": response_data["formatted_report"],
+            "lab_values": response_data["lab_values"],
+            "cache_hit": response_data["cache_hits"]["ocr"]
+        })
+        return result
+
+    audio_stage, ocr_result = await asyncio.gather(transcription(), ocr())
+
+    # STEP 3 + STEP 4
+    combined_text = await prepare_analysis_text(
+        response_data, audio_stage["text"], ocr_result["text"], ocr_result.get("lab_values"), ocr_result.get("other_text")
+    )
+    await run_analysis_stage(response_data, combined_text, language, analysis_mode)
+    _report(job_id, "analysis", {
+        "chatbot_reply": response_data["chatbot_reply"],
+        "sources": response_data["sources"],
+        "search_performed": response_data["search_performed"],
+        "summary": response_data["summary"],
+        "analysis_mode": response_data["analysis_mode"],
+        "token_counts": response_data["token_counts"]
+    })
+    return response_data
+
+async def run_workflow_job_async(job_id, audio_bytes, image_bytes, response_data, analysis_mode=None):
+    """Job entry point on an event loop - returns the final response"""
+    _report(job_id, "running", {})
+    return await _run_workflow(job_id, audio_bytes, image_bytes, response_data, analysis_mode)
+
+def run_workflow_job(job_id, audio_bytes, image_bytes, response_data, analysis_mode=None):
+    """Job entry point in a worker process"""
+    return _worker_loop().run_until_complete(
+        run_workflow_job_async(job_id, audio_bytes, image_bytes, response_data, analysis_mode)
+    )
+
+class ProcessQueueBackend:
+    """Local process pool; progress flows back over a multiprocessing queue"""
+    name = "process"
+
+    def __init__(self, workers=JOB_WORKERS, start_method=JOB_START_METHOD):
+        self.workers = workers
+        self.context = multiprocessing.get_context(start_method)
+        self.progress_queue = self.context.Queue()
+        self._lock = threading.Lock()
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self.context,
+            initializer=_init_worker,
+            initargs=(self.progress_queue, JOB_WARM_UP, True)
+        )
+
+    def submit(self, job_args):
+        with self._lock:
+            try:
+                return self.executor.submit(run_workflow_job, *job_args)
+            except BrokenProcessPool:
+                # A worker died (OOM kill, segfault in a native library); the pool
+                # refuses all further work, so replace it
+                logger.warning("Job process pool broken, starting a new one")
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._new_executor()
+                return self.executor.submit(run_workflow_job, *job_args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ThreadQueueBackend:
+    """Jobs as tasks on the API's event loop, sharing its Gemini and search clients.
+
+    The async clients' limiters and connection pools belong to that loop, so jobs
+    must not run on loops of their own; transcription and OCR still go to threads.
+    """
+    name = "thread"
+
+    def __init__(self, workers=JOB_WORKERS):
+        # Created from a request handler, i.e. on the server loop
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(workers)
+        self.progress_queue = queue.Queue()
+        _init_worker(self.progress_queue)
+
+    async def _run(self, job_args):
+        async with self.slots:
+            return await run_workflow_job_async(*job_args)
+
+    def submit(self, job_args):
+        return asyncio.run_coroutine_threadsafe(self._run(job_args), self.loop)
+
+    def shutdown(self):
+        pass
+
+# Other backends (e.g. a Redis-backed queue) register here. A backend needs
+# submit(job_args) -> concurrent Future of run_workflow_job(*job_args), a
+# progress_queue of (job_id, stage, data), and shutdown()
+JOB_QUEUE_BACKENDS = {
+    "process": ProcessQueueBackend,
+    "thread": ThreadQueueBackend,
+}
+
+def register_job_backend(name, backend_cls):
+    JOB_QUEUE_BACKENDS[name] = backend_cls
+
+class WebhookURLError(ValueError):
+    pass
+
+def _host_allowed(host):
+    return any(
+        host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+        for allowed in WEBHOOK_ALLOWED_HOSTS
+    )
+
+def validate_webhook_url(url):
+    """Webhooks carry medical results: https only, and never to internal addresses"""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or not host:
+        raise WebhookURLError("webhook_url must be an https URL")
+    if parts.username or parts.password:
+        raise WebhookURLError("webhook_url must not contain credentials")
+    if WEBHOOK_ALLOWED_HOSTS and not _host_allowed(host):
+        raise WebhookURLError(f"webhook host {host} is not allowed")
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError):
+        raise WebhookURLError(f"webhook host {host} does not resolve")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise WebhookURLError(f"webhook host {host} resolves to a non-public address")
+
+@backoff.on_exception(backoff.expo, requests.RequestException, max_tries=WEBHOOK_MAX_TRIES)
+def post_webhook(url, payload):
+    # Checked again at send time: DNS may have changed since the job was queued
+    validate_webhook_url(url)
+    # Redirects could point the payload at an internal host
+    response = requests.post(url, json=payload, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+    response.raise_for_status()
+
+class JobQueueFullError(RuntimeError):
+    """JOB_QUEUE_MAX jobs are already queued or running"""
+
+class JobManager:
+    """Tracks job status and per-stage partial results, and fires completion webhooks"""
+
+    def __init__(self, backend_name=JOB_QUEUE_BACKEND, max_active=JOB_QUEUE_MAX):
+        self.backend_name = backend_name
+        self.backend = None
+        self.max_active = max_active
+        # Queued + running jobs; each holds its uploads until it finishes
+        self.active = 0
+        self.rejected = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._webhooks = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhook")
+        self._listener = None
+
+    def _ensure_backend(self):
+        # Worker processes are only started once the first job arrives
+        with self._lock:
+            if self.backend is None:
+                backend_cls = JOB_QUEUE_BACKENDS.get(self.backend_name)
+                if backend_cls is None:
+                    logger.warning("Unknown job queue backend %r, using process pool", self.backend_name)
+                    backend_cls = ProcessQueueBackend
+                self.backend = backend_cls()
+                self._listener = threading.Thread(
+                    target=self._listen, args=(self.backend.progress_queue,), daemon=True
+                )
+                self._listener.start()
+        return self.backend
+
+    def submit(self, audio_bytes, image_bytes, response_data, analysis_mode=None, webhook_url=None):
+        """Queue a full-workflow job and return its id immediately"""
+        backend = self._ensure_backend()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock:
+            if self.active >= self.max_active:
+                self.rejected += 1
+                raise JobQueueFullError(f"{self.active} jobs are already queued or running")
+            self.active += 1
+            self._evict(now)
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": now,
+                "updated_at": now,
+                "stages": {},
+                "result": None,
+                "error": None,
+                "webhook_url": webhook_url,
+            }
+
+        try:
+            future = backend.submit((job_id, audio_bytes, image_bytes, response_data, analysis_mode))
+        except Exception:
+            with self._lock:
+                self.active -= 1
+                del self._jobs[job_id]
+            raise
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        logger.info("Queued workflow job", extra={"job_id": job_id, "backend": backend.name})
+        return job_id
+
+    def get(self, job_id):
+        """Status snapshot of a job, or None when unknown or expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {key: value for key, value in job.items() if key != "webhook_url"}
+            snapshot["stages"] = dict(job["stages"])
+            return snapshot
+
+    def _listen(self, progress_queue):
+        while True:
+            try:
+                job_id, stage, data = progress_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                # Progress can arrive after the job's future has already resolved
+                if stage != "running":
+                    job["stages"][stage] = data
+                elif job["status"] == "queued":
+                    job["status"] = "running"
+                job["updated_at"] = time.time()
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            self.active -= 1
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            try:
+                job["result"] = future.result()
+                job["status"] = "completed"
+            except Exception as e:
+                logger.exception("Workflow job %s failed", job_id)
+                job["error"] = str(e)
+                job["status"] = "failed"
+            job["updated_at"] = time.time()
+            webhook_url = job["webhook_url"]
+
+        logger.info("Workflow job finished", extra={"job_id": job_id, "status": job["status"]})
+        if webhook_url:
+            self._webhooks.submit(self._notify, webhook_url, job_id)
+
+    def _notify(self, webhook_url, job_id):
+        try:
+            post_webhook(webhook_url, self.get(job_id))
+        except Exception as e:
+            logger.error("Webhook for job %s failed: %s", job_id, e)
+
+    def _evict(self, now):
+        """Drop finished jobs past their TTL, then the oldest finished ones over the cap"""
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in ("completed", "failed")
+        ]
+        for job_id in finished:
+            if self._jobs[job_id]["updated_at"] + JOB_RESULT_TTL <= now:
+                del self._jobs[job_id]
+
+        overflow = len(self._jobs) - JOB_MAX_STORED
+        for job_id in finished:
+            if overflow <= 0:
+                break
+            if job_id in self._jobs:
+                del self._jobs[job_id]
+                overflow -= 1
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {
+                "backend": self.backend_name,
+                "jobs": counts,
+                "active": self.active,
+                "max_active": self.max_active,
+                "rejected": self.rejected
+            }
+
+    def shutdown(self):
+        if self.backend is not None:
+            self.backend.shutdown()
+        self._webhooks.shutdown(wait=False)
+
+# Global instance
+job_manager = JobManager()
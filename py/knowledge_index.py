@@ -0,0 +1,349 @@
+# knowledge_index.py - local BM25 (+ optional vector) retrieval over a curated medical corpus
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from search_cache import STOPWORDS
+from log import get_logger
+
+load_dotenv()
+
+logger = get_logger("knowledge")
+
+KNOWLEDGE_INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", "knowledge_index")
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "5"))
+# Documents are indexed as passages of about this many words
+KNOWLEDGE_PASSAGE_WORDS = int(os.getenv("KNOWLEDGE_PASSAGE_WORDS", "200"))
+KNOWLEDGE_SNIPPET_CHARS = int(os.getenv("KNOWLEDGE_SNIPPET_CHARS", "1500"))
+# Sentence-transformers model for the optional vector index, e.g. "all-MiniLM-L6-v2"; empty disables it
+KNOWLEDGE_EMBEDDING_MODEL = os.getenv("KNOWLEDGE_EMBEDDING_MODEL", "")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant for combining BM25 and vector rankings
+RRF_K = 60
+MAX_TERM_LENGTH = 40
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH
+    ]
+
+def split_passages(text, words_per_passage=KNOWLEDGE_PASSAGE_WORDS):
+    """Paragraph-aligned passages of roughly words_per_passage words"""
+    passages = []
+    current = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if current and len(current) + len(words) > words_per_passage:
+            passages.append(" ".join(current))
+            current = []
+        current.extend(words)
+        while len(current) > words_per_passage:
+            passages.append(" ".join(current[:words_per_passage]))
+            current = current[words_per_passage:]
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+class Segment:
+    """One immutable ingestion batch; every array is memory-mapped, nothing is read up front"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lexicon = np.load(os.path.join(path, "lexicon.npy"), mmap_mode="r")
+        self.term_offsets = np.load(os.path.join(path, "term_offsets.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self.frequencies = np.load(os.path.join(path, "frequencies.npy"), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r")
+
+        vectors_path = os.path.join(path, "vectors.npy")
+        self.vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+
+        self._docs_file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def postings_for(self, term):
+        """(doc ids, term frequencies) for a term, or None"""
+        index = int(np.searchsorted(self.lexicon, term))
+        if index >= len(self.lexicon) or self.lexicon[index] != term:
+            return None
+        start, end = self.term_offsets[index], self.term_offsets[index + 1]
+        return self.postings[start:end], self.frequencies[start:end]
+
+    def document(self, doc_id):
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        return json.loads(self._docs[start:end])
+
+    def close(self):
+        self._docs.close()
+        self._docs_file.close()
+
+def write_segment(path, passages, vectors=None):
+    """Build the inverted index for a batch of passages and write it as a segment directory"""
+    inverted = {}
+    doc_lengths = []
+    for doc_id, passage in enumerate(passages):
+        tokens = tokenize(passage["text"])
+        doc_lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            inverted.setdefault(token, []).append((doc_id, count))
+
+    terms = sorted(inverted)
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings = []
+    frequencies = []
+    for index, term in enumerate(terms):
+        entries = inverted[term]
+        postings.extend(doc_id for doc_id, _ in entries)
+        frequencies.extend(min(count, 65535) for _, count in entries)
+        term_offsets[index + 1] = len(postings)
+
+    os.makedirs(path)
+    np.save(os.path.join(path, "lexicon.npy"), np.array(terms, dtype=f"<U{MAX_TERM_LENGTH}"))
+    np.save(os.path.join(path, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(path, "postings.npy"), np.array(postings, dtype=np.uint32))
+    np.save(os.path.join(path, "frequencies.npy"), np.array(frequencies, dtype=np.uint16))
+    np.save(os.path.join(path, "doc_lengths.npy"), np.array(doc_lengths, dtype=np.uint32))
+
+    doc_offsets = [0]
+    with open(os.path.join(path, "docs.jsonl"), "wb") as f:
+        for passage in passages:
+            line = (json.dumps(passage, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            doc_offsets.append(doc_offsets[-1] + len(line))
+    np.save(os.path.join(path, "doc_offsets.npy"), np.array(doc_offsets, dtype=np.int64))
+
+    if vectors is not None:
+        np.save(os.path.join(path, "vectors.npy"), vectors.astype(np.float32))
+
+    return sum(doc_lengths)
+
+class KnowledgeIndex:
+    """Segmented on-disk index: each ingest adds a segment, meta.json lists the live ones"""
+
+    def __init__(self, path=KNOWLEDGE_INDEX_DIR, embedding_model=KNOWLEDGE_EMBEDDING_MODEL):
+        self.path = path
+        self.embedding_model = embedding_model
+        self._embedder = None
+        self._segments = []
+        self._meta = {"segments": [], "documents": 0, "total_length": 0}
+        self._meta_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def refresh(self):
+        """Open new segments when meta.json changed (e.g. after an ingest from the CLI)"""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._meta_mtime:
+            return
+
+        with self._lock:
+            if mtime == self._meta_mtime:
+                return
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            opened = {os.path.basename(segment.path): segment for segment in self._segments}
+            self._segments = [
+                opened.pop(name, None) or Segment(os.path.join(self.path, name))
+                for name in meta["segments"]
+            ]
+            for segment in opened.values():
+                segment.close()
+            self._meta = meta
+            self._meta_mtime = mtime
+        logger.info("Knowledge index loaded", extra={"passages": meta["documents"], "segments": len(meta["segments"])})
+
+    def _embed(self, texts):
+        """Normalized embeddings, or None when the vector index is disabled or unavailable"""
+        if not self.embedding_model:
+            return None
+        if self._embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                logger.warning("sentence-transformers not installed - vector index disabled")
+                self.embedding_model = ""
+                return None
+            self._embedder = SentenceTransformer(self.embedding_model)
+        return np.asarray(self._embedder.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+    def add_documents(self, documents):
+        """Ingest {"title", "url", "text"} documents as a new segment; returns the passage count"""
+        passages = []
+        for document in documents:
+            for number, text in enumerate(split_passages(document["text"]), 1):
+                passages.append({
+                    "title": document.get("title", ""),
+                    "url": document.get("url", ""),
+                    "passage": number,
+                    "text": text
+                })
+        if not passages:
+            return 0
+
+        vectors = self._embed(passage["text"] for passage in passages)
+
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            meta = self._meta
+            if os.path.exists(self._meta_path):
+                with open(self._meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+
+            name = f"segment-{time.time_ns()}"
+            total_length = write_segment(os.path.join(self.path, name), passages, vectors)
+
+            meta = {
+                "segments": meta["segments"] + [name],
+                "documents": meta["documents"] + len(passages),
+                "total_length": meta["total_length"] + total_length,
+                "embedding_model": self.embedding_model if vectors is not None else meta.get("embedding_model", "")
+            }
+            tmp_path = f"{self._meta_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path)
+
+        self.refresh()
+        return len(passages)
+
+    def _bm25(self, terms):
+        """BM25 scores per segment, with document frequencies summed over all segments"""
+        total_docs = self._meta["documents"]
+        average_length = self._meta["total_length"] / max(1, total_docs)
+
+        term_postings = []
+        for term in set(terms):
+            per_segment = [segment.postings_for(term) for segment in self._segments]
+            df = sum(len(found[0]) for found in per_segment if found is not None)
+            if df:
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                term_postings.append((idf, per_segment))
+
+        scores = [np.zeros(len(segment), dtype=np.float32) for segment in self._segments]
+        for idf, per_segment in term_postings:
+            for index, found in enumerate(per_segment):
+                if found is None:
+                    continue
+                doc_ids, frequencies = found
+                tf = frequencies.astype(np.float32)
+                lengths = self._segments[index].doc_lengths[doc_ids].astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+                scores[index][doc_ids] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def _top(self, scores, k):
+        """Best (score, segment index, doc id) triples across segments"""
+        candidates = []
+        for index, segment_scores in enumerate(scores):
+            if not len(segment_scores):
+                continue
+            count = min(k, len(segment_scores))
+            best = np.argpartition(-segment_scores, count - 1)[:count]
+            candidates.extend(
+                (float(segment_scores[doc_id]), index, int(doc_id))
+                for doc_id in best if segment_scores[doc_id] > 0
+            )
+        return sorted(candidates, reverse=True)[:k]
+
+    def search(self, query, k=KNOWLEDGE_TOP_K):
+        """Top passages for the query: [{title, url, passage, text, score, bm25}]"""
+        self.refresh()
+        with self._lock:
+            if not self._segments:
+                return []
+
+            lexical = self._top(self._bm25(tokenize(query)), k)
+            fused = {}
+            for rank, (score, index, doc_id) in enumerate(lexical):
+                fused[(index, doc_id)] = {"score": 1 / (RRF_K + rank + 1), "bm25": score}
+
+            query_vector = self._embed([query]) if self._meta.get("embedding_model") else None
+            if query_vector is not None:
+                similarities = [
+                    np.asarray(segment.vectors @ query_vector[0]) if segment.vectors is not None
+                    else np.zeros(len(segment), dtype=np.float32)
+                    for segment in self._segments
+                ]
+                for rank, (_, index, doc_id) in enumerate(self._top(similarities, k)):
+                    entry = fused.setdefault((index, doc_id), {"score": 0.0, "bm25": 0.0})
+                    entry["score"] += 1 / (RRF_K + rank + 1)
+
+            ranked = sorted(fused.items(), key=lambda item: item[1]["score"], reverse=True)[:k]
+            return [
+                {**self._segments[index].document(doc_id), **entry}
+                for (index, doc_id), entry in ranked
+            ]
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                "path": self.path,
+                "segments": len(self._segments),
+                "passages": self._meta["documents"],
+                "vector_index": bool(self._meta.get("embedding_model"))
+            }
+
+def as_search_results(passages, snippet_chars=KNOWLEDGE_SNIPPET_CHARS):
+    """Passages in the {url: {snippet, title}} shape that build_context_block expects"""
+    results = {}
+    for passage in passages:
+        url = passage["url"] or f"local:{passage['title']}"
+        results[f"{url}#passage-{passage['passage']}"] = {
+            "snippet": passage["text"][:snippet_chars],
+            "title": passage["title"]
+        }
+    return results
+
+def load_documents(paths):
+    """.jsonl files of {"title", "url", "text"}; any other file is one plain-text document"""
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield {"title": os.path.splitext(os.path.basename(path))[0], "url": "", "text": f.read()}
+
+# Global instance
+knowledge_index = KnowledgeIndex()
+
+if __name__ == "__main__":
+    # python knowledge_index.py add corpus.jsonl notes.md ...
+    # python knowledge_index.py search "normal hemoglobin range"
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "add":
+        print(f"✅ Indexed {knowledge_index.add_documents(load_documents(args))} passages")
+    elif command == "search":
+        started = time.perf_counter()
+        passages = knowledge_index.search(" ".join(args))
+        print(f"🔎 {len(passages)} passages in {(time.perf_counter() - started) * 1000:.1f} ms")
+        for passage in passages:
+            print(f"   {passage['score']:.4f} bm25={passage['bm25']:.2f} {passage['title']} #{passage['passage']}: "
+                  f"{passage['text'][:100]}")
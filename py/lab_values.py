@@ -0,0 +1,289 @@
+# lab_values.py - structured lab results (test, value, unit, reference range, flag) from OCR output
+import re
+from collections import deque
+
+# Bump when ANALYTES or the parsing rules change - part of the OCR cache key
+LAB_DICTIONARY_VERSION = 3
+
+# Canonical analyte -> aliases as they appear on Indian/US/UK lab reports
+ANALYTES = {
+    "Hemoglobin": ["hemoglobin", "haemoglobin", "hb", "hgb"],
+    "RBC Count": ["rbc count", "rbc", "red blood cell count", "red blood cells", "total rbc count"],
+    "WBC Count": ["wbc count", "wbc", "white blood cell count", "total leukocyte count", "tlc", "total wbc count"],
+    "Platelet Count": ["platelet count", "platelets", "plt"],
+    "Hematocrit": ["hematocrit", "haematocrit", "pcv", "packed cell volume", "hct"],
+    "MCV": ["mcv", "mean corpuscular volume"],
+    "MCH": ["mch", "mean corpuscular hemoglobin"],
+    "MCHC": ["mchc", "mean corpuscular hemoglobin concentration"],
+    "RDW": ["rdw", "rdw-cv", "red cell distribution width"],
+    "Neutrophils": ["neutrophils", "neutrophil", "polymorphs"],
+    "Lymphocytes": ["lymphocytes", "lymphocyte"],
+    "Monocytes": ["monocytes", "monocyte"],
+    "Eosinophils": ["eosinophils", "eosinophil"],
+    "Basophils": ["basophils", "basophil"],
+    "ESR": ["esr", "erythrocyte sedimentation rate"],
+    "Fasting Glucose": ["fasting blood sugar", "fbs", "fasting glucose", "glucose fasting", "fasting plasma glucose"],
+    "Postprandial Glucose": ["post prandial blood sugar", "postprandial glucose", "ppbs", "glucose pp", "post prandial glucose"],
+    "Random Glucose": ["random blood sugar", "rbs", "random glucose", "glucose random"],
+    "HbA1c": ["hba1c", "glycated hemoglobin", "glycosylated hemoglobin", "a1c"],
+    "Total Cholesterol": ["total cholesterol", "cholesterol total", "serum cholesterol", "cholesterol"],
+    "HDL Cholesterol": ["hdl cholesterol", "hdl", "hdl-c"],
+    "LDL Cholesterol": ["ldl cholesterol", "ldl", "ldl-c"],
+    "VLDL Cholesterol": ["vldl cholesterol", "vldl"],
+    "Triglycerides": ["triglycerides", "triglyceride", "tg"],
+    "Creatinine": ["serum creatinine", "creatinine"],
+    "Urea": ["blood urea", "urea", "serum urea"],
+    "BUN": ["blood urea nitrogen", "bun"],
+    "Uric Acid": ["uric acid", "serum uric acid"],
+    "Sodium": ["sodium", "na+", "serum sodium"],
+    "Potassium": ["potassium", "k+", "serum potassium"],
+    "Chloride": ["chloride", "cl-", "serum chloride"],
+    "Calcium": ["calcium", "serum calcium"],
+    "Total Bilirubin": ["total bilirubin", "bilirubin total", "serum bilirubin total"],
+    "Direct Bilirubin": ["direct bilirubin", "bilirubin direct", "conjugated bilirubin"],
+    "AST (SGOT)": ["sgot", "ast", "aspartate aminotransferase", "ast (sgot)", "sgot (ast)"],
+    "ALT (SGPT)": ["sgpt", "alt", "alanine aminotransferase", "alt (sgpt)", "sgpt (alt)"],
+    "Alkaline Phosphatase": ["alkaline phosphatase", "alp"],
+    "Total Protein": ["total protein", "serum protein", "protein total"],
+    "Albumin": ["albumin", "serum albumin"],
+    "Globulin": ["globulin"],
+    "TSH": ["tsh", "thyroid stimulating hormone"],
+    "T3": ["t3", "total t3", "triiodothyronine"],
+    "T4": ["t4", "total t4", "thyroxine"],
+    "Vitamin D": ["vitamin d", "25-oh vitamin d", "25 hydroxy vitamin d", "vit d"],
+    "Vitamin B12": ["vitamin b12", "vit b12", "cobalamin"],
+    "Iron": ["serum iron", "iron"],
+    "Ferritin": ["ferritin", "serum ferritin"],
+    "CRP": ["crp", "c-reactive protein", "c reactive protein"],
+}
+
+UNIT_PATTERN = re.compile(
+    r"^(g/dl|gm/dl|gm%|mg/dl|mg/l|g/l|mmol/l|meq/l|µmol/l|umol/l|iu/l|u/l|µiu/ml|uiu/ml|miu/l|"
+    r"ng/ml|ng/dl|pg/ml|pg|fl|%|mm/hr|mm/1st hr|cells/cumm|cells/µl|cells/ul|/cumm|/µl|/ul|"
+    r"lakhs/cumm|lakh/cumm|million/cumm|mill/cumm|10\^3/µl|10\^3/ul|10\^6/µl|10\^6/ul|x10\^3/µl|x10\^6/µl|"
+    r"thou/mm3|mill/mm3|ratio)$",
+    re.IGNORECASE
+)
+NUMBER_PATTERN = re.compile(r"^[<>]?\d{1,3}(?:,\d{3})+(?:\.\d+)?$|^[<>]?\d+(?:\.\d+)?$")
+RANGE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:-|–|to)\s*(\d+(?:\.\d+)?)")
+LIMIT_PATTERN = re.compile(r"(<|>|<=|>=|≤|≥|upto|up to|less than|more than)\s*(\d+(?:\.\d+)?)", re.IGNORECASE)
+# Separators allowed between a test name and its value: "Hemoglobin: 13.5", "Hb - 13.5"
+SEPARATOR_PATTERN = re.compile(r"^[:;=\-–]+$")
+FLAG_TOKENS = {"h": "high", "high": "high", "l": "low", "low": "low", "*": "abnormal", "abnormal": "abnormal"}
+
+class AhoCorasick:
+    """Trie with failure links - finds every alias in one pass over a line"""
+
+    def __init__(self, patterns):
+        # Node i: goto transitions, failure link and the patterns ending here
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append((len(pattern), value))
+
+        # Breadth-first failure links; depth-1 nodes fail back to the root
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                if node:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """All (start, end, value) matches"""
+        matches = []
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.output[node]:
+                matches.append((index - length + 1, index + 1, value))
+        return matches
+
+def _build_matcher():
+    return AhoCorasick(
+        (alias, canonical)
+        for canonical, aliases in ANALYTES.items()
+        for alias in aliases
+    )
+
+# Compiled once at import
+analyte_matcher = _build_matcher()
+
+def _is_boundary(text, start, end):
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not after.isalnum()
+
+def find_analytes(line):
+    """Leftmost-longest whole-word analyte matches in a line: [(start, end, canonical)]"""
+    lowered = line.lower()
+    matches = [
+        match for match in analyte_matcher.find(lowered)
+        if _is_boundary(lowered, match[0], match[1])
+    ]
+    matches.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+
+    selected = []
+    last_end = -1
+    for start, end, canonical in matches:
+        if start >= last_end:
+            selected.append((start, end, canonical))
+            last_end = end
+    return selected
+
+def _to_number(token):
+    return float(token.lstrip("<>").replace(",", ""))
+
+def parse_result(canonical, line, rest):
+    """Value, unit, reference range and flag from the text after the test name.
+
+    The value has to be the first token after the name (separators aside), as in a
+    table row - prose such as "advised iron supplements for 4 weeks" is not a result.
+    """
+    tokens = rest.replace("(", " ").replace(")", " ").replace("[", " ").replace("]", " ").split()
+    while tokens and SEPARATOR_PATTERN.match(tokens[0]):
+        tokens.pop(0)
+    if not tokens:
+        return None
+
+    value_text = tokens[0].strip(":;=")
+    if not NUMBER_PATTERN.match(value_text):
+        return None
+    value = _to_number(value_text)
+
+    unit = None
+    flag = None
+    for token in tokens[1:]:
+        cleaned = token.strip(":;=")
+        if unit is None and UNIT_PATTERN.match(cleaned):
+            unit = cleaned
+            continue
+        if flag is None and cleaned.lower() in FLAG_TOKENS:
+            flag = FLAG_TOKENS[cleaned.lower()]
+
+    # The reference range follows the value
+    after_value = rest[rest.find(value_text) + len(value_text):]
+    reference = None
+    range_match = RANGE_PATTERN.search(after_value)
+    if range_match:
+        low, high = float(range_match.group(1)), float(range_match.group(2))
+        reference = {"low": low, "high": high, "text": range_match.group(0)}
+    else:
+        limit_match = LIMIT_PATTERN.search(after_value)
+        if limit_match:
+            bound = float(limit_match.group(2))
+            if limit_match.group(1).lower() in ("<", "<=", "≤", "upto", "up to", "less than"):
+                reference = {"low": None, "high": bound, "text": limit_match.group(0)}
+            else:
+                reference = {"low": bound, "high": None, "text": limit_match.group(0)}
+
+    if flag is None and reference is not None:
+        if reference["low"] is not None and value < reference["low"]:
+            flag = "low"
+        elif reference["high"] is not None and value > reference["high"]:
+            flag = "high"
+        else:
+            flag = "normal"
+
+    return {
+        "test": canonical,
+        "value": value,
+        "value_text": value_text,
+        "unit": unit,
+        "reference_range": reference,
+        "flag": flag,
+        "line": line.strip()
+    }
+
+def extract_lab_values(lines):
+    """Typed lab records from text rows (one table row per line); "row" is the record's line index"""
+    records = []
+    for row, line in enumerate(lines):
+        seen = set()
+        matches = find_analytes(line)
+        for i, (start, end, canonical) in enumerate(matches):
+            # The result for a test runs up to the next test name on the same row
+            stop = matches[i + 1][0] if i + 1 < len(matches) else len(line)
+            record = parse_result(canonical, line, line[end:stop])
+            if record is None:
+                continue
+            # Only a test named twice on one row (an alias next to the name) is a duplicate;
+            # the same result on another row is a repeated measurement
+            key = (record["test"], record["value"])
+            if key not in seen:
+                seen.add(key)
+                record["row"] = row
+                records.append(record)
+    return records
+
+def rows_from_words(data):
+    """Rebuild table rows from image_to_data word boxes by vertical overlap.
+
+    Tesseract often puts the name, value and range columns of one table row
+    in different blocks; grouping by y-position puts them back on one row.
+    Returns (rows, row_words): the row texts and each row's word indexes into data.
+    """
+    words = []
+    for i, text in enumerate(data["text"]):
+        text = text.strip() if text else ""
+        if not text or float(data["conf"][i]) < 0:
+            continue
+        top, height = data["top"][i], data["height"][i]
+        words.append((top + height / 2, height, data["left"][i], text, i))
+
+    words.sort()
+    rows = []
+    for center, height, left, text, index in words:
+        if rows and abs(center - rows[-1]["center"]) <= max(height, rows[-1]["height"]) * 0.5:
+            rows[-1]["words"].append((left, text, index))
+        else:
+            rows.append({"center": center, "height": height, "words": [(left, text, index)]})
+
+    ordered = [sorted(row["words"]) for row in rows]
+    return (
+        [" ".join(text for _, text, _ in words) for words in ordered],
+        [[index for _, _, index in words] for words in ordered]
+    )
+
+def lab_row_words(records, row_words):
+    """Word indexes of the rows the records were parsed from"""
+    return {index for row in {record["row"] for record in records} for index in row_words[row]}
+
+def strip_lab_rows(lines, records):
+    """The lines no record was parsed from, by row index - everything else is kept"""
+    source_rows = {record["row"] for record in records}
+    return "\n".join(
+        line for row, line in enumerate(lines)
+        if line.strip() and row not in source_rows
+    )
+
+def format_lab_values(records):
+    """One compact line per record for LLM prompts"""
+    lines = []
+    for record in records:
+        line = f"{record['test']}: {record['value_text']}"
+        if record["unit"]:
+            line += f" {record['unit']}"
+        if record["reference_range"]:
+            line += f" (ref {record['reference_range']['text']})"
+        if record["flag"] and record["flag"] != "normal":
+            line += f" [{record['flag'].upper()}]"
+        lines.append(line)
+    return "\n".join(lines)
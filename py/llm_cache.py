@@ -0,0 +1,186 @@
+# llm_cache.py - response cache for Gemini calls
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+from result_cache import ResultCache, content_key
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(6 * 60 * 60)))
+# Near-duplicate (MinHash) tier is opt-in: a one-word change can flip a medical answer
+LLM_CACHE_NEAR_DUPLICATE = os.getenv("LLM_CACHE_NEAR_DUPLICATE", "0") == "1"
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.9"))
+LLM_CACHE_NEAR_MAX_ENTRIES = int(os.getenv("LLM_CACHE_NEAR_MAX_ENTRIES", "4096"))
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+MINHASH_PRIME = (1 << 61) - 1
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting-only differences share a key.
+
+    Case is kept: in medical text it carries meaning ("MS" vs "ms", "Mg" vs "mg").
+    """
+    return re.sub(r"\s+", " ", prompt).strip()
+
+class MinHashIndex:
+    """Locality-sensitive index of prompt signatures for near-duplicate lookups"""
+
+    def __init__(self, max_entries=LLM_CACHE_NEAR_MAX_ENTRIES, threshold=LLM_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+        rng = random.Random(1729)
+        self._params = [
+            (rng.randrange(1, MINHASH_PRIME), rng.randrange(0, MINHASH_PRIME))
+            for _ in range(MINHASH_PERMUTATIONS)
+        ]
+
+        # exact cache key -> (context, signature); buckets map band hashes to keys
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def signature(self, text):
+        words = text.split()
+        if len(words) < 3:
+            shingles = set(words) or {""}
+        else:
+            shingles = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+            for s in shingles
+        ]
+        return tuple(
+            min((a * h + b) % MINHASH_PRIME for h in hashes)
+            for a, b in self._params
+        )
+
+    def _bands(self, context, signature):
+        for band in range(MINHASH_BANDS):
+            start = band * self.rows
+            yield (context, band, signature[start:start + self.rows])
+
+    def add(self, key, context, signature):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (context, signature)
+            for band in self._bands(context, signature):
+                self._buckets.setdefault(band, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._bands(*entry):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def query(self, context, signature):
+        """Most similar indexed key above the threshold, or None"""
+        with self._lock:
+            candidates = set()
+            for band in self._bands(context, signature):
+                candidates.update(self._buckets.get(band, ()))
+
+            best_key = None
+            best_score = self.threshold
+            for key in candidates:
+                _, other = self._entries[key]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / MINHASH_PERMUTATIONS
+                if score >= best_score:
+                    best_key, best_score = key, score
+            return best_key
+
+class LLMResponseCache:
+    """Exact-match tier keyed by prompt + model + config, with an optional MinHash tier"""
+
+    def __init__(self, enabled=LLM_CACHE_ENABLED, near_duplicate=LLM_CACHE_NEAR_DUPLICATE):
+        self.enabled = enabled
+        self.exact = ResultCache("llm", max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL, disk_dir="")
+        self.near = MinHashIndex() if near_duplicate else None
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _context(self, model_name, system_instruction, generation_config):
+        return json.dumps(
+            {"model": model_name, "system": system_instruction, "config": generation_config},
+            sort_keys=True,
+            default=str
+        )
+
+    def _key(self, normalized, context):
+        return content_key(normalized.encode("utf-8"), context=context)
+
+    def get(self, prompt, model_name, system_instruction=None, generation_config=None):
+        if not self.enabled:
+            return None
+
+        normalized = normalize_prompt(prompt)
+        context = self._context(model_name, system_instruction, generation_config)
+
+        value = self.exact.get(self._key(normalized, context))
+        if value is not None:
+            self._count("exact_hits")
+            return value["text"]
+
+        if self.near is not None:
+            near_key = self.near.query(context, self.near.signature(normalized))
+            if near_key is not None:
+                value = self.exact.get(near_key)
+                if value is not None:
+                    self._count("near_hits")
+                    return value["text"]
+                # Expired or evicted from the exact tier
+                self.near.discard(near_key)
+
+        self._count("misses")
+        return None
+
+    def set(self, prompt, model_name, text, system_instruction=None, generation_config=None):
+        if not self.enabled:
+            return
+
+        normalized = normalize_prompt(prompt)
+        context = self._context(model_name, system_instruction, generation_config)
+        key = self._key(normalized, context)
+
+        self.exact.set(key, {"text": text})
+        if self.near is not None:
+            self.near.add(key, context, self.near.signature(normalized))
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "entries": self.exact.stats()["entries"],
+                "bytes": self.exact.stats()["bytes"],
+                "near_duplicate": self.near is not None,
+            }
@@ -0,0 +1,74 @@
+# llm_clients.py - process-wide registry of Gemini models
+import json
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+MODEL_REGISTRY_SIZE = int(os.getenv("MODEL_REGISTRY_SIZE", "64"))
+
+# google.generativeai is slow to import, so it is
+# loaded on first use (or by warm-up) instead of at module import
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """Import and configure google.generativeai once"""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                if GEMINI_API_KEY:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                _genai = genai
+    return _genai
+
+def is_retryable_error(error):
+    """Gemini quota and availability errors are worth retrying"""
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable))
+
+class ClientRegistry:
+    """Creates each GenerativeModel once and hands it out per request"""
+
+    def __init__(self, max_models=MODEL_REGISTRY_SIZE):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _model_key(self, model_name, system_instruction, generation_config):
+        return (model_name, system_instruction, json.dumps(generation_config, sort_keys=True, default=str))
+
+    def get_model(self, model_name, system_instruction=None, generation_config=None):
+        """GenerativeModel for this system instruction + generation config, built once"""
+        key = self._model_key(model_name, system_instruction, generation_config)
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+        # All models share the SDK's process-wide client and its pooled channel
+        model = get_genai().GenerativeModel(
+            model_name,
+            system_instruction=system_instruction,
+            generation_config=generation_config
+        )
+
+        with self._lock:
+            model = self._models.setdefault(key, model)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        return model
+
+    def stats(self):
+        with self._lock:
+            return {"models": len(self._models)}
+
+# Global instance
+client_registry = ClientRegistry()
@@ -0,0 +1,160 @@
+# log.py - leveled, structured logging that never blocks the request path
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for the log pipeline
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Fraction of requests whose DEBUG records are kept (when LOG_LEVEL=DEBUG)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+# Records beyond this many waiting for the writer thread are dropped, not waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+LOGGER_NAME = "doctor_assistant"
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# None outside a request: background work follows LOG_DEBUG_SAMPLE_RATE per record
+debug_sampled_var = contextvars.ContextVar("debug_sampled", default=None)
+
+# Attributes every LogRecord has; anything else came in through extra= and is a structured field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "exception"}
+
+def start_request(request_id):
+    """Tag log records of the current request and decide whether its debug output is kept"""
+    request_id_var.set(request_id)
+    debug_sampled_var.set(random.random() < LOG_DEBUG_SAMPLE_RATE)
+
+def debug_sampled():
+    sampled = debug_sampled_var.get()
+    return random.random() < LOG_DEBUG_SAMPLE_RATE if sampled is None else sampled
+
+def debug_enabled(logger):
+    """Guard for debug output that is expensive to build (previews, sizes, dumps)"""
+    return logger.isEnabledFor(logging.DEBUG) and debug_sampled()
+
+class RequestContextFilter(logging.Filter):
+    """Adds request_id to every record and drops DEBUG records of unsampled requests"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        if record.levelno <= logging.DEBUG and not debug_sampled():
+            return False
+        return True
+
+def _exception_text(formatter, record):
+    """Traceback captured by DroppingQueueHandler, or formatted here for records logged directly"""
+    exception = getattr(record, "exception", None)
+    if exception is None and record.exc_info:
+        exception = formatter.formatException(record.exc_info)
+    return exception
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        exception = _exception_text(self, record)
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES
+        )
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} "
+                f"[{getattr(record, 'request_id', '-')}] {record.name}: {record.getMessage()}")
+        if fields:
+            line += f" {fields}"
+        exception = _exception_text(self, record)
+        if exception:
+            line += "\n" + exception
+        return line
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the writer falls behind instead of blocking"""
+
+    def prepare(self, record):
+        """Like QueueHandler.prepare, but the traceback goes to record.exception instead of into msg"""
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+        elif record.exc_text:
+            record.exception = record.exc_text
+        # Tracebacks hold frames that cannot be pickled or shared across threads safely
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+_listener = None
+
+def _configure():
+    """One queue handler on the app logger; a listener thread does the actual writing"""
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.handlers:
+        return logger
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
+
+def _reconfigure_after_fork():
+    """A forked child inherits the queue handler but not the listener thread - start its own"""
+    global _listener
+    if _listener is None:
+        return
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    _listener = None
+    _configure()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reconfigure_after_fork)
+
+def get_logger(name):
+    """Child of the app logger, e.g. get_logger("ocr") -> doctor_assistant.ocr"""
+    _configure()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
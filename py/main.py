@@ -3,22 +3,100 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from enhanced_speech import enhanced_speech
 from enhanced_ocr import enhanced_ocr
-from utils import enhanced_chatbot_response, get_language_name, get_supported_languages
-import google.generativeai as genai
+from utils import (
+    enhanced_chatbot_response_async, enhanced_chatbot_response_stream_async,
+    get_supported_languages, llm_cache, warm_up_llm, gemini_async, search_async
+)
+from jobs import job_manager, validate_webhook_url, WebhookURLError, JobQueueFullError
+from batch_ocr import batch_ocr, PageLimitError
+from prompt_budget import count_tokens
+from search_cache import search_cache
+from knowledge_index import knowledge_index
+from log import get_logger, start_request
+from metrics import stage, start_request_timings, server_timing_header, request_seconds, render_metrics, run_in_executor
+from workflow import (
+    NO_MEDICAL_DATA_MESSAGE, INSUFFICIENT_DATA_MESSAGE, summarize_text, summarize_text_stream,
+    prepare_analysis_text, fit_to_budget, record_output_tokens, get_medical_analysis_prompt, build_full_analysis,
+    transcribe_upload, ocr_upload, apply_transcription_stage, apply_ocr_stage, run_analysis_stage
+)
 import os
 import sys
 from dotenv import load_dotenv
-from fastapi.responses import JSONResponse
-from typing import Optional
-import tempfile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+from typing import List, Optional
+import asyncio
+import json
+import threading
+import time
+import uuid
 
 load_dotenv()
 
+logger = get_logger("api")
+
+# Models load in the background after the port opens; /ready reports when they are resident
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+readiness = {
+    "complete": False,
+    "components": {"speech": "pending", "ocr": "pending", "llm": "pending"}
+}
+
+async def warm_up():
+    """Load Whisper, probe Tesseract and import the Gemini client on their executors"""
+    loop = asyncio.get_running_loop()
+
+    async def warm_component(name, executor, warm_up_fn):
+        try:
+            ok = await loop.run_in_executor(executor, warm_up_fn)
+            readiness["components"][name] = "ready" if ok else "failed"
+        except Exception as e:
+            logger.error("Warm-up of %s failed: %s", name, e)
+            readiness["components"][name] = "failed"
+
+    await asyncio.gather(
+        warm_component("speech", audio_executor, enhanced_speech.warm_up),
+        warm_component("ocr", ocr_executor, enhanced_ocr.warm_up),
+        warm_component("llm", None, warm_up_llm)
+    )
+    readiness["complete"] = True
+    failed = failed_components()
+    if failed:
+        logger.error("Warm-up finished with failed components", extra={"failed": failed})
+    else:
+        logger.info("Warm-up finished", extra=readiness["components"])
+
+def failed_components():
+    return [name for name, status in readiness["components"].items() if status == "failed"]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_task = None
+    if WARMUP_ON_STARTUP:
+        warm_up_task = asyncio.create_task(warm_up())
+    else:
+        # Engines load lazily on their first request instead
+        readiness["components"] = {name: "lazy" for name in readiness["components"]}
+        readiness["complete"] = True
+
+    yield
+
+    if warm_up_task and not warm_up_task.done():
+        warm_up_task.cancel()
+    audio_executor.shutdown(wait=False, cancel_futures=True)
+    ocr_executor.shutdown(wait=False, cancel_futures=True)
+    await search_async.aclose()
+    job_manager.shutdown()
+    batch_ocr.shutdown()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="🏥 Doctor Assistant API",
     description="AI-powered medical assistant with OCR, speech-to-text, and medical search",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
@@ -28,8 +106,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Per-stage durations in a Server-Timing header, plus the request latency histogram"""
+    timings = start_request_timings()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # Label by route template, not raw path, so job ids don't create new series
+    route = request.scope.get("route")
+    request_seconds.observe(elapsed, path=getattr(route, "path", "unmatched"), method=request.method)
+
+    timings.append(("total", elapsed))
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Request id for every log record of the request (taken from X-Request-ID when the proxy sets one)"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    start_request(request_id)
+    started = time.perf_counter()
+    response = await call_next(request)
+    logger.info("%s %s", request.method, request.url.path, extra={
+        "status": response.status_code,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # Pydantic models
 class ChatRequest(BaseModel):
     message: str
@@ -51,6 +160,7 @@ class TranscriptionResponse(BaseModel):
     language_code: str = ""
     source: str = ""
     confidence: str = ""
+    cache_hit: bool = False
 
 class OCRResponse(BaseModel):
     text: str
@@ -58,52 +168,142 @@ class OCRResponse(BaseModel):
     source: str = ""
     confidence: float = 0.0
     formatted_report: str = ""
+    cache_hit: bool = False
+    lab_values: list = []
+    timings: dict = {}
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Bounded executors for the CPU-heavy stages so they never run on the event loop.
+# Threads are enough here: Whisper (CTranslate2) releases the GIL and
+# pytesseract runs the tesseract binary in a subprocess.
+# One audio thread per Whisper slot (replicas x num_workers), so the pool is never oversubscribed
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", str(enhanced_speech.models.concurrency)))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+
+audio_executor = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="audio")
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
 
-# Initialize Gemini
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+TRANSCRIPTION_RETRY_AFTER = os.getenv("TRANSCRIPTION_RETRY_AFTER", "5")
+JOB_RETRY_AFTER = os.getenv("JOB_RETRY_AFTER", "30")
 
-def summarize_text(text: str, language: str = "en") -> str:
-    """Summarize medical text using Gemini in specified language"""
-    if not GEMINI_API_KEY:
-        return "Gemini API key not configured for summarization."
+def admit_transcriptions(count: int = 1):
+    """Reserve transcription slots, or refuse with 429 when the Whisper queue is full"""
+    if not enhanced_speech.slots.try_acquire(count):
+        raise HTTPException(
+            status_code=429,
+            detail="Transcription queue is full, please retry shortly",
+            headers={"Retry-After": TRANSCRIPTION_RETRY_AFTER}
+        )
 
+async def release_transcriptions_after(events, count: int = 1):
+    """Pass a streaming body through and free its transcription slots when it ends"""
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        language_name = get_language_name(language)
-        
-        prompt = f"""
-        As a medical expert, analyze this medical text and provide a structured summary in {language_name}.
-
-        **Medical Text:** {text}
-
-        Please respond ONLY in {language_name} and provide a comprehensive summary including:
-        - **Patient Information** (if available)
-        - **Key Findings**
-        - **Test Results**
-        - **Medications/Treatments**
-        - **Recommendations**
-        - **Important Notes**
-
-        Format the response clearly with proper medical terminology in {language_name}.
-        Ensure the entire response is in {language_name}, including section headers.
-        """
-
-        response = model.generate_content(prompt)
-        return response.text
+        # aclosing: the body is finished off before the slots are freed, not left to the GC
+        async with aclosing(events):
+            async for event in events:
+                yield event
+    finally:
+        enhanced_speech.slots.release(count)
+
+async def read_upload(upload: Optional[UploadFile]) -> Optional[bytes]:
+    """Read an optional upload fully, None when nothing was sent"""
+    if not (upload and upload.filename):
+        return None
+
+    with stage("upload_read") as info:
+        await upload.seek(0)
+        data = await upload.read()
+        info["bytes"] = len(data)
+    return data
+
+async def transcription_stage(audio_bytes: Optional[bytes]) -> dict:
+    """STEP 1: transcribe uploaded audio off the event loop"""
+    if audio_bytes is None:
+        return {"transcription": "No audio file provided", "text": ""}
+
+    if len(audio_bytes) == 0:
+        return {"transcription": "Error: Audio file is empty", "text": ""}
+
+    try:
+        return await run_in_executor(audio_executor, transcribe_upload, audio_bytes)
     except Exception as e:
-        return f"Summarization error: {str(e)}"
+        logger.exception("Audio processing failed")
+        return {"transcription": f"Audio processing error: {str(e)}", "text": ""}
 
-# MAIN FULL WORKFLOW ENDPOINT
-@app.post("/full-workflow")
-async def full_workflow(
-    file: UploadFile = File(...),
-    image: Optional[UploadFile] = File(None),
-    language: str = Form("en")
-):
-    # Initialize response
-    response_data = {
+async def ocr_stage(image_bytes: Optional[bytes]) -> dict:
+    """STEP 2: run OCR on the uploaded image off the event loop"""
+    if image_bytes is None:
+        return {"extracted_text": "No image file provided", "text": "", "formatted_report": ""}
+
+    try:
+        return await run_in_executor(ocr_executor, ocr_upload, image_bytes)
+    except Exception as e:
+        logger.exception("OCR processing failed")
+        return {"extracted_text": f"OCR processing error: {str(e)}", "text": "", "formatted_report": ""}
+
+def _next_locked(iterator, lock, default):
+    with lock:
+        return next(iterator, default)
+
+def _close_locked(iterator, lock):
+    with lock:
+        iterator.close()
+
+async def iterate_in_executor(executor, iterator):
+    """Drive a blocking generator on a bounded executor, one item at a time.
+
+    The generator is closed when iteration stops early (e.g. the client disconnected),
+    once any next() still running on the executor has returned.
+    """
+    sentinel = object()
+    lock = threading.Lock()
+    try:
+        while True:
+            item = await run_in_executor(executor, _next_locked, iterator, lock, sentinel)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        await run_in_executor(executor, _close_locked, iterator, lock)
+
+async def streaming_transcription_stage(audio_bytes: Optional[bytes]):
+    """STEP 1, streaming: yield ("transcription_segment", event) as Whisper decodes,
+    then ("transcription", stage_result) once the transcript is complete"""
+    if audio_bytes is None:
+        yield "transcription", {"transcription": "No audio file provided", "text": ""}
+        return
+
+    if len(audio_bytes) == 0:
+        yield "transcription", {"transcription": "Error: Audio file is empty", "text": ""}
+        return
+
+    try:
+        async with aclosing(iterate_in_executor(audio_executor, enhanced_speech.transcribe_stream(audio_bytes))) as events:
+            async for event in events:
+                kind = event.pop("event")
+                if kind == "segment":
+                    yield "transcription_segment", event
+                elif kind == "done":
+                    transcript_text = event.get("text", "").strip()
+                    yield "transcription", {
+                        "transcription": transcript_text,
+                        "text": transcript_text,
+                        "cache_hit": event.get("cache_hit", False)
+                    }
+                    return
+                elif kind == "error":
+                    yield "transcription", {"transcription": event["message"], "text": ""}
+                    return
+
+        yield "transcription", {"transcription": "Transcription failed - invalid result format", "text": ""}
+    except Exception as e:
+        logger.exception("Audio processing failed")
+        yield "transcription", {"transcription": f"Audio processing error: {str(e)}", "text": ""}
+
+def new_workflow_response(file: Optional[UploadFile], image: Optional[UploadFile], language: str) -> dict:
+    """Initial /full-workflow response payload"""
+    return {
         "transcription": "",
         "chatbot_reply": "",
         "sources": [],
@@ -112,6 +312,8 @@ async def full_workflow(
         "summary": "",
         "language": language,
         "formatted_report": "",
+        "lab_values": [],
+        "token_counts": {},
         "debug_info": {
             "received_file": bool(file),
             "received_filename": file.filename if file else None,
@@ -119,161 +321,217 @@ async def full_workflow(
             "received_language": language
         }
     }
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# MAIN FULL WORKFLOW ENDPOINT
+@app.post("/full-workflow")
+async def full_workflow(
+    file: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    language: str = Form("en"),
+    analysis_mode: Optional[str] = Form(None)
+):
+    # Initialize response
+    response_data = new_workflow_response(file, image, language)
     
-    transcript_text = ""
-    extracted_text = ""
+    audio_bytes = await read_upload(file)
+    image_bytes = await read_upload(image)
+
+    transcription_admitted = bool(audio_bytes)
+    if transcription_admitted:
+        admit_transcriptions()
+
+    # STEP 1 + STEP 2: AUDIO TRANSCRIPTION AND IMAGE OCR, run concurrently
+    try:
+        audio_stage, ocr_result = await asyncio.gather(
+            transcription_stage(audio_bytes),
+            ocr_stage(image_bytes)
+        )
+    finally:
+        if transcription_admitted:
+            enhanced_speech.slots.release()
+
+    transcript_text = audio_stage["text"]
+    apply_transcription_stage(response_data, audio_stage)
+
+    extracted_text = ocr_result["text"]
+    apply_ocr_stage(response_data, ocr_result)
     
-    # STEP 1: AUDIO TRANSCRIPTION
-    if file and file.filename:
-        try:
-            await file.seek(0)
-            audio_bytes = await file.read()
-            
-            if len(audio_bytes) == 0:
-                response_data["transcription"] = "Error: Audio file is empty"
+    # STEP 3 + STEP 4: MEDICAL ANALYSIS AND FINAL SUMMARY
+    combined_text = await prepare_analysis_text(
+        response_data, transcript_text, extracted_text, ocr_result.get("lab_values"), ocr_result.get("other_text")
+    )
+    await run_analysis_stage(response_data, combined_text, language, analysis_mode)
+
+    return JSONResponse(content=response_data)
+
+async def full_workflow_events(audio_bytes: Optional[bytes], image_bytes: Optional[bytes], response_data: dict):
+    """Run the full workflow, yielding each stage as an SSE event as soon as it is ready"""
+    language = response_data["language"]
+
+    # STEP 1 + STEP 2: transcript segments are pushed as Whisper decodes them,
+    # and each stage result as soon as it finishes
+    stage_events = asyncio.Queue()
+
+    async def produce_transcription():
+        async with aclosing(streaming_transcription_stage(audio_bytes)) as items:
+            async for item in items:
+                await stage_events.put(item)
+
+    async def produce_ocr():
+        await stage_events.put(("ocr", await ocr_stage(image_bytes)))
+
+    producers = [asyncio.ensure_future(produce_transcription()), asyncio.ensure_future(produce_ocr())]
+
+    stage_results = {}
+    try:
+        while len(stage_results) < len(producers):
+            stage_name, result = await stage_events.get()
+
+            if stage_name == "transcription_segment":
+                yield sse_event(stage_name, result)
+                continue
+
+            stage_results[stage_name] = result
+            if stage_name == "transcription":
+                apply_transcription_stage(response_data, result)
+                yield sse_event("transcription", {
+                    "transcription": response_data["transcription"],
+                    "cache_hit": response_data["cache_hits"]["transcription"]
+                })
             else:
-                # Save to temporary file
-                file_extension = os.path.splitext(file.filename)[1] or '.mp3'
-                with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension, mode='wb') as tmp:
-                    tmp.write(audio_bytes)
-                    tmp.flush()
-                    audio_path = tmp.name
-                
-                # Transcribe using enhanced_speech
-                with open(audio_path, 'rb') as audio_file_obj:
-                    transcript_result = enhanced_speech.transcribe_audio(audio_file_obj)
-                
-                if transcript_result and isinstance(transcript_result, dict):
-                    transcript_text = transcript_result.get("text", "").strip()
-                    response_data["transcription"] = transcript_text
-                else:
-                    response_data["transcription"] = "Transcription failed - invalid result format"
-                
-                # Cleanup temp file
-                try:
-                    os.unlink(audio_path)
-                except Exception as cleanup_error:
-                    pass
-                    
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            response_data["transcription"] = f"Audio processing error: {str(e)}"
-    else:
-        response_data["transcription"] = "No audio file provided"
-    
-    # STEP 2: IMAGE OCR PROCESSING
-    if image and image.filename:
-        try:
-            await image.seek(0)
-            
-            ocr_result = enhanced_ocr.extract_text(image.file)
-            
-            if ocr_result and isinstance(ocr_result, dict):
-                extracted_text = ocr_result.get("text", "").strip()
-                response_data["extracted_text"] = extracted_text
-                
-                # Format medical report
-                try:
-                    formatted_report = enhanced_ocr.format_medical_report(ocr_result)
-                    response_data["formatted_report"] = formatted_report
-                except Exception as format_error:
-                    response_data["formatted_report"] = extracted_text
+                apply_ocr_stage(response_data, result)
+                yield sse_event("ocr", {
+                    "extracted_text": response_data["extracted_text"],
+                    "formatted_report": response_data["formatted_report"],
+                    "lab_values": response_data["lab_values"],
+                    "cache_hit": response_data["cache_hits"]["ocr"]
+                })
+    finally:
+        # A client disconnect closes this generator mid-stage: stop the producers and
+        # wait for them, so the transcription slot is only released once Whisper has stopped
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+
+    combined_text = await prepare_analysis_text(
+        response_data,
+        stage_results["transcription"]["text"],
+        stage_results["ocr"]["text"],
+        stage_results["ocr"].get("lab_values"),
+        stage_results["ocr"].get("other_text")
+    )
+    yield sse_event("token_counts", response_data["token_counts"])
+
+    # STEP 3: stream the medical analysis tokens
+    if combined_text.strip():
+        medical_prompt = get_medical_analysis_prompt(combined_text, language)
+        async for event in enhanced_chatbot_response_stream_async(medical_prompt, language):
+            kind = event.pop("event")
+            if kind == "search":
+                response_data["sources"] = event["sources"]
+                response_data["search_performed"] = event["search_performed"]
+                yield sse_event("analysis_search", event)
+            elif kind == "token":
+                yield sse_event("analysis_token", event)
+            elif kind == "done":
+                response_data["chatbot_reply"] = event["response"]
             else:
-                response_data["extracted_text"] = "OCR failed - invalid result format"
-            
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            response_data["extracted_text"] = f"OCR processing error: {str(e)}"
+                response_data["chatbot_reply"] = f"Medical analysis error: {event.get('message', '')}"
+                yield sse_event("analysis_error", event)
     else:
-        response_data["extracted_text"] = "No image file provided"
-    
-    # STEP 3: MEDICAL ANALYSIS WITH CHATBOT
-    try:
-        # Combine all available text for analysis
-        combined_text = ""
-        
-        if transcript_text:
-            combined_text += f"PATIENT AUDIO TRANSCRIPTION:\n{transcript_text}\n\n"
-            
-        if extracted_text:
-            combined_text += f"MEDICAL DOCUMENT TEXT (OCR):\n{extracted_text}\n\n"
-        
-        if combined_text.strip():
-            # Create comprehensive medical analysis prompt
-            language_name = get_language_name(language)
-            medical_prompt = f"""
-As an expert medical AI assistant, analyze the following medical information and provide a comprehensive professional assessment:
-
-{combined_text}
-
-Please provide a detailed medical analysis in {language_name} including:
-
-1. **Patient Information Summary** (if available from the data)
-2. **Primary Symptoms Analysis** (from audio/documents)
-3. **Key Medical Findings** (test results, measurements, observations)
-4. **Clinical Assessment** (potential diagnoses based on symptoms/findings)
-5. **Recommendations** (suggested actions, follow-up care, lifestyle changes)
-6. **Important Warnings** (urgent concerns, contraindications, precautions)
-7. **Additional Notes** (relevant medical context or considerations)
-
-Format your response in clear, professional medical language suitable for healthcare professionals.
-Use proper medical terminology and provide evidence-based analysis.
-Respond entirely in: {language_name}
-"""
-            
-            chatbot_result = enhanced_chatbot_response(medical_prompt, language)
-            
-            if chatbot_result and isinstance(chatbot_result, dict):
-                response_data["chatbot_reply"] = chatbot_result.get("response", "")
-                response_data["sources"] = chatbot_result.get("sources", [])
-                response_data["search_performed"] = chatbot_result.get("search_performed", False)
-            else:
-                response_data["chatbot_reply"] = "Medical analysis failed - chatbot error"
-            
-        else:
-            response_data["chatbot_reply"] = "No medical data available for analysis. Please provide audio recording or medical documents."
-            response_data["sources"] = []
-            response_data["search_performed"] = False
-    
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        response_data["chatbot_reply"] = f"Medical analysis error: {str(e)}"
-        response_data["sources"] = []
-        response_data["search_performed"] = False
-    
-    # STEP 4: GENERATE FINAL SUMMARY
+        response_data["chatbot_reply"] = NO_MEDICAL_DATA_MESSAGE
+        yield sse_event("analysis_token", {"text": NO_MEDICAL_DATA_MESSAGE})
+
+    # STEP 4: stream the final summary tokens
+    if combined_text.strip() and response_data["chatbot_reply"]:
+        full_analysis, budget_info = await fit_to_budget(
+            build_full_analysis(combined_text, response_data["chatbot_reply"])
+        )
+        response_data["token_counts"]["summary_input_sent"] = budget_info["tokens_out"]
+        summary_parts = []
+        async for chunk in summarize_text_stream(full_analysis, language):
+            summary_parts.append(chunk)
+            yield sse_event("summary_token", {"text": chunk})
+        response_data["summary"] = "".join(summary_parts)
+    else:
+        response_data["summary"] = INSUFFICIENT_DATA_MESSAGE
+        yield sse_event("summary_token", {"text": INSUFFICIENT_DATA_MESSAGE})
+
+    record_output_tokens(response_data)
+    yield sse_event("done", response_data)
+
+@app.post("/full-workflow/stream")
+async def full_workflow_stream(
+    file: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    language: str = Form("en")
+):
+    # Read uploads before streaming starts; the files are closed once the handler returns
+    audio_bytes = await read_upload(file)
+    image_bytes = await read_upload(image)
+    response_data = new_workflow_response(file, image, language)
+
+    events = full_workflow_events(audio_bytes, image_bytes, response_data)
+    if audio_bytes:
+        admit_transcriptions()
+        events = release_transcriptions_after(events)
+
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+# BACKGROUND JOBS - submit returns immediately, clients poll or receive a webhook
+@app.post("/jobs/full-workflow", status_code=202)
+async def submit_full_workflow_job(
+    file: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    language: str = Form("en"),
+    analysis_mode: Optional[str] = Form(None),
+    webhook_url: Optional[str] = Form(None)
+):
+    if webhook_url:
+        try:
+            # Resolves the host - kept off the event loop
+            await run_in_executor(None, validate_webhook_url, webhook_url)
+        except WebhookURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    audio_bytes = await read_upload(file)
+    image_bytes = await read_upload(image)
+    response_data = new_workflow_response(file, image, language)
+
     try:
-        if combined_text.strip() and response_data["chatbot_reply"]:
-            # Combine all information for summary
-            full_analysis = f"""
-MEDICAL DATA:
-{combined_text}
-
-AI ANALYSIS:
-{response_data['chatbot_reply']}
-"""
-            
-            summary_text = summarize_text(full_analysis, language)
-            response_data["summary"] = summary_text
-            
-        else:
-            response_data["summary"] = "Unable to create summary - insufficient medical data provided."
-    
+        job_id = job_manager.submit(audio_bytes, image_bytes, response_data, analysis_mode, webhook_url)
+    except JobQueueFullError:
+        raise HTTPException(
+            status_code=429,
+            detail="Job queue is full, please retry shortly",
+            headers={"Retry-After": JOB_RETRY_AFTER}
+        )
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        response_data["summary"] = f"Summary generation error: {str(e)}"
-    
-    return JSONResponse(content=response_data)
+        raise HTTPException(status_code=503, detail=f"Job queue unavailable: {str(e)}")
+
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status with per-stage partial results, and the full response once completed"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
 
 # Additional endpoints
 @app.post("/chatbot", response_model=ChatResponse)
 async def chat(chat_req: ChatRequest):
     try:
-        result = enhanced_chatbot_response(chat_req.message, chat_req.language)
+        result = await enhanced_chatbot_response_async(chat_req.message, chat_req.language)
         return ChatResponse(
             reply=result["response"],
             sources=result["sources"],
@@ -283,22 +541,97 @@ async def chat(chat_req: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chatbot error: {str(e)}")
 
+@app.post("/chatbot/stream")
+async def chat_stream(chat_req: ChatRequest):
+    async def events():
+        async for event in enhanced_chatbot_response_stream_async(chat_req.message, chat_req.language):
+            yield sse_event(event.pop("event"), event)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/transcribe", response_model=TranscriptionResponse)
 async def transcribe(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
 
+    admit_transcriptions()
     try:
-        result = enhanced_speech.transcribe_audio(file.file)
+        result = await run_in_executor(audio_executor, enhanced_speech.transcribe_audio, file.file)
         return TranscriptionResponse(
             transcription=result["text"],
             language=result.get("language", ""),
             language_code=result.get("language_code", ""),
             source=result["source"],
-            confidence=result["confidence"]
+            confidence=result["confidence"],
+            cache_hit=result.get("cache_hit", False)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription error: {str(e)}")
+    finally:
+        enhanced_speech.slots.release()
+
+@app.post("/transcribe/batch")
+async def transcribe_batch(files: List[UploadFile] = File(...)):
+    """Transcribe several audio files in one call across the Whisper pool; results keep upload order"""
+    uploads = [(upload.filename, await read_upload(upload)) for upload in files]
+    uploads = [(filename, audio_bytes) for filename, audio_bytes in uploads if audio_bytes]
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No audio files provided")
+
+    if len(uploads) > enhanced_speech.slots.capacity:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many files - at most {enhanced_speech.slots.capacity} per batch"
+        )
+
+    admit_transcriptions(len(uploads))
+    try:
+        results = await asyncio.gather(
+            *[
+                run_in_executor(audio_executor, enhanced_speech.transcribe_audio, audio_bytes)
+                for _, audio_bytes in uploads
+            ],
+            return_exceptions=True
+        )
+    finally:
+        enhanced_speech.slots.release(len(uploads))
+
+    transcriptions = []
+    for (filename, _), result in zip(uploads, results):
+        if isinstance(result, Exception):
+            result = {"text": f"Transcription error: {str(result)}", "source": "error", "confidence": "low"}
+        transcriptions.append({
+            "filename": filename,
+            "transcription": result["text"],
+            "language": result.get("language", ""),
+            "language_code": result.get("language_code", ""),
+            "source": result.get("source", ""),
+            "confidence": result.get("confidence", ""),
+            "cache_hit": result.get("cache_hit", False)
+        })
+
+    return {"count": len(transcriptions), "transcriptions": transcriptions}
+
+@app.post("/transcribe/stream")
+async def transcribe_stream(file: UploadFile = File(...)):
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    audio_bytes = await read_upload(file)
+
+    async def events():
+        # Segments are sent with timestamps as soon as faster-whisper produces them,
+        # so clients can start using the partial transcript before the audio is done
+        async with aclosing(iterate_in_executor(audio_executor, enhanced_speech.transcribe_stream(audio_bytes))) as segments:
+            async for event in segments:
+                yield sse_event(event.pop("event"), event)
+
+    admit_transcriptions()
+    return StreamingResponse(
+        release_transcriptions_after(events()),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
 
 @app.post("/extract-text", response_model=OCRResponse)
 async def ocr(image: UploadFile = File(...)):
@@ -306,7 +639,7 @@ async def ocr(image: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="No image provided")
 
     try:
-        ocr_result = enhanced_ocr.extract_text(image.file)
+        ocr_result = await run_in_executor(ocr_executor, enhanced_ocr.extract_text, image.file)
         formatted_report = enhanced_ocr.format_medical_report(ocr_result)
 
         return OCRResponse(
@@ -314,16 +647,63 @@ async def ocr(image: UploadFile = File(...)):
             format=ocr_result["format"],
             source=ocr_result["source"],
             confidence=ocr_result.get("confidence", 0.0),
-            formatted_report=formatted_report
+            formatted_report=formatted_report,
+            cache_hit=ocr_result.get("cache_hit", False),
+            lab_values=ocr_result.get("lab_values", []),
+            timings=ocr_result.get("timings", {})
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR error: {str(e)}")
 
+async def read_batch_pages(images: List[UploadFile]) -> list:
+    """Read every upload and expand PDFs into page tasks"""
+    documents = [data for data in [await read_upload(image) for image in images] if data]
+    if not documents:
+        raise HTTPException(status_code=400, detail="No images provided")
+
+    try:
+        # Counting and spooling PDF pages is blocking work
+        return await run_in_executor(None, batch_ocr.expand_pages, documents)
+    except PageLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+@app.post("/extract-text/batch")
+async def ocr_batch(images: List[UploadFile] = File(...)):
+    """OCR several images and/or PDFs in parallel; pages come back in order"""
+    pages = await read_batch_pages(images)
+    page_results = [page async for page in batch_ocr.iter_pages(pages)]
+    return batch_ocr.combine(page_results)
+
+@app.post("/extract-text/batch/stream")
+async def ocr_batch_stream(images: List[UploadFile] = File(...)):
+    """Same as /extract-text/batch, but each page is sent as soon as it is recognised"""
+    pages = await read_batch_pages(images)
+
+    async def events():
+        page_results = []
+        async for page in batch_ocr.iter_pages(pages):
+            page_results.append(page)
+            yield sse_event("page", page)
+        yield sse_event("done", batch_ocr.combine(page_results))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/summarize")
 async def summarize(req: SummarizeRequest):
     try:
-        summary = summarize_text(req.text, req.language)
-        return {"summary": summary}
+        text, budget_info = await fit_to_budget(req.text)
+        summary = await summarize_text(text, req.language)
+        return {
+            "summary": summary,
+            "token_counts": {
+                "input": budget_info["tokens_in"],
+                "input_sent": budget_info["tokens_out"],
+                "compacted": budget_info["compacted"],
+                "output": count_tokens(summary)
+            }
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Summarization error: {str(e)}")
 
@@ -336,6 +716,26 @@ async def root():
         "supported_languages": list(get_supported_languages().keys())
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+async def ready_check():
+    """Readiness probe - 503 until warm-up has finished, and for good if a component failed to load"""
+    failed = failed_components()
+    if not readiness["complete"]:
+        status = "warming_up"
+    elif failed:
+        status = "degraded"
+    else:
+        status = "ready"
+    return JSONResponse(
+        status_code=200 if status == "ready" else 503,
+        content={"status": status, "components": readiness["components"], "failed": failed}
+    )
+
 @app.get("/health")
 async def health_check():
     return {
@@ -349,6 +749,22 @@ async def health_check():
             "📝 Summarization": "AI-powered medical summaries",
             "🎤 Speech": "Faster-Whisper transcription",
             "🌐 Multi-language": "Support for 12 languages"
+        },
+        "cache_stats": {
+            "ocr": enhanced_ocr.cache.stats(),
+            "transcription": enhanced_speech.cache.stats(),
+            "llm": llm_cache.stats(),
+            "search": search_cache.stats()
+        },
+        "transcription_pool": {
+            **enhanced_speech.models.stats(),
+            "admission": enhanced_speech.slots.stats()
+        },
+        "jobs": job_manager.stats(),
+        "knowledge_index": knowledge_index.stats(),
+        "rate_limits": {
+            "gemini": gemini_async.limiter.stats(),
+            "search": search_async.limiter.stats()
         }
     }
 
@@ -0,0 +1,169 @@
+# metrics.py - per-stage latency histograms (/metrics), Server-Timing entries and optional OpenTelemetry spans
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from log import get_logger
+
+load_dotenv()
+
+logger = get_logger("metrics")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Spans go to whatever OpenTelemetry SDK/exporter the process is configured with
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+METRICS_PREFIX = "doctor_assistant"
+
+# Seconds; covers a 2 ms cache hit up to a multi-minute transcription
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+tracer = None
+if OTEL_TRACING:
+    try:
+        from opentelemetry import trace
+        tracer = trace.get_tracer("doctor-assistant")
+    except ImportError:
+        logger.warning("OTEL_TRACING=1 but opentelemetry-api is not installed - spans disabled")
+
+# Stage timings of the request being handled, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+class Histogram:
+    """Prometheus histogram with labels, rendered in the text exposition format"""
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # label tuple -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(key)
+                for index, bound in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {series[index]}")
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+class Counter:
+    """Prometheus counter with labels"""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(key))} {value}")
+        return lines
+
+stage_seconds = Histogram(f"{METRICS_PREFIX}_stage_duration_seconds", "Duration of one pipeline stage")
+request_seconds = Histogram(f"{METRICS_PREFIX}_request_duration_seconds", "HTTP request duration until the response starts")
+stage_bytes = Counter(f"{METRICS_PREFIX}_stage_bytes_total", "Bytes processed by a pipeline stage")
+stage_tokens = Counter(f"{METRICS_PREFIX}_stage_tokens_total", "Prompt (in) and response (out) tokens of an LLM stage")
+stage_errors = Counter(f"{METRICS_PREFIX}_stage_errors_total", "Pipeline stages that raised")
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in (stage_seconds, request_seconds, stage_bytes, stage_tokens, stage_errors):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def start_request_timings():
+    """Collect the stages of the current request (call once per request, e.g. in middleware)"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(name, seconds, counts=None, failed=False):
+    if not METRICS_ENABLED:
+        return
+    counts = counts or {}
+    stage_seconds.observe(seconds, stage=name)
+    if counts.get("bytes"):
+        stage_bytes.inc(counts["bytes"], stage=name)
+    if counts.get("tokens_in"):
+        stage_tokens.inc(counts["tokens_in"], stage=name, direction="in")
+    if counts.get("tokens_out"):
+        stage_tokens.inc(counts["tokens_out"], stage=name, direction="out")
+    if failed:
+        stage_errors.inc(stage=name)
+
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+@contextmanager
+def stage(name, **counts):
+    """Time a block as a pipeline stage. Yields a dict for counts only known at the end
+
+        with stage("summary_llm", tokens_in=n) as info:
+            ...
+            info["tokens_out"] = count_tokens(text)
+    """
+    # Child of the current span, but never made current itself: stages can span
+    # generator yields and executor threads, where attach/detach would not pair up
+    span = tracer.start_span(name) if tracer is not None else None
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield counts
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - started, counts, failed)
+        if span is not None:
+            for key, value in counts.items():
+                if isinstance(value, (int, float, str, bool)):
+                    span.set_attribute(key, value)
+            span.end()
+
+def server_timing_header(timings):
+    """Server-Timing value; repeated stages (e.g. several Tesseract configs) are summed"""
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+def run_in_executor(executor, fn, *args):
+    """loop.run_in_executor that carries the request's timing context into the worker thread"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
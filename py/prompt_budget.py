@@ -0,0 +1,190 @@
+# prompt_budget.py - local token counts, transcript/OCR cleanup and map-reduce compaction for Gemini prompts
+import asyncio
+import math
+import os
+import re
+from dotenv import load_dotenv
+from log import get_logger
+
+load_dotenv()
+
+logger = get_logger("prompt_budget")
+
+# Input tokens allowed for the medical data part of a prompt; above this it is
+# condensed chunk by chunk (map) and, if still too long, condensed again (reduce)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_CHUNK_TOKENS = int(os.getenv("PROMPT_CHUNK_TOKENS", "1500"))
+PROMPT_REDUCE_ROUNDS = int(os.getenv("PROMPT_REDUCE_ROUNDS", "2"))
+TRANSCRIPT_CLEANUP = os.getenv("TRANSCRIPT_CLEANUP", "1") == "1"
+# OCR dedupe: lines this close to a page's top or bottom count as header/footer, and
+# lines at least this long count as boilerplate (disclaimers) wherever they repeat
+DEDUPE_PAGE_EDGE_LINES = int(os.getenv("DEDUPE_PAGE_EDGE_LINES", "3"))
+DEDUPE_BOILERPLATE_CHARS = int(os.getenv("DEDUPE_BOILERPLATE_CHARS", "80"))
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Gemini's tokenizer splits long words into pieces of about four characters
+CHARS_PER_WORD_PIECE = 4
+
+# Only unambiguous fillers - "er" (ER) and "mm" (millimetres) are real words in a consultation
+FILLER_PATTERN = re.compile(r"\b(?:u+m+|u+h+|uhm|erm|a+h+|hmm+)\b[,.]?\s*|\b(?:you know|i mean),\s*", re.IGNORECASE)
+# "I I I think" -> "I think": exact repeats separated only by spaces. Numbers are left
+# alone ("120 120" can be a reading), and so is anything with a comma ("no, no")
+REPEATED_WORD_PATTERN = re.compile(r"\b([A-Za-z]+)(?:[ \t]+\1\b)+")
+# Words that are doubled on purpose ("she had had chest pain", "that that")
+INTENDED_REPEATS = frozenset({"had", "that", "very", "really", "so"})
+# Cut-off starts: "th- the", "pai- pain" - only when the fragment begins the next word,
+# so "1- 2 tablets" and "left- sided pain" are kept
+FALSE_START_PATTERN = re.compile(r"\b([A-Za-z]+)-\s+([A-Za-z]+)")
+
+def count_tokens(text: str) -> int:
+    """Local estimate of Gemini tokens - no API round trip"""
+    if not text:
+        return 0
+    return sum(
+        math.ceil(len(piece) / CHARS_PER_WORD_PIECE) if piece[0].isalnum() else 1
+        for piece in TOKEN_PATTERN.findall(text)
+    )
+
+def _drop_false_start(match):
+    fragment, word = match.group(1), match.group(2)
+    return word if word.lower().startswith(fragment.lower()) else match.group(0)
+
+def _collapse_repeat(match):
+    word = match.group(1)
+    return match.group(0) if word.lower() in INTENDED_REPEATS else word
+
+def clean_transcript(text: str) -> str:
+    """Drop fillers, stutters and false starts from a speech transcript"""
+    if not text or not TRANSCRIPT_CLEANUP:
+        return text
+    text = FILLER_PATTERN.sub("", text)
+    text = FALSE_START_PATTERN.sub(_drop_false_start, text)
+    text = REPEATED_WORD_PATTERN.sub(_collapse_repeat, text)
+    text = re.sub(r"[ \t]{2,}", " ", text)
+    text = re.sub(r"\s+([,.?!])", r"\1", text)
+    return text.strip()
+
+# Page separator written by batch OCR ("--- Page 2 ---")
+PAGE_MARKER_PATTERN = re.compile(r"^--- Page \d+ ---$")
+
+def _split_pages(lines):
+    pages = [[]]
+    for line in lines:
+        if PAGE_MARKER_PATTERN.match(line.strip()) and pages[-1]:
+            pages.append([])
+        pages[-1].append(line)
+    return pages
+
+def _page_edges(page):
+    """Indexes of the header and footer lines of a page"""
+    content = [
+        index for index, line in enumerate(page)
+        if line.strip() and not PAGE_MARKER_PATTERN.match(line.strip())
+    ]
+    return set(content[:DEDUPE_PAGE_EDGE_LINES]), set(content[-DEDUPE_PAGE_EDGE_LINES:])
+
+def dedupe_lines(text: str) -> str:
+    """Drop page headers and footers repeated on later pages, and repeated long boilerplate.
+
+    Other repeats are kept: short values ("Negative", "Nil") and the same result on
+    two dates of a cumulative report are clinical content.
+    """
+    if not text:
+        return text
+    seen_headers, seen_footers, seen_boilerplate = set(), set(), set()
+    lines = []
+    for page in _split_pages(text.splitlines()):
+        headers, footers = _page_edges(page)
+        page_headers, page_footers = set(), set()
+        for index, line in enumerate(page):
+            key = " ".join(line.lower().split())
+            if not key:
+                if lines and not lines[-1]:
+                    continue
+            elif (
+                (index in headers and key in seen_headers)
+                or (index in footers and key in seen_footers)
+                or (len(key) >= DEDUPE_BOILERPLATE_CHARS and key in seen_boilerplate)
+            ):
+                continue
+            else:
+                if index in headers:
+                    page_headers.add(key)
+                if index in footers:
+                    page_footers.add(key)
+                if len(key) >= DEDUPE_BOILERPLATE_CHARS:
+                    seen_boilerplate.add(key)
+            lines.append(line.rstrip())
+        # Headers and footers only repeat across pages, never within one
+        seen_headers |= page_headers
+        seen_footers |= page_footers
+    return "\n".join(lines).strip()
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+def _pieces(text: str, max_tokens: int):
+    """Lines, with over-long lines (a whole transcript is one line) cut at sentences, then words"""
+    for line in text.splitlines():
+        if count_tokens(line) <= max_tokens:
+            yield line, "\n"
+            continue
+        for sentence in SENTENCE_BREAK.split(line):
+            if count_tokens(sentence) <= max_tokens:
+                yield sentence, " "
+            else:
+                for word in sentence.split():
+                    yield word, " "
+
+def split_chunks(text: str, max_tokens: int = PROMPT_CHUNK_TOKENS) -> list:
+    """Split into chunks of at most max_tokens at line, sentence or word boundaries"""
+    chunks = []
+    current = ""
+    current_tokens = 0
+    for piece, separator in _pieces(text, max_tokens):
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            current = ""
+            current_tokens = 0
+        current = f"{current}{separator}{piece}" if current else piece
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def get_condense_prompt(text: str, target_tokens: int) -> str:
+    return f"""Condense this part of a patient's medical record to at most {target_tokens} tokens.
+Keep every symptom, test name, value, unit, reference range, medication, dose, date and section heading.
+Drop repetition, small talk and anything that is not medically relevant. Do not add interpretation.
+
+{text}"""
+
+async def _condense(text: str, target_tokens: int) -> str:
+    from utils import generate_text_async
+    return await generate_text_async(get_condense_prompt(text, target_tokens), stage_name="condense_llm")
+
+async def compact_text(text: str, budget: int = PROMPT_TOKEN_BUDGET, condense=None) -> tuple:
+    """Map-reduce the text down to the token budget. Returns (text, info)"""
+    condense = condense or _condense
+    tokens = count_tokens(text)
+    info = {"tokens_in": tokens, "tokens_out": tokens, "compacted": False, "chunks": 0, "rounds": 0}
+    if tokens <= budget:
+        return text, info
+
+    for _ in range(PROMPT_REDUCE_ROUNDS):
+        chunks = split_chunks(text)
+        # Each chunk gets its share of the budget; chunks are condensed in parallel
+        target = max(100, budget // len(chunks))
+        condensed = await asyncio.gather(*(condense(chunk, target) for chunk in chunks))
+        text = "\n\n".join(part.strip() for part in condensed if part and part.strip())
+
+        info["chunks"] += len(chunks)
+        info["rounds"] += 1
+        tokens = count_tokens(text)
+        if tokens <= budget:
+            break
+
+    info["tokens_out"] = tokens
+    info["compacted"] = True
+    logger.info("Compacted prompt input", extra=info)
+    return text, info
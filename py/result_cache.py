@@ -0,0 +1,182 @@
+# result_cache.py - content-addressed cache for OCR and transcription results
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from log import get_logger
+
+logger = get_logger("cache")
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(24 * 60 * 60)))
+# Optional on-disk tier, disabled unless a directory is configured
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+def content_key(data: bytes, **params) -> str:
+    """Hash of the uploaded bytes plus the engine parameters that shape the result"""
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+class ResultCache:
+    """In-memory LRU tier with an optional disk tier, both size-bounded with TTL"""
+
+    def __init__(self, namespace, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL,
+                 disk_dir=RESULT_CACHE_DIR, disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_dir = os.path.join(disk_dir, namespace) if disk_dir else None
+
+        # key -> (expires_at, encoded value); values are stored as JSON so
+        # callers never share (and mutate) a cached dict
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_evict()
+
+    def get(self, key):
+        """Return the cached value or None; disk hits are promoted to memory"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, encoded = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(encoded)
+                self._remove(key)
+
+        encoded = self._disk_get(key, now)
+        with self._lock:
+            if encoded is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._memory_set(key, encoded, now)
+        return json.loads(encoded)
+
+    def set(self, key, value):
+        encoded = json.dumps(value)
+        now = time.time()
+
+        with self._lock:
+            self._memory_set(key, encoded, now)
+        self._disk_set(key, encoded)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "namespace": self.namespace,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key):
+        _, encoded = self._entries.pop(key)
+        self._size -= len(encoded)
+
+    def _memory_set(self, key, encoded, now):
+        if len(encoded) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (now + self.ttl, encoded)
+        self._size += len(encoded)
+
+        # Evict least recently used entries until we fit the size budget
+        while self._size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                os.unlink(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_set(self, key, encoded):
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Result cache disk write failed: %s", e)
+            return
+
+        # Only rescan the directory once the running estimate is over budget
+        with self._lock:
+            self._disk_bytes += len(encoded)
+            over_budget = self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        """Drop expired files, then the oldest ones until the disk budget fits"""
+        now = time.time()
+        files = []
+        total = 0
+
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime + self.ttl <= now:
+                    self._unlink(path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total > self.disk_max_bytes:
+            for _, size, path in sorted(files):
+                self._unlink(path)
+                total -= size
+                if total <= self.disk_max_bytes:
+                    break
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,73 @@
+# search_cache.py - Custom Search results cached by normalized query
+import os
+import re
+import threading
+from result_cache import ResultCache, content_key
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") == "1"
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(24 * 60 * 60)))
+# Optional on-disk tier so cached results (and the quota they saved) survive restarts
+SEARCH_CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", "")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can could do does for from how i if in into is it its me my of on or
+should so than that the their there these this to was what when where which who why will with
+would you your about after before during
+""".split())
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def normalize_search_query(query: str) -> str:
+    """Lowercase, drop punctuation and stopwords, sort tokens - word-order variants share a key"""
+    tokens = WORD_PATTERN.findall(query.lower())
+    kept = [token for token in tokens if token not in STOPWORDS]
+    # A query made only of stopwords still needs a key of its own
+    return " ".join(sorted(set(kept or tokens)))
+
+class SearchCache:
+    """Parsed search results per (normalized query, language), LRU + TTL with an optional disk tier"""
+
+    def __init__(self, enabled=SEARCH_CACHE_ENABLED, max_bytes=SEARCH_CACHE_MAX_BYTES,
+                 ttl=SEARCH_CACHE_TTL, disk_dir=SEARCH_CACHE_DIR):
+        self.enabled = enabled
+        self.results = ResultCache("search", max_bytes=max_bytes, ttl=ttl, disk_dir=disk_dir)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, query, language):
+        return content_key(normalize_search_query(query).encode("utf-8"), language=language)
+
+    def get(self, query, language="en"):
+        if not self.enabled:
+            return None
+
+        value = self.results.get(self._key(query, language))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, query, language, results):
+        # Errors and empty result sets are not cached - the next request retries
+        if self.enabled and results:
+            self.results.set(self._key(query, language), results)
+
+    def stats(self):
+        results = self.results.stats()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": results["entries"],
+                "bytes": results["bytes"],
+                "disk": self.results.disk_dir is not None,
+            }
+
+# Global instance
+search_cache = SearchCache()
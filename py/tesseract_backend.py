@@ -0,0 +1,175 @@
+# tesseract_backend.py - pluggable Tesseract engines for EnhancedOCR
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import numpy as np
+from log import get_logger
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = get_logger("ocr")
+
+# "auto" uses the in-process tesserocr pool when installed, else pytesseract
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", str(os.cpu_count() or 1)))
+
+TSV_INT_COLUMNS = [
+    'level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+    'left', 'top', 'width', 'height'
+]
+
+def parse_tsv(tsv):
+    """Parse Tesseract TSV output into the pytesseract Output.DICT layout"""
+    data = {column: [] for column in TSV_INT_COLUMNS + ['conf', 'text']}
+
+    for row in tsv.splitlines():
+        fields = row.split('\t')
+        if len(fields) < 12 or fields[0] == 'level':
+            continue
+
+        for column, value in zip(TSV_INT_COLUMNS, fields):
+            data[column].append(int(value))
+        data['conf'].append(float(fields[10]))
+        data['text'].append('\t'.join(fields[11:]))
+
+    return data
+
+class PytesseractBackend:
+    """Spawns the tesseract binary per call - always available"""
+    name = "pytesseract"
+
+    @property
+    def pytesseract(self):
+        # pytesseract pulls in optional heavy deps (pandas) on import; defer until used
+        import pytesseract
+        return pytesseract
+
+    def version(self):
+        return str(self.pytesseract.get_tesseract_version())
+
+    def warm_up(self):
+        """Nothing to keep warm - every call starts a new process"""
+
+    def _config(self, psm):
+        return f'--oem 3 --psm {psm}' if psm is not None else ''
+
+    def image_to_data(self, image, lang='eng', psm=None):
+        pytesseract = self.pytesseract
+        return pytesseract.image_to_data(
+            image,
+            lang=lang,
+            config=self._config(psm),
+            output_type=pytesseract.Output.DICT
+        )
+
+    def image_to_string(self, image, lang='eng', psm=None):
+        return self.pytesseract.image_to_string(image, lang=lang, config=self._config(psm))
+
+class TesserocrPoolBackend:
+    """Pool of warm in-process Tesseract handles shared across requests"""
+    name = "tesserocr"
+
+    def __init__(self, size=OCR_POOL_SIZE, lang='eng'):
+        self.size = max(1, size)
+        self.lang = lang
+        self.fallback = PytesseractBackend()
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        return tesserocr.tesseract_version().splitlines()[0]
+
+    def _reserve(self):
+        """Claim a slot for a new handle; False once the pool is full"""
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+            return True
+
+    def _new_handle(self):
+        try:
+            return tesserocr.PyTessBaseAPI(lang=self.lang, oem=tesserocr.OEM.DEFAULT)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def _handle(self):
+        """Check out a handle, creating one lazily until the pool is full"""
+        try:
+            api = self._pool.get_nowait()
+        except queue.Empty:
+            api = self._new_handle() if self._reserve() else self._pool.get()
+
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    def warm_up(self):
+        """Create every handle up front so the first requests skip model load"""
+        while self._reserve():
+            self._pool.put(self._new_handle())
+
+    def _psm(self, psm):
+        return tesserocr.PSM.AUTO if psm is None else psm
+
+    def _set_image(self, api, image):
+        """PIL images go through SetImage; NumPy arrays are handed over without conversion"""
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image)
+            height, width = image.shape[:2]
+            channels = 1 if image.ndim == 2 else image.shape[2]
+            api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+        else:
+            api.SetImage(image)
+
+    def image_to_data(self, image, lang='eng', psm=None):
+        if lang != self.lang:
+            return self.fallback.image_to_data(image, lang=lang, psm=psm)
+
+        try:
+            with self._handle() as api:
+                api.SetPageSegMode(self._psm(psm))
+                self._set_image(api, image)
+                tsv = api.GetTSVText(0)
+            return parse_tsv(tsv)
+        except Exception as e:
+            logger.warning("tesserocr failed, falling back to pytesseract: %s", e)
+            return self.fallback.image_to_data(image, lang=lang, psm=psm)
+
+    def image_to_string(self, image, lang='eng', psm=None):
+        if lang != self.lang:
+            return self.fallback.image_to_string(image, lang=lang, psm=psm)
+
+        try:
+            with self._handle() as api:
+                api.SetPageSegMode(self._psm(psm))
+                self._set_image(api, image)
+                return api.GetUTF8Text()
+        except Exception as e:
+            logger.warning("tesserocr failed, falling back to pytesseract: %s", e)
+            return self.fallback.image_to_string(image, lang=lang, psm=psm)
+
+def create_backend(name=OCR_BACKEND):
+    """Pick the OCR backend - tesserocr pool when available, pytesseract otherwise"""
+    if name == "pytesseract":
+        return PytesseractBackend()
+
+    if tesserocr is None:
+        if name == "tesserocr":
+            logger.info("tesserocr not installed, using pytesseract backend")
+        return PytesseractBackend()
+
+    return TesserocrPoolBackend()
+
+# Global instance
+ocr_backend = create_backend()
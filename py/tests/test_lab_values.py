@@ -0,0 +1,69 @@
+from lab_values import extract_lab_values, lab_row_words, parse_result, rows_from_words, strip_lab_rows
+
+SAMPLE_REPORT = """CITY DIAGNOSTIC LABORATORY
+Patient: Priya Nair
+45 Years / Male
+Hemoglobin 10.2 g/dL 13.0 - 17.0
+Serum Ferritin: 8 ng/ml 30 - 400 L
+Urine Albumin: Trace
+HbA1c: Pending
+Remarks: Advised iron supplements and repeat CBC after 4 weeks
+2 tablets of ferrous sulphate daily
+Dr. A. Rao, MD Pathology"""
+
+def test_value_must_follow_the_test_name():
+    assert parse_result("Iron", "", " supplements and repeat CBC after 4 weeks") is None
+    assert parse_result("HbA1c", "", ": Pending") is None
+
+def test_separators_before_the_value():
+    record = parse_result("Hemoglobin", "Hb - 13.5 g/dl", " - 13.5 g/dl")
+    assert record["value"] == 13.5
+    assert record["unit"] == "g/dl"
+
+def test_table_rows_are_extracted():
+    records = extract_lab_values(SAMPLE_REPORT.splitlines())
+    assert [(record["test"], record["value"]) for record in records] == [
+        ("Hemoglobin", 10.2),
+        ("Ferritin", 8.0),
+    ]
+    assert records[0]["flag"] == "low"
+    assert records[1]["reference_range"]["text"] == "30 - 400"
+
+def test_repeated_measurements_are_kept():
+    records = extract_lab_values([
+        "12/01/2024 Serum Creatinine 1.0 mg/dL",
+        "19/02/2024 Serum Creatinine 1.0 mg/dL",
+    ])
+    assert [(record["test"], record["value"], record["row"]) for record in records] == [
+        ("Creatinine", 1.0, 0),
+        ("Creatinine", 1.0, 1),
+    ]
+
+def test_only_parsed_rows_are_stripped():
+    lines = SAMPLE_REPORT.splitlines()
+    records = extract_lab_values(lines)
+    kept = strip_lab_rows(lines, records).splitlines()
+    assert "Hemoglobin 10.2 g/dL 13.0 - 17.0" not in kept
+    assert "Serum Ferritin: 8 ng/ml 30 - 400 L" not in kept
+    for line in (
+        "45 Years / Male",
+        "Urine Albumin: Trace",
+        "HbA1c: Pending",
+        "Remarks: Advised iron supplements and repeat CBC after 4 weeks",
+        "2 tablets of ferrous sulphate daily",
+    ):
+        assert line in kept
+
+def test_word_rows_map_records_back_to_words():
+    # Name and value columns in separate Tesseract blocks, on the same row
+    data = {
+        "text": ["Hemoglobin", "Remarks:", "normal", "10.2", "g/dL"],
+        "conf": [90, 90, 90, 90, 90],
+        "top": [10, 40, 40, 11, 11],
+        "height": [10, 10, 10, 10, 10],
+        "left": [0, 0, 80, 200, 240],
+    }
+    rows, row_words = rows_from_words(data)
+    assert rows == ["Hemoglobin 10.2 g/dL", "Remarks: normal"]
+    records = extract_lab_values(rows)
+    assert lab_row_words(records, row_words) == {0, 3, 4}
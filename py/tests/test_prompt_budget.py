@@ -0,0 +1,45 @@
+from prompt_budget import clean_transcript, count_tokens, dedupe_lines
+
+def test_fillers_are_removed():
+    assert clean_transcript("Um, the pain is, uh, worse at night") == "the pain is, worse at night"
+
+def test_false_starts_that_begin_the_next_word():
+    assert clean_transcript("th- the pai- pain started yesterday") == "the pain started yesterday"
+
+def test_dose_ranges_and_hyphenated_words_are_kept():
+    assert clean_transcript("Take 1- 2 tablets twice a day") == "Take 1- 2 tablets twice a day"
+    assert clean_transcript("it's the left- sided pain") == "it's the left- sided pain"
+
+def test_stutters_are_collapsed():
+    assert clean_transcript("I I I think the the cough is better") == "I think the cough is better"
+
+def test_intended_repeats_are_kept():
+    assert clean_transcript("She had had chest pain before") == "She had had chest pain before"
+    assert clean_transcript("No, no, it doesn't radiate") == "No, no, it doesn't radiate"
+    assert clean_transcript("BP was 120 120 on both arms") == "BP was 120 120 on both arms"
+
+DISCLAIMER = "This report is for the use of the referring physician only and is not valid for medico-legal purposes."
+
+def test_dedupe_lines_drops_repeated_page_headers_and_footers():
+    text = (
+        "--- Page 1 ---\nCITY LAB\nHb 13.5\nWBC 7.2\nUrea 30\nSodium 140\nPotassium 4.1\nLab Director"
+        "\n\n--- Page 2 ---\ncity lab\nCreatinine 1.0\nLab Director"
+    )
+    assert dedupe_lines(text) == (
+        "--- Page 1 ---\nCITY LAB\nHb 13.5\nWBC 7.2\nUrea 30\nSodium 140\nPotassium 4.1\nLab Director"
+        "\n\n--- Page 2 ---\nCreatinine 1.0"
+    )
+
+def test_dedupe_lines_drops_repeated_boilerplate():
+    assert dedupe_lines(f"Hb 13.5\n{DISCLAIMER}\nWBC 7.2\n{DISCLAIMER}") == f"Hb 13.5\n{DISCLAIMER}\nWBC 7.2"
+
+def test_dedupe_lines_keeps_repeated_values():
+    text = (
+        "Urine Sugar\nNegative\nUrine Ketones\nNegative\n"
+        "12/01/2024\nSerum Creatinine 1.0 mg/dL\n19/02/2024\nSerum Creatinine 1.0 mg/dL"
+    )
+    assert dedupe_lines(text) == text
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert count_tokens("hemoglobin 13.5") > count_tokens("hb 13")
@@ -1,13 +1,20 @@
+import asyncio
 import os
 import re
-import backoff
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
+from llm_cache import LLMResponseCache
+from search_cache import search_cache
+from knowledge_index import knowledge_index, as_search_results
+from metrics import stage
+from log import get_logger
+from prompt_budget import count_tokens
+from llm_clients import get_genai
+from async_clients import AsyncGeminiClient, AsyncSearchClient
 
 load_dotenv()
 
+logger = get_logger("chat")
+
 # Configuration
 NUM_SEARCH = 5
 LLM_MODEL = 'gemini-1.5-flash'
@@ -15,8 +22,44 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 PSE_ID = os.getenv('PROGRAMMABLE_SEARCH_ENGINE_ID')
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# "serial": route with Gemini, then search, then answer (default)
+# "speculative": opt-in; start a search on the user's own words (and optionally the
+#   direct answer) while Gemini routes. Costs a search call on every message
+# "rules": local keyword router, falling back to Gemini routing when unsure
+CHAT_ROUTING_MODE = os.getenv("CHAT_ROUTING_MODE", "serial")
+CHAT_SPECULATE_DIRECT = os.getenv("CHAT_SPECULATE_DIRECT", "0") == "1"
+SPECULATIVE_MAX_QUERY_WORDS = int(os.getenv("SPECULATIVE_MAX_QUERY_WORDS", "32"))
+
+# Where search-backed answers get their context: "web" (Custom Search), "local"
+# (knowledge_index) or "hybrid" (local first, web when no local passage scores well)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "web")
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", "5.0"))
+
+SEARCH_ANSWER_CONFIG = {"max_output_tokens": 800, "temperature": 0.4}
+DIRECT_ANSWER_CONFIG = {"max_output_tokens": 600, "temperature": 0.4}
+
+def warm_up_llm():
+    """Import the Gemini SDK ahead of the first request"""
+    get_genai()
+    return True
+
+llm_cache = LLMResponseCache()
+
+# asyncio clients behind every Gemini and Custom Search call
+gemini_async = AsyncGeminiClient(llm_cache)
+search_async = AsyncSearchClient(GOOGLE_API_KEY)
+
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|thanks|thank you|ok|okay|bye|good (morning|afternoon|evening|night))\b[\s!.?]*$",
+    re.IGNORECASE
+)
+MEDICAL_TERMS_PATTERN = re.compile(
+    r"\b(symptoms?|causes?|treatments?|cure|diagnos\w*|disease|disorder|syndrome|infection|"
+    r"pain|fever|dose|dosage|mg|side effects?|medicines?|medications?|drugs?|tablets?|"
+    r"vaccines?|tests?|levels?|blood|sugar|pressure|cholesterol|hba1c|thyroid|diabetes|"
+    r"cancer|allerg\w*|prevent\w*|risk|normal range)\b",
+    re.IGNORECASE
+)
 
 # Language mapping - CENTRALIZED HERE
 LANGUAGE_NAMES = {
@@ -107,160 +150,355 @@ User Question: {{query}}
 Provide detailed medical answer with citations in {language_name}:
 """
 
-def search_with_pse(query, language="en"):
-    """Search medical sources using Google Custom Search"""
+def get_direct_answer_prompt(user_message: str, language: str) -> str:
+    """Get prompt for answering without search results in specified language"""
+    language_name = get_language_name(language)
+
+    return f"""
+                As a medical assistant, provide detailed answer to: {user_message}
+                
+                IMPORTANT: Respond ONLY in {language_name}.
+
+                Requirements:
+                - 8-15 lines of detailed explanation
+                - Clear structure with bullet points  
+                - Include symptoms, causes, treatments, prevention
+                - Explain medical terms clearly
+                - Use **bold** for key terms
+                - Ensure entire response is in {language_name}
+                """
+
+def get_search_answer_prompt(query: str, search_results, language: str) -> str:
+    """Answer prompt with the numbered search snippets filled in"""
+    return get_answer_prompt(language).format(
+        context_block=build_context_block(search_results),
+        query=query
+    )
+
+def build_context_block(search_results) -> str:
+    """Number search snippets for citation in the answer prompt"""
+    if not search_results:
+        return "No sources available."
+
+    context_parts = []
+    for i, (url, data) in enumerate(search_results.items(), 1):
+        context_parts.append(f"[{i}] {data['snippet']}")
+    return "\n\n".join(context_parts)
+
+def llm_token_counts(prompt, system_instruction=None):
+    return {"tokens_in": count_tokens(prompt) + count_tokens(system_instruction or "")}
+
+async def generate_text_async(prompt, system_instruction=None, generation_config=None, model_name=LLM_MODEL,
+                              stage_name="llm"):
+    """Call Gemini through the response cache - rate limited and retried without blocking the event loop"""
+    with stage(stage_name, **llm_token_counts(prompt, system_instruction)) as info:
+        text = await gemini_async.generate(prompt, model_name, system_instruction, generation_config)
+        info["tokens_out"] = count_tokens(text)
+    return text
+
+async def stream_text_async(prompt, system_instruction=None, generation_config=None, model_name=LLM_MODEL,
+                            stage_name="llm"):
+    """Stream Gemini response chunks; cached responses are yielded in one piece"""
+    with stage(stage_name, **llm_token_counts(prompt, system_instruction)) as info:
+        info["tokens_out"] = 0
+        async for chunk in gemini_async.stream(prompt, model_name, system_instruction, generation_config):
+            info["tokens_out"] += count_tokens(chunk)
+            yield chunk
+
+def get_medical_search_query(query, language="en"):
+    """Add medical and language-specific terms to the search query"""
+    if language != 'en':
+        language_name = get_language_name(language)
+        return f"{query} medical health symptoms treatment causes prevention {language_name}"
+    return f"{query} medical health symptoms treatment causes prevention"
+
+def parse_search_items(res):
+    """Map Custom Search items to {url: {snippet, title}}"""
+    if 'items' not in res:
+        return {}
+
+    search_results = {}
+    for item in res['items']:
+        url = item['link']
+        snippet = item.get('snippet', '')[:400]
+        title = item.get('title', '')[:150]
+        search_results[url] = {'snippet': snippet, 'title': title}
+
+    logger.info("Web search returned %d sources", len(search_results))
+    return search_results
+
+async def search_with_pse_async(query, language="en"):
+    """Search medical sources using Google Custom Search over the pooled HTTP client"""
     try:
         if not all([GOOGLE_API_KEY, PSE_ID]):
             return {}
 
-        service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY)
-        
-        # Add language-specific search terms if not English
-        if language != 'en':
-            language_name = get_language_name(language)
-            medical_query = f"{query} medical health symptoms treatment causes prevention {language_name}"
-        else:
-            medical_query = f"{query} medical health symptoms treatment causes prevention"
-            
-        res = service.cse().list(q=medical_query, cx=PSE_ID, num=NUM_SEARCH).execute()
-
-        if 'items' in res:
-            search_results = {}
-            for item in res['items']:
-                url = item['link']
-                snippet = item.get('snippet', '')[:400]
-                title = item.get('title', '')[:150]
-                search_results[url] = {'snippet': snippet, 'title': title}
-
-            print(f"✅ Found {len(search_results)} medical sources")
-            return search_results
+        cached = search_cache.get(query, language)
+        if cached is not None:
+            logger.info("Search cache hit")
+            return cached
+
+        medical_query = get_medical_search_query(query, language)
+        with stage("search"):
+            res = await search_async.list(q=medical_query, cx=PSE_ID, num=NUM_SEARCH)
+        search_results = parse_search_items(res)
+        search_cache.set(query, language, search_results)
+        return search_results
+    except Exception as e:
+        logger.error("Search error: %s", e)
         return {}
+
+def search_local(query, min_score=0.0):
+    """Passages from the local knowledge index, in the same shape as search_with_pse"""
+    try:
+        with stage("local_search"):
+            passages = [
+                passage for passage in knowledge_index.search(query)
+                if passage["bm25"] >= min_score
+            ]
     except Exception as e:
-        print(f"❌ Search error: {e}")
+        logger.error("Knowledge index error: %s", e)
         return {}
+    if passages:
+        logger.info("Knowledge index returned %d passages", len(passages))
+    return as_search_results(passages)
+
+async def retrieve_async(query, language="en"):
+    """Context for a search-backed answer from the configured RETRIEVAL_BACKEND"""
+    if RETRIEVAL_BACKEND == "local":
+        return search_local(query)
+    if RETRIEVAL_BACKEND == "hybrid":
+        results = search_local(query, KNOWLEDGE_MIN_SCORE)
+        if results:
+            return results
+    return await search_with_pse_async(query, language)
+
+def get_routing_prompt(query, language="en"):
+    """Prompt and system instruction for the search routing call"""
+    language_name = get_language_name(language)
+    prompt = f"User Query: {query}\n\nRespond in {language_name}."
+    system_instruction = f"Decide if query needs web search. If yes, reformulate for search in {language_name}. If no, respond 'ns'."
+    return prompt, system_instruction
+
+def parse_routing_decision(response_text):
+    """Search query from the routing response, or None for 'ns'"""
+    cleaned_response = response_text.lower().strip()
+
+    if re.fullmatch(r"\bns\b", cleaned_response):
+        return None
+    return cleaned_response
 
-@backoff.on_exception(backoff.expo, (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable))
-def llm_check_search(query, language="en"):
-    """Check if query needs web search"""
+async def llm_check_search_async(query, language="en"):
+    """Check if query needs web search; retries happen in the client layer"""
     try:
         if not GEMINI_API_KEY:
             return query
 
-        language_name = get_language_name(language)
-        prompt = f"User Query: {query}\n\nRespond in {language_name}."
-        
-        model = genai.GenerativeModel(
-            LLM_MODEL,
-            system_instruction=f"Decide if query needs web search. If yes, reformulate for search in {language_name}. If no, respond 'ns'."
+        prompt, system_instruction = get_routing_prompt(query, language)
+        return parse_routing_decision(
+            await generate_text_async(prompt, system_instruction=system_instruction, stage_name="routing_llm")
         )
-        response = model.generate_content(prompt)
-        cleaned_response = response.text.lower().strip()
-
-        if re.fullmatch(r"\bns\b", cleaned_response):
-            return None
-        return cleaned_response
     except Exception:
         return query
 
-@backoff.on_exception(backoff.expo, (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable))
-def llm_answer_with_search(query, search_results=None, language="en"):
+def compact_search_query(user_message, max_words=SPECULATIVE_MAX_QUERY_WORDS):
+    """The user's own words as a search query, or None when the message is too long to search as-is"""
+    words = re.sub(r"[^\w\s%./-]", " ", user_message).split()
+    if not words or (max_words is not None and len(words) > max_words):
+        return None
+    return " ".join(words)
+
+def _same_query(a, b):
+    """Queries equal up to case, punctuation and spacing"""
+    return (compact_search_query(a, max_words=None) or "").lower() == (compact_search_query(b, max_words=None) or "").lower()
+
+def rule_based_route(user_message):
+    """Local router: ("direct", None), ("search", query), or (None, None) when unsure"""
+    if SMALL_TALK_PATTERN.match(user_message):
+        return "direct", None
+
+    query = compact_search_query(user_message)
+    if query and MEDICAL_TERMS_PATTERN.search(user_message):
+        return "search", query
+
+    return None, None
+
+async def llm_answer_with_search_async(query, search_results=None, language="en"):
     """Generate comprehensive medical answer in specified language"""
     try:
         if not GEMINI_API_KEY:
             return "Gemini API key not configured."
 
-        if search_results:
-            context_parts = []
-            for i, (url, data) in enumerate(search_results.items(), 1):
-                context_parts.append(f"[{i}] {data['snippet']}")
-            context_block = "\n\n".join(context_parts)
-        else:
-            context_block = "No sources available."
-
-        answer_prompt = get_answer_prompt(language)
-        prompt = answer_prompt.format(context_block=context_block, query=query)
-
-        system_prompt = get_system_prompt(language)
-        
-        model = genai.GenerativeModel(
-            LLM_MODEL,
-            system_instruction=system_prompt,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=800,
-                temperature=0.4
-            )
+        answer_text = await generate_text_async(
+            get_search_answer_prompt(query, search_results, language),
+            system_instruction=get_system_prompt(language),
+            generation_config=SEARCH_ANSWER_CONFIG,
+            stage_name="answer_llm"
         )
-
-        response = model.generate_content(prompt)
-        answer_text = response.text
-        answer_text = re.sub(r'<[^>]+>', '', answer_text)
-
-        # Add disclaimer in appropriate language
-        disclaimer = get_disclaimer(language)
-        return answer_text + disclaimer
+        return re.sub(r'<[^>]+>', '', answer_text) + get_disclaimer(language)
 
     except Exception as e:
         return f"Error generating medical response: {str(e)}"
 
-def enhanced_chatbot_response(user_message, language="en"):
+async def direct_chatbot_response_async(user_message, language="en"):
+    """Answer without search results"""
+    logger.debug("Direct response")
+    if not GEMINI_API_KEY:
+        return {
+            "response": "Gemini API key not configured.",
+            "sources": [],
+            "search_performed": False
+        }
+
+    response_text = await generate_text_async(
+        get_direct_answer_prompt(user_message, language),
+        generation_config=DIRECT_ANSWER_CONFIG,
+        stage_name="answer_llm"
+    )
+    return {
+        "response": re.sub(r'<[^>]+>', '', response_text) + get_short_disclaimer(language),
+        "sources": [],
+        "search_performed": False
+    }
+
+async def plan_response_async(user_message, language="en", speculate_direct=False):
+    """Decide whether to search and fetch the results, according to CHAT_ROUTING_MODE.
+
+    Returns (search_query, search_results, direct_task). direct_task holds a
+    speculative direct answer when one was started and the route did not search.
+    """
+    mode = CHAT_ROUTING_MODE
+
+    if mode == "rules":
+        decision, query = rule_based_route(user_message)
+        if decision == "direct":
+            return None, {}, None
+        if decision == "search":
+            logger.debug("Searching for: %s", query)
+            return query, await retrieve_async(query, language), None
+        mode = "serial"
+
+    if mode != "speculative":
+        search_query = await llm_check_search_async(user_message, language)
+        if not search_query:
+            return None, {}, None
+        logger.debug("Searching for: %s", search_query)
+        return search_query, await retrieve_async(search_query, language), None
+
+    routing = asyncio.ensure_future(llm_check_search_async(user_message, language))
+
+    speculative_query = compact_search_query(user_message)
+    search_task = None
+    if speculative_query:
+        search_task = asyncio.ensure_future(retrieve_async(speculative_query, language))
+
+    direct_task = None
+    if speculate_direct and GEMINI_API_KEY:
+        direct_task = asyncio.ensure_future(direct_chatbot_response_async(user_message, language))
+
+    try:
+        search_query = await routing
+    except BaseException:
+        for task in (search_task, direct_task):
+            if task:
+                task.cancel()
+        raise
+
+    if search_query:
+        if direct_task:
+            direct_task.cancel()
+        # The speculative results only stand in when Gemini asked for the same search
+        if search_task and _same_query(search_query, speculative_query):
+            logger.debug("Searching for: %s (speculative)", speculative_query)
+            return speculative_query, await search_task, None
+        if search_task:
+            search_task.cancel()
+        logger.debug("Searching for: %s", search_query)
+        return search_query, await retrieve_async(search_query, language), None
+
+    if search_task:
+        search_task.cancel()
+    return None, {}, direct_task
+
+async def enhanced_chatbot_response_async(user_message, language="en"):
     """Enhanced chatbot with comprehensive responses in specified language"""
     try:
-        search_query = llm_check_search(user_message, language)
-        language_name = get_language_name(language)
+        search_query, search_results, direct_task = await plan_response_async(
+            user_message, language, speculate_direct=CHAT_SPECULATE_DIRECT
+        )
 
         if search_query:
-            print(f"🔍 Searching for: {search_query}")
-            search_results = search_with_pse(search_query, language)
-            response = llm_answer_with_search(user_message, search_results, language)
+            response = await llm_answer_with_search_async(user_message, search_results, language)
             return {
                 "response": response,
                 "sources": list(search_results.keys()) if search_results else [],
                 "search_performed": True,
                 "search_query": search_query
             }
+        elif direct_task:
+            return await direct_task
         else:
-            print("💭 Direct response...")
-            if GEMINI_API_KEY:
-                model = genai.GenerativeModel(
-                    "gemini-1.5-flash",
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=600,
-                        temperature=0.4
-                    )
-                )
-
-                comprehensive_prompt = f"""
-                As a medical assistant, provide detailed answer to: {user_message}
-                
-                IMPORTANT: Respond ONLY in {language_name}.
-
-                Requirements:
-                - 8-15 lines of detailed explanation
-                - Clear structure with bullet points  
-                - Include symptoms, causes, treatments, prevention
-                - Explain medical terms clearly
-                - Use **bold** for key terms
-                - Ensure entire response is in {language_name}
-                """
-
-                response = model.generate_content(comprehensive_prompt)
-                clean_response = re.sub(r'<[^>]+>', '', response.text)
-
-                disclaimer = get_short_disclaimer(language)
-                return {
-                    "response": clean_response + disclaimer,
-                    "sources": [],
-                    "search_performed": False
-                }
-            else:
-                return {
-                    "response": "Gemini API key not configured.",
-                    "sources": [],
-                    "search_performed": False
-                }
+            return await direct_chatbot_response_async(user_message, language)
     except Exception as e:
         return {
             "response": f"Error: {str(e)}",
             "sources": [],
             "search_performed": False
         }
+
+async def enhanced_chatbot_response_stream_async(user_message, language="en"):
+    """Streaming variant of enhanced_chatbot_response_async - yields event dicts"""
+    try:
+        if not GEMINI_API_KEY:
+            yield {"event": "token", "text": "Gemini API key not configured."}
+            yield {
+                "event": "done",
+                "response": "Gemini API key not configured.",
+                "sources": [],
+                "search_performed": False
+            }
+            return
+
+        search_query, search_results, _ = await plan_response_async(user_message, language)
+
+        if search_query:
+            sources = list(search_results.keys()) if search_results else []
+            chunks = stream_text_async(
+                get_search_answer_prompt(user_message, search_results, language),
+                system_instruction=get_system_prompt(language),
+                generation_config=SEARCH_ANSWER_CONFIG,
+                stage_name="answer_llm"
+            )
+            disclaimer = get_disclaimer(language)
+        else:
+            logger.debug("Direct response")
+            sources = []
+            chunks = stream_text_async(
+                get_direct_answer_prompt(user_message, language),
+                generation_config=DIRECT_ANSWER_CONFIG,
+                stage_name="answer_llm"
+            )
+            disclaimer = get_short_disclaimer(language)
+
+        yield {
+            "event": "search",
+            "search_performed": bool(search_query),
+            "search_query": search_query or "",
+            "sources": sources
+        }
+
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield {"event": "token", "text": re.sub(r'<[^>]+>', '', chunk)}
+        yield {"event": "token", "text": disclaimer}
+
+        yield {
+            "event": "done",
+            "response": re.sub(r'<[^>]+>', '', "".join(parts)) + disclaimer,
+            "sources": sources,
+            "search_performed": bool(search_query),
+            "search_query": search_query or ""
+        }
+    except Exception as e:
+        yield {"event": "error", "message": f"Error: {str(e)}"}
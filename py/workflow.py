@@ -0,0 +1,317 @@
+# workflow.py - full-workflow stages shared by the HTTP handlers and the job workers
+import io
+import json
+import os
+from dotenv import load_dotenv
+from log import get_logger
+from enhanced_speech import enhanced_speech
+from enhanced_ocr import enhanced_ocr
+from lab_values import format_lab_values
+from prompt_budget import count_tokens, clean_transcript, dedupe_lines, compact_text
+from utils import (
+    enhanced_chatbot_response_async, generate_text_async, stream_text_async,
+    get_language_name, get_disclaimer
+)
+
+load_dotenv()
+
+logger = get_logger("workflow")
+
+NO_MEDICAL_DATA_MESSAGE = "No medical data available for analysis. Please provide audio recording or medical documents."
+INSUFFICIENT_DATA_MESSAGE = "Unable to create summary - insufficient medical data provided."
+
+# Gemini itself is configured lazily in utils.get_genai
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+# "single_call": one structured Gemini call returns both the analysis and the summary
+# "multi_call": chatbot analysis (with search), then a separate summary call
+WORKFLOW_ANALYSIS_MODE = os.getenv("WORKFLOW_ANALYSIS_MODE", "single_call")
+ANALYSIS_MODES = ("single_call", "multi_call")
+
+# "raw": send the whole OCR text
+# "structured": send extracted lab values plus the OCR lines they were not parsed from
+WORKFLOW_OCR_CONTEXT = os.getenv("WORKFLOW_OCR_CONTEXT", "raw")
+
+ANALYSIS_SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": {"type": "string"},
+        "summary": {"type": "string"}
+    },
+    "required": ["analysis", "summary"]
+}
+ANALYSIS_SUMMARY_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": ANALYSIS_SUMMARY_SCHEMA,
+    "temperature": 0.4
+}
+
+def get_summary_prompt(text: str, language: str = "en") -> str:
+    """Build the structured summary prompt in specified language"""
+    language_name = get_language_name(language)
+        
+    return f"""
+        As a medical expert, analyze this medical text and provide a structured summary in {language_name}.
+
+        **Medical Text:** {text}
+
+        Please respond ONLY in {language_name} and provide a comprehensive summary including:
+        - **Patient Information** (if available)
+        - **Key Findings**
+        - **Test Results**
+        - **Medications/Treatments**
+        - **Recommendations**
+        - **Important Notes**
+
+        Format the response clearly with proper medical terminology in {language_name}.
+        Ensure the entire response is in {language_name}, including section headers.
+        """
+
+async def summarize_text(text: str, language: str = "en") -> str:
+    """Summarize medical text using Gemini in specified language"""
+    if not GEMINI_API_KEY:
+        return "Gemini API key not configured for summarization."
+
+    try:
+        return await generate_text_async(get_summary_prompt(text, language), stage_name="summary_llm")
+    except Exception as e:
+        return f"Summarization error: {str(e)}"
+
+def build_combined_text(transcript_text: str, extracted_text: str, lab_values: list = None, other_text: str = None) -> str:
+    """Combine all available text for analysis"""
+    combined_text = ""
+
+    if transcript_text:
+        combined_text += f"PATIENT AUDIO TRANSCRIPTION:\n{transcript_text}\n\n"
+
+    if lab_values and WORKFLOW_OCR_CONTEXT == "structured":
+        # Rows a result was parsed from are already in the table; OCR keeps the rest of the
+        # report as other_text. Without it, the full text is sent
+        combined_text += f"LAB RESULTS (extracted from the medical document):\n{format_lab_values(lab_values)}\n\n"
+        other_text = extracted_text if other_text is None else other_text
+        if other_text:
+            combined_text += f"OTHER DOCUMENT TEXT (OCR):\n{other_text}\n\n"
+    elif extracted_text:
+        combined_text += f"MEDICAL DOCUMENT TEXT (OCR):\n{extracted_text}\n\n"
+
+    return combined_text
+
+async def fit_to_budget(text: str) -> tuple:
+    """compact_text, but a failed condense call falls back to the full text"""
+    try:
+        return await compact_text(text)
+    except Exception:
+        logger.exception("Prompt compaction failed, sending the full text")
+        tokens = count_tokens(text)
+        return text, {"tokens_in": tokens, "tokens_out": tokens, "compacted": False}
+
+async def prepare_analysis_text(response_data: dict, transcript_text: str, extracted_text: str,
+                                lab_values: list = None, other_text: str = None) -> str:
+    """Clean the transcript, dedupe the OCR text, build the combined text and fit it to the token budget"""
+    transcript = clean_transcript(transcript_text)
+    document = dedupe_lines(extracted_text)
+    if other_text is not None:
+        other_text = dedupe_lines(other_text)
+    combined_text, budget_info = await fit_to_budget(build_combined_text(transcript, document, lab_values, other_text))
+
+    response_data["token_counts"] = {
+        "transcript": count_tokens(transcript_text),
+        "transcript_cleaned": count_tokens(transcript),
+        "document": count_tokens(extracted_text),
+        "document_deduped": count_tokens(document),
+        "analysis_input": budget_info["tokens_in"],
+        "analysis_input_sent": budget_info["tokens_out"],
+        "compacted": budget_info["compacted"]
+    }
+    return combined_text
+
+def record_output_tokens(response_data: dict):
+    token_counts = response_data.setdefault("token_counts", {})
+    token_counts["analysis_output"] = count_tokens(response_data.get("chatbot_reply", ""))
+    token_counts["summary_output"] = count_tokens(response_data.get("summary", ""))
+
+def get_medical_analysis_prompt(combined_text: str, language: str = "en") -> str:
+    """Create comprehensive medical analysis prompt"""
+    language_name = get_language_name(language)
+
+    return f"""
+As an expert medical AI assistant, analyze the following medical information and provide a comprehensive professional assessment:
+
+{combined_text}
+
+Please provide a detailed medical analysis in {language_name} including:
+
+1. **Patient Information Summary** (if available from the data)
+2. **Primary Symptoms Analysis** (from audio/documents)
+3. **Key Medical Findings** (test results, measurements, observations)
+4. **Clinical Assessment** (potential diagnoses based on symptoms/findings)
+5. **Recommendations** (suggested actions, follow-up care, lifestyle changes)
+6. **Important Warnings** (urgent concerns, contraindications, precautions)
+7. **Additional Notes** (relevant medical context or considerations)
+
+Format your response in clear, professional medical language suitable for healthcare professionals.
+Use proper medical terminology and provide evidence-based analysis.
+Respond entirely in: {language_name}
+"""
+
+def get_analysis_summary_prompt(combined_text: str, language: str = "en") -> str:
+    """Medical analysis prompt that also asks for the structured summary, as JSON"""
+    language_name = get_language_name(language)
+
+    return f"""{get_medical_analysis_prompt(combined_text, language)}
+Return a JSON object with two fields:
+- "analysis": the detailed medical analysis described above, formatted in Markdown
+- "summary": a structured summary of the medical data and your analysis in {language_name}, with
+  **Patient Information**, **Key Findings**, **Test Results**, **Medications/Treatments**,
+  **Recommendations** and **Important Notes** sections
+
+Both fields must be entirely in {language_name}, including section headers.
+"""
+
+async def analyze_and_summarize(combined_text: str, language: str = "en") -> dict:
+    """STEP 3 + STEP 4 in one structured Gemini call - {"analysis", "summary"}"""
+    response_text = await generate_text_async(
+        get_analysis_summary_prompt(combined_text, language),
+        generation_config=ANALYSIS_SUMMARY_CONFIG,
+        stage_name="analysis_summary_llm"
+    )
+    result = json.loads(response_text)
+    return {"analysis": result["analysis"], "summary": result["summary"]}
+
+async def summarize_text_stream(text: str, language: str = "en"):
+    """Streaming variant of summarize_text - yields text chunks"""
+    if not GEMINI_API_KEY:
+        yield "Gemini API key not configured for summarization."
+        return
+
+    try:
+        async for chunk in stream_text_async(get_summary_prompt(text, language), stage_name="summary_llm"):
+            yield chunk
+    except Exception as e:
+        yield f"Summarization error: {str(e)}"
+
+def build_full_analysis(combined_text: str, chatbot_reply: str) -> str:
+    """Combine all information for summary"""
+    return f"""
+MEDICAL DATA:
+{combined_text}
+
+AI ANALYSIS:
+{chatbot_reply}
+"""
+
+def transcribe_upload(audio_bytes: bytes) -> dict:
+    """Transcribe uploaded audio bytes (blocking, runs on audio_executor)"""
+    # Decoded in memory - no temp files between the upload and Whisper
+    transcript_result = enhanced_speech.transcribe_audio(audio_bytes)
+
+    if transcript_result and isinstance(transcript_result, dict):
+        transcript_text = transcript_result.get("text", "").strip()
+        return {
+            "transcription": transcript_text,
+            "text": transcript_text,
+            "cache_hit": transcript_result.get("cache_hit", False)
+        }
+    return {"transcription": "Transcription failed - invalid result format", "text": ""}
+
+def ocr_upload(image_bytes: bytes) -> dict:
+    """Run OCR on uploaded image bytes (blocking, runs on ocr_executor)"""
+    ocr_result = enhanced_ocr.extract_text(io.BytesIO(image_bytes))
+
+    if not (ocr_result and isinstance(ocr_result, dict)):
+        return {"extracted_text": "OCR failed - invalid result format", "text": "", "formatted_report": ""}
+
+    extracted_text = ocr_result.get("text", "").strip()
+
+    # Format medical report
+    try:
+        formatted_report = enhanced_ocr.format_medical_report(ocr_result)
+    except Exception:
+        formatted_report = extracted_text
+
+    return {
+        "extracted_text": extracted_text,
+        "text": extracted_text,
+        "formatted_report": formatted_report,
+        "lab_values": ocr_result.get("lab_values", []),
+        "other_text": ocr_result.get("other_text"),
+        "cache_hit": ocr_result.get("cache_hit", False)
+    }
+
+def apply_transcription_stage(response_data: dict, audio_stage: dict):
+    response_data["transcription"] = audio_stage["transcription"]
+    response_data.setdefault("cache_hits", {})["transcription"] = audio_stage.get("cache_hit", False)
+
+def apply_ocr_stage(response_data: dict, ocr_result: dict):
+    response_data["extracted_text"] = ocr_result["extracted_text"]
+    response_data["formatted_report"] = ocr_result["formatted_report"]
+    response_data["lab_values"] = ocr_result.get("lab_values", [])
+    response_data.setdefault("cache_hits", {})["ocr"] = ocr_result.get("cache_hit", False)
+
+async def multi_call_analysis(response_data: dict, combined_text: str, language: str):
+    """STEP 3 + STEP 4 as separate calls: chatbot analysis (may search), then the summary"""
+    # STEP 3: MEDICAL ANALYSIS WITH CHATBOT
+    try:
+        if combined_text.strip():
+            medical_prompt = get_medical_analysis_prompt(combined_text, language)
+            
+            # LLM analysis starts only once both upload stages have finished
+            chatbot_result = await enhanced_chatbot_response_async(medical_prompt, language)
+            
+            if chatbot_result and isinstance(chatbot_result, dict):
+                response_data["chatbot_reply"] = chatbot_result.get("response", "")
+                response_data["sources"] = chatbot_result.get("sources", [])
+                response_data["search_performed"] = chatbot_result.get("search_performed", False)
+            else:
+                response_data["chatbot_reply"] = "Medical analysis failed - chatbot error"
+            
+        else:
+            response_data["chatbot_reply"] = NO_MEDICAL_DATA_MESSAGE
+            response_data["sources"] = []
+            response_data["search_performed"] = False
+    
+    except Exception as e:
+        logger.exception("Medical analysis failed")
+        response_data["chatbot_reply"] = f"Medical analysis error: {str(e)}"
+        response_data["sources"] = []
+        response_data["search_performed"] = False
+    
+    # STEP 4: GENERATE FINAL SUMMARY
+    try:
+        if combined_text.strip() and response_data["chatbot_reply"]:
+            full_analysis, budget_info = await fit_to_budget(
+                build_full_analysis(combined_text, response_data["chatbot_reply"])
+            )
+            response_data.setdefault("token_counts", {})["summary_input_sent"] = budget_info["tokens_out"]
+
+            summary_text = await summarize_text(full_analysis, language)
+            response_data["summary"] = summary_text
+            
+        else:
+            response_data["summary"] = INSUFFICIENT_DATA_MESSAGE
+    
+    except Exception as e:
+        logger.exception("Summary generation failed")
+        response_data["summary"] = f"Summary generation error: {str(e)}"
+
+
+async def run_analysis_stage(response_data: dict, combined_text: str, language: str, analysis_mode=None):
+    """STEP 3 + STEP 4: fill chatbot_reply, sources and summary in response_data"""
+    if analysis_mode not in ANALYSIS_MODES:
+        analysis_mode = WORKFLOW_ANALYSIS_MODE
+    response_data["analysis_mode"] = analysis_mode
+
+    if analysis_mode == "single_call" and combined_text.strip() and GEMINI_API_KEY:
+        # STEP 3 + STEP 4: analysis and summary from a single structured call
+        try:
+            result = await analyze_and_summarize(combined_text, language)
+            response_data["chatbot_reply"] = result["analysis"] + get_disclaimer(language)
+            response_data["summary"] = result["summary"]
+            record_output_tokens(response_data)
+            return
+        except Exception:
+            logger.exception("Single-call analysis failed, falling back to multi-call")
+            response_data["analysis_mode"] = "multi_call"
+
+    await multi_call_analysis(response_data, combined_text, language)
+    record_output_tokens(response_data)